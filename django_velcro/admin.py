@@ -1,14 +1,27 @@
+from django import forms
 from django.apps import apps
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.contenttypes.forms import BaseGenericInlineFormSet
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import connections, models, router
+from django.template.response import TemplateResponse
 
 from genericadmin.admin import (GenericAdminModelAdmin, GenericStackedInline,
     GenericTabularInline)
 
-from .app_settings import (VELCRO_GENERICADMIN, VELCRO_INLINES,
-    VELCRO_INLINES_EXTRA, VELCRO_INLINES_MAX_NUM, VELCRO_INLINES_TABULAR,
-    VELCRO_METADATA, VELCRO_RELATIONSHIPS)
-from .utils import (get_relationship_inlines, plural_velcro_type,
-    singular_velcro_type)
+from .app_settings import (VELCRO_ADMIN_ACTIONS, VELCRO_ADMIN_LARGE_TABLES,
+    VELCRO_GENERICADMIN, VELCRO_INLINES, VELCRO_INLINES_EXTRA,
+    VELCRO_INLINES_MAX_NUM, VELCRO_INLINES_TABULAR, VELCRO_METADATA,
+    VELCRO_RELATIONSHIPS)
+from .utils import (_hydrate, bulk_add_related_content,
+    bulk_remove_related_content, get_related_types, get_relationship_inlines,
+    get_velcro_type, plural_velcro_type, singular_velcro_type)
+
+
+AFTER_VAR = 'after'
 
 
 def _startup():
@@ -30,6 +43,336 @@ def _startup():
             model_name = model_metadata['model']
             add_velcro_to_third_party_admin(app_name, model_name, velcro_type)
 
+def _relate_or_unrelate_selected(
+        modeladmin, request, queryset, add_or_remove):
+    """
+    Admin action view that relates the selected objects to a target object
+    or unrelates them from it, depending on whether 'add_or_remove' equals
+    'add' or 'remove'. The target is chosen on an intermediate page; the
+    relationships are then added or removed in bulk.
+    """
+    velcro_type = get_velcro_type(queryset.model)
+
+    if request.POST.get('apply'):
+        form = RelatedTargetForm(velcro_type, request.POST)
+        if form.is_valid():
+            target = form.cleaned_data['target']
+            try:
+                if add_or_remove == 'add':
+                    count = bulk_add_related_content(queryset, target)
+                    message = '{} relationships to "{}" added.'
+                else:
+                    count = bulk_remove_related_content(queryset, target)
+                    message = '{} relationships to "{}" removed.'
+            except ValueError as e:
+                modeladmin.message_user(request, str(e), messages.ERROR)
+            else:
+                modeladmin.message_user(
+                    request, message.format(count, target), messages.SUCCESS)
+            return None
+    else:
+        form = RelatedTargetForm(velcro_type)
+
+    opts = modeladmin.model._meta
+    if add_or_remove == 'add':
+        title = 'Relate selected {} to an object'
+    else:
+        title = 'Unrelate selected {} from an object'
+    context = dict(
+        modeladmin.admin_site.each_context(request),
+        action=request.POST.get('action'),
+        action_checkbox_name=ACTION_CHECKBOX_NAME,
+        add_or_remove=add_or_remove,
+        form=form,
+        opts=opts,
+        selected=queryset.values_list('pk', flat=True),
+        title=title.format(opts.verbose_name_plural),
+    )
+    return TemplateResponse(
+        request, 'admin/django_velcro/relate_selected.html', context)
+
+def estimate_row_count(model, using):
+    """
+    Return the number of rows in a model's table, estimated from planner
+    statistics on PostgreSQL and MySQL, so large tables aren't scanned.
+    Other databases, and tables without statistics, get an exact count.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+        params = [connection.ops.quote_name(table)]
+    elif connection.vendor == 'mysql':
+        sql = ('SELECT table_rows FROM information_schema.tables '
+               'WHERE table_schema = DATABASE() AND table_name = %s')
+        params = [table]
+    else:
+        sql = None
+
+    estimate = None
+    if sql is not None:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is not None and row[0] is not None and row[0] > 0:
+            estimate = int(row[0])
+
+    if estimate is None:
+        estimate = model._default_manager.db_manager(using).count()
+    return estimate
+
+class KeysetChangeList(ChangeList):
+    """
+    Change list for large relationship tables. Rows are ordered by primary
+    key and paged with an 'after' parameter holding the last primary key of
+    the previous page, so pages are read with an index range scan instead
+    of 'OFFSET'. Counts are estimated instead of counted. An invalid
+    'after' value shows the first page.
+    """
+    def get_queryset(self, request):
+        self.after = self.params.pop(AFTER_VAR, None)
+        if self.after:
+            try:
+                self.after = self.model._meta.pk.to_python(self.after)
+            except ValidationError:
+                self.after = None
+        return super().get_queryset(request)
+
+    def get_ordering(self, request, queryset):
+        return ['pk']
+
+    def get_results(self, request):
+        queryset = self.queryset
+        if self.after:
+            queryset = queryset.filter(pk__gt=self.after)
+
+        results = list(queryset[:self.list_per_page + 1])
+        self.result_list = results[:self.list_per_page]
+        self.next_after = None
+        if len(results) > self.list_per_page:
+            self.next_after = self.result_list[-1].pk
+
+        using = router.db_for_read(self.model)
+        self.full_result_count = estimate_row_count(self.model, using)
+        if self.queryset.query.where:
+            self.result_count = len(self.result_list)
+        else:
+            self.result_count = self.full_result_count
+
+        self.can_show_all = False
+        self.multi_page = bool(self.after or self.next_after)
+        self.paginator = None
+        self.show_admin_actions = bool(self.result_list)
+        self.show_full_result_count = False
+        self.first_page_query = self.get_query_string(remove=[AFTER_VAR])
+        self.next_page_query = self.get_query_string({
+            AFTER_VAR: self.next_after})
+
+class LargeTableAdminMixin(object):
+    """
+    Relationship admin for tables with millions of rows: estimated counts,
+    keyset pagination by primary key, labels shown from the indexed
+    'order_by' column and case-insensitive search limited to label
+    prefixes. Labels start with the upper-cased content type name, e.g.
+    'DATA: ...'.
+
+    To use it for all relationship admins, add to 'settings.py':
+
+        VELCRO_ADMIN_LARGE_TABLES = True
+    """
+    change_list_template = 'admin/django_velcro/keyset_change_list.html'
+    list_display = ('order_by',)
+    search_fields = ('order_by',)
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.filter(order_by__istartswith=search_term), False
+
+class RelatedTargetForm(forms.Form):
+    """
+    Form for choosing the target object of the relate and unrelate admin
+    actions, among the models of the related types of a velcro type.
+    """
+    content_type = forms.ModelChoiceField(
+        queryset=ContentType.objects.none(), label='Type')
+    object_pk = forms.IntegerField(min_value=0, label='Object ID')
+
+    def __init__(self, velcro_type, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['content_type'].queryset = ContentType.objects.filter(
+            pk__in=[
+                ContentType.objects.get_for_model(apps.get_model(
+                    model_metadata['app_label'], model_metadata['model'])).pk
+                for related_type in get_related_types(velcro_type)
+                for model_metadata in VELCRO_METADATA[related_type]['apps']
+            ])
+
+    def clean(self):
+        cleaned_data = super().clean()
+        content_type = cleaned_data.get('content_type')
+        object_pk = cleaned_data.get('object_pk')
+        if content_type is not None and object_pk is not None:
+            try:
+                cleaned_data['target'] = (
+                    content_type.get_object_for_this_type(pk=object_pk))
+            except ObjectDoesNotExist:
+                raise forms.ValidationError(
+                    '{} with ID {} does not exist.'.format(
+                        content_type.name.capitalize(), object_pk))
+        return cleaned_data
+
+class RelationshipQuerySetMixin(object):
+    """
+    Fetch the content types and content objects shown by relationship
+    admins and inlines in bulk, so the number of queries doesn't grow with
+    the number of relationships listed.
+    """
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        velcro_fields = self.model.velcro_fields
+        return queryset.select_related(
+            *[ct_field for ct_field, _, _ in velcro_fields]).prefetch_related(
+            *[object_field for _, _, object_field in velcro_fields])
+
+class VelcroInlineFormSet(BaseGenericInlineFormSet):
+    """
+    Inline formset whose forms share the choices of their content type
+    fields, so content types are queried once per field instead of once
+    per form.
+    """
+    def __init__(self, *args, **kwargs):
+        self._shared_choices = {}
+        super().__init__(*args, **kwargs)
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        for name, field in form.fields.items():
+            queryset = getattr(field, 'queryset', None)
+            if queryset is None or queryset.model is not ContentType:
+                continue
+            if name not in self._shared_choices:
+                self._shared_choices[name] = list(field.choices)
+            field.choices = self._shared_choices[name]
+        return form
+
+    def save_existing(self, form, instance, commit=True):
+        # Content objects cached for display belong to the loaded ends, so
+        # they are dropped for moved ends before the label is rebuilt
+        loaded_endpoints = getattr(instance, '_loaded_endpoints', None)
+        if loaded_endpoints is not None:
+            for (_, _, object_field), endpoint, loaded_endpoint in zip(
+                    instance.velcro_fields, instance.get_endpoints(),
+                    loaded_endpoints):
+                if endpoint != loaded_endpoint:
+                    instance.__dict__.pop(
+                        getattr(type(instance), object_field).cache_attr,
+                        None)
+        return super().save_existing(form, instance, commit=commit)
+
+class SymmetricInlineFormSet(VelcroInlineFormSet):
+    """
+    Inline formset for relationships with matching velcro types that lists
+    the relationships of an object whichever end it is on, with one query.
+    Forms always edit the other end in the second pair of fields, so rows
+    with the object at the second end are shown through a copy with its
+    ends turned around. Changes and deletions are applied to the stored
+    relationships, which keep their orientation. The objects at the other
+    ends are fetched in bulk. New relationships are saved with the object
+    first.
+    """
+    def __init__(self, data=None, files=None, instance=None, save_as_new=None,
+                 prefix=None, queryset=None, **kwargs):
+        if queryset is None:
+            queryset = self.model._default_manager.all()
+        self._unfiltered_queryset = queryset
+        super().__init__(
+            data=data, files=files, instance=instance,
+            save_as_new=save_as_new, prefix=prefix, queryset=queryset,
+            **kwargs)
+
+    def get_queryset(self):
+        """
+        Return the relationships of the object as a list, not a QuerySet:
+        rows with the object at the second end are unsaved copies that
+        can't be expressed as a query. The formset only indexes, counts
+        and iterates it; filter the 'queryset' argument instead of the
+        result to narrow the rows shown.
+        """
+        if hasattr(self, '_symmetric_queryset'):
+            return self._symmetric_queryset
+
+        self._symmetric_queryset = []
+        self._reversed_relationships = {}
+        if self.instance is None or self.instance.pk is None:
+            return self._symmetric_queryset
+
+        content_type = ContentType.objects.get_for_model(
+            self.instance, for_concrete_model=self.for_concrete_model)
+        instance_key = (content_type.pk, self.instance.pk)
+        relationships = list(self._unfiltered_queryset.prefetch_related(
+            None).filter(
+            models.Q(content_type_1=content_type,
+                     object_pk_1=self.instance.pk) |
+            models.Q(content_type_2=content_type,
+                     object_pk_2=self.instance.pk)).order_by('order_by', 'pk'))
+
+        objects = _hydrate(
+            endpoint
+            for relationship in relationships
+            for endpoint in relationship.get_endpoints()
+            if endpoint != instance_key)
+        for relationship in relationships:
+            endpoints = relationship.get_endpoints()
+            if endpoints[0] == instance_key:
+                view, other_key = relationship, endpoints[1]
+            else:
+                view, other_key = self._reversed(relationship), endpoints[0]
+                self._reversed_relationships[relationship.pk] = relationship
+            other = objects.get(other_key)
+            view.content_object_1 = self.instance
+            if other is not None:
+                view.content_object_2 = other
+            self._symmetric_queryset.append(view)
+
+        return self._symmetric_queryset
+
+    def _reversed(self, relationship):
+        """
+        Return an unsaved copy of a relationship with its ends turned
+        around, for display and editing in a form.
+        """
+        view = self.model(pk=relationship.pk, order_by=relationship.order_by)
+        view.content_type_1 = relationship.content_type_2
+        view.object_pk_1 = relationship.object_pk_2
+        view.content_type_2 = relationship.content_type_1
+        view.object_pk_2 = relationship.object_pk_1
+        view._state.adding = False
+        view._state.db = relationship._state.db
+        return view
+
+    def save_existing(self, form, instance, commit=True):
+        relationship = self._reversed_relationships.get(instance.pk)
+        if relationship is not None:
+            relationship.content_type_1 = instance.content_type_2
+            relationship.object_pk_1 = instance.object_pk_2
+            form.instance = relationship
+        return super().save_existing(form, form.instance, commit=commit)
+
+    def save_existing_objects(self, commit=True):
+        # Reversed rows are deleted through the stored relationship, so the
+        # removal is logged with its own orientation
+        for form in self.deleted_forms:
+            relationship = self._reversed_relationships.get(form.instance.pk)
+            if relationship is not None:
+                form.instance = relationship
+        return super().save_existing_objects(commit=commit)
+
 def add_velcro_to_third_party_admin(app_name, model_name, velcro_type):
     """
     Update third party admin models with inline classes for relationships
@@ -44,6 +387,13 @@ def add_velcro_to_third_party_admin(app_name, model_name, velcro_type):
     'settings.py':
 
         VELCRO_INLINES = False
+
+    Admin actions to relate the selected objects to an object, or unrelate
+    them from it, in bulk ('relate_selected' and 'unrelate_selected') are
+    added unless the admin model disables actions. To prevent this, add to
+    'settings.py':
+
+        VELCRO_ADMIN_ACTIONS = False
     """
     model = apps.get_model(app_name, model_name)
     orig_model_admin = admin.site._registry[model].__class__
@@ -61,14 +411,16 @@ def add_velcro_to_third_party_admin(app_name, model_name, velcro_type):
     else:
         inlines = orig_inlines
 
+    typedict = {
+        '__module__': __name__,
+        'inlines': inlines,
+    }
+
+    if VELCRO_ADMIN_ACTIONS and orig_model_admin.actions is not None:
+        typedict['actions'] = [relate_selected, unrelate_selected]
+
     updated_model_admin = type(
-        orig_model_admin.__name__,
-        model_admin,
-        {
-            '__module__': __name__,
-            'inlines': inlines,
-        }
-    )
+        orig_model_admin.__name__, model_admin, typedict)
 
     admin.site.unregister(model)
     admin.site.register(model, updated_model_admin)
@@ -106,20 +458,35 @@ def generate_inline_model(
 
     Equivalent To:
 
-        class DataToPublicationsRelationshipInline(GenericTabularInline):
+        class DataToPublicationsRelationshipInline(
+                RelationshipQuerySetMixin, GenericTabularInline):
             model = DataPublicationsRelationship
+            formset = VelcroInlineFormSet
             ct_field = 'data_content_type'
             ct_fk_field = 'data_object_pk'
             fields = ['publication_content_type', 'publication_object_pk']
             ordering = ['publication_content_type', 'order_by']
             verbose_name = 'Related Publication'
             verbose_name_plural = 'Related Publications'
+
+    Relationships with matching velcro types get a single inline that lists
+    relationships in both directions (see 'SymmetricInlineFormSet'). For
+    them, 'reverse' only adds a deprecated '...RelationshipReverseInline'
+    alias of that inline, e.g. 'DataToDataRelationshipReverseInline'.
     """
     object_1_velcro_type, object_2_velcro_type = sorted(
         relationship, reverse=reverse)
     klass_name = '{}To{}RelationshipInline'.format(
         object_1_velcro_type.capitalize(), object_2_velcro_type.capitalize())
 
+    if reverse and object_1_velcro_type == object_2_velcro_type:
+        if klass_name not in globals():
+            generate_inline_model(relationship, tabular=tabular)
+        globals()['{}To{}RelationshipReverseInline'.format(
+            object_1_velcro_type.capitalize(),
+            object_2_velcro_type.capitalize())] = globals()[klass_name]
+        return
+
     if tabular:
         inline_style = GenericTabularInline
     else:
@@ -129,45 +496,28 @@ def generate_inline_model(
         'model': eval('{}{}Relationship'.format(
             *sorted(map(lambda x: x.capitalize(), relationship)))),
         '__module__': __name__,
+        'formset': VelcroInlineFormSet,
         'max_num': VELCRO_INLINES_MAX_NUM,
         'verbose_name': 'Related {}'.format(
             singular_velcro_type(object_2_velcro_type)).title(),
     }
 
     if object_1_velcro_type == object_2_velcro_type:
-        if reverse:
-            klass_name = '{}To{}RelationshipReverseInline'.format(
-                object_1_velcro_type.capitalize(),
-                object_2_velcro_type.capitalize())
-            typedict.update({
-                'ct_field': 'content_type_2',
-                'ct_fk_field': 'object_pk_2',
-                'extra': 0,
-                'fields': [
-                    'content_type_1',
-                    'object_pk_1',
-                ],
-                'ordering': [
-                    'order_by',
-                ],
-                'verbose_name_plural': 'Related {} (Reverse)'.format(
-                    plural_velcro_type(object_1_velcro_type)).title(),
-            })
-        else:
-            typedict.update({
-                'ct_field': 'content_type_1',
-                'ct_fk_field': 'object_pk_1',
-                'extra': VELCRO_INLINES_EXTRA,
-                'fields': [
-                    'content_type_2',
-                    'object_pk_2',
-                ],
-                'ordering': [
-                    'order_by',
-                ],
-                'verbose_name_plural': 'Related {} (Forward)'.format(
-                    plural_velcro_type(object_2_velcro_type)).title(),
-            })
+        typedict.update({
+            'ct_field': 'content_type_1',
+            'ct_fk_field': 'object_pk_1',
+            'extra': VELCRO_INLINES_EXTRA,
+            'fields': [
+                'content_type_2',
+                'object_pk_2',
+            ],
+            'formset': SymmetricInlineFormSet,
+            'ordering': [
+                'order_by',
+            ],
+            'verbose_name_plural': 'Related {}'.format(
+                plural_velcro_type(object_2_velcro_type)).title(),
+        })
     else:
         typedict.update({
             'ct_field': '{}_content_type'.format(object_1_velcro_type),
@@ -185,12 +535,15 @@ def generate_inline_model(
                 plural_velcro_type(object_2_velcro_type)).title(),
         })
 
-    klass = type(klass_name, (inline_style,), typedict)
+    klass = type(
+        klass_name, (RelationshipQuerySetMixin, inline_style), typedict)
     globals()[klass_name] = klass
 
 def generate_and_register_admin_model(relationship):
     """
-    Generates and registers an admin model from a relationship tuple.
+    Generates and registers an admin model from a relationship tuple. With
+    'VELCRO_ADMIN_LARGE_TABLES = True', the admin model is built for large
+    tables (see 'LargeTableAdminMixin').
 
     Usage:
 
@@ -198,7 +551,8 @@ def generate_and_register_admin_model(relationship):
 
     Equivalent To:
 
-        class DataPublicationRelationshipAdmin(GenericAdminModelAdmin):
+        class DataPublicationRelationshipAdmin(
+                RelationshipQuerySetMixin, GenericAdminModelAdmin):
             readonly_fields = ['order_by']
         admin.site.register(DataPublicationRelationship, DataPublicationAdmin)
     """
@@ -206,9 +560,13 @@ def generate_and_register_admin_model(relationship):
     model_name = '{}{}Relationship'.format(
         object_1_velcro_type.capitalize(), object_2_velcro_type.capitalize())
     klass_name = '{}Admin'.format(model_name)
+    if VELCRO_ADMIN_LARGE_TABLES:
+        queryset_mixin = LargeTableAdminMixin
+    else:
+        queryset_mixin = RelationshipQuerySetMixin
     klass = type(
         klass_name,
-        (GenericAdminModelAdmin,),
+        (queryset_mixin, GenericAdminModelAdmin),
         {
             '__module__': __name__,
             'readonly_fields': ['order_by'],
@@ -219,5 +577,23 @@ def generate_and_register_admin_model(relationship):
     model = eval(model_name)
     admin.site.register(model, klass)
 
+def relate_selected(modeladmin, request, queryset):
+    """
+    Admin action that relates the selected objects to an object chosen on
+    an intermediate page.
+    """
+    return _relate_or_unrelate_selected(modeladmin, request, queryset, 'add')
+relate_selected.short_description = 'Relate selected %(verbose_name_plural)s'
+
+def unrelate_selected(modeladmin, request, queryset):
+    """
+    Admin action that unrelates the selected objects from an object chosen
+    on an intermediate page.
+    """
+    return _relate_or_unrelate_selected(
+        modeladmin, request, queryset, 'remove')
+unrelate_selected.short_description = (
+    'Unrelate selected %(verbose_name_plural)s')
+
 
 _startup()
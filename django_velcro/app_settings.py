@@ -1,11 +1,33 @@
 from django.conf import settings
 
 
+VELCRO_ADMIN_ACTIONS = getattr(settings, 'VELCRO_ADMIN_ACTIONS', True)
+VELCRO_ADMIN_LARGE_TABLES = getattr(
+    settings, 'VELCRO_ADMIN_LARGE_TABLES', False)
+VELCRO_CACHE = getattr(settings, 'VELCRO_CACHE', 'default')
+VELCRO_CHANGELOG = getattr(settings, 'VELCRO_CHANGELOG', False)
+VELCRO_DATABASE = getattr(settings, 'VELCRO_DATABASE', 'default')
+VELCRO_DATABASE_REPLICAS = getattr(settings, 'VELCRO_DATABASE_REPLICAS', [])
+VELCRO_DATABASE_STICKY_SECONDS = getattr(
+    settings, 'VELCRO_DATABASE_STICKY_SECONDS', 2)
+VELCRO_DEBUG = getattr(settings, 'VELCRO_DEBUG', False)
 VELCRO_GENERICADMIN = getattr(settings, 'VELCRO_GENERICADMIN', True)
+VELCRO_GENERIC_RELATIONS = getattr(settings, 'VELCRO_GENERIC_RELATIONS', True)
+VELCRO_GRAPH_SNAPSHOT = getattr(settings, 'VELCRO_GRAPH_SNAPSHOT', False)
+VELCRO_GRAPH_SNAPSHOT_CHECK_SECONDS = getattr(
+    settings, 'VELCRO_GRAPH_SNAPSHOT_CHECK_SECONDS', 30)
+VELCRO_GRAPH_SNAPSHOT_MAX_AGE = getattr(
+    settings, 'VELCRO_GRAPH_SNAPSHOT_MAX_AGE', 3600)
 VELCRO_INLINES = getattr(settings, 'VELCRO_INLINES', True)
 VELCRO_INLINES_EXTRA = getattr(settings, 'VELCRO_INLINES_EXTRA', 3)
 VELCRO_INLINES_MAX_NUM = getattr(settings, 'VELCRO_INLINES_MAX_NUM', None)
 VELCRO_INLINES_TABULAR = getattr(settings, 'VELCRO_INLINES_TABULAR', True)
 VELCRO_METADATA = getattr(settings, 'VELCRO_METADATA', {})
 VELCRO_METHODS = getattr(settings, 'VELCRO_METHODS', True)
+VELCRO_ORDER_BY_SIGNALS = getattr(settings, 'VELCRO_ORDER_BY_SIGNALS', True)
+VELCRO_RELATED_CACHE = getattr(settings, 'VELCRO_RELATED_CACHE', False)
+VELCRO_RELATED_CACHE_TIMEOUT = getattr(
+    settings, 'VELCRO_RELATED_CACHE_TIMEOUT', 3600)
+VELCRO_RELATIONSHIP_VERSIONS = getattr(
+    settings, 'VELCRO_RELATIONSHIP_VERSIONS', False)
 VELCRO_RELATIONSHIPS = getattr(settings, 'VELCRO_RELATIONSHIPS', [(), ()])
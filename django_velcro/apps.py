@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class DjangoVelcroConfig(AppConfig):
+    name = 'django_velcro'
+    verbose_name = 'Django Velcro'
+
+    def ready(self):
+        from . import signals
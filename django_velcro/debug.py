@@ -0,0 +1,180 @@
+import inspect
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from functools import partial, wraps
+
+from django.db import connections
+
+from .app_settings import VELCRO_DEBUG
+
+
+N_PLUS_ONE_THRESHOLD = 3
+OUTSIDE_VELCRO = ('(outside velcro)', None)
+
+_NUMBER_RE = re.compile(r'\b\d+(\.\d+)?\b')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_IN_LIST_RE = re.compile(r'\bIN \((?:\?, )*\?\)')
+
+_state = threading.local()
+
+
+def _related_type_of(args, kwargs):
+    """
+    Guess the related type(s) a velcro call is about from its arguments:
+    a 'related_type' keyword, or string arguments after the object.
+    """
+    if kwargs.get('related_type'):
+        return kwargs['related_type']
+    related_types = [arg for arg in args[1:] if isinstance(arg, str)]
+    return ', '.join(related_types) or None
+
+def normalize_sql(sql):
+    """
+    Replace literals in a SQL statement with placeholders, so statements
+    that only differ by their parameters compare equal.
+    """
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    return _IN_LIST_RE.sub('IN (...)', sql)
+
+def start_tracing():
+    """
+    Start attributing queries run by the current thread to velcro entry
+    points. Connections must log queries (e.g., with 'force_debug_cursor')
+    for anything to be recorded.
+    """
+    _state.labels = {}
+    _state.stack = []
+
+def stop_tracing():
+    """
+    Stop tracing and return a dict mapping '(database alias, query index)'
+    pairs to the '(entry point, related type)' that ran them.
+    """
+    labels = getattr(_state, 'labels', None) or {}
+    _state.labels = None
+    _state.stack = []
+    return labels
+
+def velcro_trace(func=None, name=None, related_type=None):
+    """
+    Decorator that attributes the queries run by a velcro entry point to
+    it, for the velcro debug panel. Queries are claimed by the innermost
+    traced call and labelled with the chain of traced calls that led to it
+    (e.g., 'velcro_related > get_related_content'). The wrapper keeps the
+    signature of the function, so template tags can be traced too.
+
+    Unless 'VELCRO_DEBUG' is enabled, the function is returned unchanged,
+    so tracing costs nothing in production.
+
+    Usage:
+        @velcro_trace
+        def get_related_content(obj, *related_types, **kwargs):
+            ...
+
+        method = velcro_trace(
+            method, name='get_velcro_publication_content',
+            related_type='publication')
+    """
+    if func is None:
+        return partial(velcro_trace, name=name, related_type=related_type)
+    if not VELCRO_DEBUG:
+        return func
+
+    entry_point = name or func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        labels = getattr(_state, 'labels', None)
+        if labels is None:
+            return func(*args, **kwargs)
+
+        start = {
+            connection.alias: len(connection.queries_log)
+            for connection in connections.all()
+        }
+        _state.stack.append(entry_point)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            label = (
+                ' > '.join(_state.stack),
+                related_type or _related_type_of(args, kwargs),
+            )
+            _state.stack.pop()
+            for connection in connections.all():
+                for i in range(start.get(connection.alias, 0),
+                               len(connection.queries_log)):
+                    labels.setdefault((connection.alias, i), label)
+
+    wrapper.__signature__ = inspect.signature(func)
+    return wrapper
+
+def build_report(queries, labels, relationship_tables):
+    """
+    Summarize traced queries for the debug panel.
+
+    'queries' is a list of '(database alias, query index, query)' tuples,
+    where each query is a dict with 'sql' and 'time' keys as logged by
+    Django, and 'labels' is the result of 'stop_tracing()'.
+
+    Returns a dict with:
+      - 'groups': a list of dicts with the 'entry_point', 'related_type',
+        'count', 'time' and 'queries' of each group, in order of first query
+      - 'n_plus_one': a list of dicts with the 'entry_point',
+        'related_type', 'count' and normalized 'sql' of statements repeated
+        at least 'N_PLUS_ONE_THRESHOLD' times within a group
+      - 'tables': a list of '(table, count, time)' tuples for relationship
+        tables, slowest first
+      - 'count' and 'time': totals for queries run by velcro entry points
+    """
+    groups = OrderedDict()
+    repeats = defaultdict(int)
+    tables = defaultdict(lambda: [0, 0.0])
+
+    for alias, index, query in queries:
+        label = labels.get((alias, index), OUTSIDE_VELCRO)
+        if label == OUTSIDE_VELCRO:
+            continue
+        sql = query['sql']
+        time = float(query['time'])
+
+        group = groups.setdefault(label, {
+            'entry_point': label[0],
+            'related_type': label[1],
+            'count': 0,
+            'time': 0.0,
+            'queries': [],
+        })
+        group['count'] += 1
+        group['time'] += time
+        group['queries'].append({'alias': alias, 'sql': sql, 'time': time})
+
+        repeats[(label, normalize_sql(sql))] += 1
+
+        for table in relationship_tables:
+            if table in sql:
+                tables[table][0] += 1
+                tables[table][1] += time
+
+    n_plus_one = [
+        {
+            'entry_point': label[0],
+            'related_type': label[1],
+            'count': count,
+            'sql': sql,
+        }
+        for (label, sql), count in repeats.items()
+        if count >= N_PLUS_ONE_THRESHOLD
+    ]
+
+    return {
+        'groups': list(groups.values()),
+        'n_plus_one': sorted(n_plus_one, key=lambda r: -r['count']),
+        'tables': sorted(
+            ((table, count, time) for table, (count, time) in tables.items()),
+            key=lambda t: -t[2]),
+        'count': sum(group['count'] for group in groups.values()),
+        'time': sum(group['time'] for group in groups.values()),
+    }
@@ -0,0 +1,108 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import BooleanField, F, IntegerField
+from django.db.models.expressions import Expression
+
+
+class RelatedSubquery(Expression):
+    """
+    Base class for expressions that compile to a subquery on the
+    relationship table between the annotated model and a related type,
+    correlated with the primary key of the outer query.
+    """
+    template = None
+
+    def __init__(self, related_type, output_field=None):
+        super().__init__(output_field=output_field)
+        self.related_type = related_type
+        self.outer_pk = F('pk')
+
+    def __repr__(self):
+        return "{}('{}')".format(self.__class__.__name__, self.related_type)
+
+    def get_source_expressions(self):
+        return [self.outer_pk]
+
+    def set_source_expressions(self, exprs):
+        self.outer_pk, = exprs
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None,
+                           summarize=False, for_save=False):
+        from .utils import (get_related_types, get_relationship_class,
+            get_velcro_type)
+
+        velcro_type = get_velcro_type(query.model)
+        if self.related_type not in get_related_types(velcro_type):
+            raise ValueError(
+                "'{}' is not a related velcro type for '{}'.".format(
+                    self.related_type, velcro_type))
+
+        c = super().resolve_expression(
+            query, allow_joins, reuse, summarize, for_save)
+        c.velcro_type = velcro_type
+        c.relationship_class = get_relationship_class(
+            velcro_type, self.related_type)
+        c.content_type = ContentType.objects.get_for_model(query.model)
+        return c
+
+    def as_sql(self, compiler, connection, template=None):
+        from .utils import _endpoint_orientations, _quoted_column
+
+        outer_pk_sql, outer_pk_params = compiler.compile(self.outer_pk)
+        alias = 'velcro_subquery'
+        conditions = []
+        params = []
+        for own, other in _endpoint_orientations(
+                self.relationship_class, self.velcro_type):
+            conditions.append('({} = %s AND {} = {})'.format(
+                _quoted_column(
+                    self.relationship_class, connection, own[0], alias),
+                _quoted_column(
+                    self.relationship_class, connection, own[1], alias),
+                outer_pk_sql,
+            ))
+            params.extend([self.content_type.pk] + list(outer_pk_params))
+
+        sql = (template or self.template).format(
+            table=connection.ops.quote_name(
+                self.relationship_class._meta.db_table),
+            alias=alias,
+            where=' OR '.join(conditions),
+        )
+        return sql, params
+
+class VelcroCount(RelatedSubquery):
+    """
+    Number of relationships between each object and objects of a related
+    type.
+
+    Usage:
+        DataSet.objects.annotate(publication_count=VelcroCount('publication'))
+        DataSet.objects.annotate(
+            publication_count=VelcroCount('publication')).filter(
+            publication_count__gte=5)
+    """
+    template = '(SELECT COUNT(*) FROM {table} {alias} WHERE {where})'
+
+    def __init__(self, related_type):
+        super().__init__(related_type, output_field=IntegerField())
+
+class VelcroExists(RelatedSubquery):
+    """
+    Whether each object has any relationships with objects of a related
+    type.
+
+    Usage:
+        DataSet.objects.annotate(has_publications=VelcroExists('publication'))
+        DataSet.objects.annotate(
+            has_publications=VelcroExists('publication')).filter(
+            has_publications=True)
+    """
+    template = 'EXISTS (SELECT 1 FROM {table} {alias} WHERE {where})'
+
+    def __init__(self, related_type):
+        super().__init__(related_type, output_field=BooleanField())
+
+    def as_oracle(self, compiler, connection):
+        return self.as_sql(compiler, connection, template=(
+            'CASE WHEN EXISTS (SELECT 1 FROM {table} {alias} WHERE {where}) '
+            'THEN 1 ELSE 0 END'))
@@ -0,0 +1,378 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from operator import itemgetter
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.db import models, router, transaction
+
+from .app_settings import (VELCRO_CACHE, VELCRO_CHANGELOG,
+    VELCRO_GRAPH_SNAPSHOT, VELCRO_GRAPH_SNAPSHOT_CHECK_SECONDS,
+    VELCRO_GRAPH_SNAPSHOT_MAX_AGE)
+from .models import RelationshipChange
+from .routers import mark_written
+
+
+GRAPH_RELOAD_KEY = 'django_velcro:graph_reload'
+GRAPH_VERSION_KEY = 'django_velcro:graph_version'
+REPLAY_BATCH_SIZE = 1000
+
+_graph = None
+_lock = threading.RLock()
+_pending = threading.local()
+
+
+def _pack(key):
+    """
+    Pack a '(content_type_id, object_pk)' pair into a single integer.
+    """
+    return (key[0] << 32) | key[1]
+
+def _unpack(packed):
+    """
+    Unpack an integer made by '_pack()' into a '(content_type_id, object_pk)'
+    pair.
+    """
+    return (packed >> 32, packed & 0xffffffff)
+
+def _apply_updates(updates):
+    """
+    Apply committed '(relationship_class, op, endpoints)' updates to the
+    graph snapshot, if one is loaded, and tell other processes that the
+    graph has changed by incrementing the graph version.
+
+    If the version was the one the snapshot last saw, no other process has
+    changed the graph in between, so the snapshot takes the new version and
+    doesn't reload to pick up its own changes.
+    """
+    version = _increment_graph_version()
+    if _graph is not None:
+        with _lock:
+            for relationship_class, op, endpoints in updates:
+                for pair in endpoints:
+                    _graph.apply(relationship_class, op, pair)
+            if version is not None and _graph._version == version - 1:
+                _graph._version = version
+
+def _increment_graph_version():
+    """
+    Atomically increment the graph version in the cache and return it, or
+    return 'None' if there was no version to increment (e.g., because it
+    was evicted), in which case a new one is started.
+    """
+    cache = caches[VELCRO_CACHE]
+    try:
+        return cache.incr(GRAPH_VERSION_KEY)
+    except ValueError:
+        cache.add(GRAPH_VERSION_KEY, 0, None)
+        return None
+
+def _pending_updates():
+    """
+    Return the graph updates of this thread that wait for their transaction
+    to commit, as a dict of lists keyed by database alias.
+    """
+    if not hasattr(_pending, 'updates'):
+        _pending.updates = {}
+    return _pending.updates
+
+def _resolve_pending_updates():
+    """
+    Drop pending graph updates whose transaction has ended outside
+    'graph_atomic()', and invalidate the graph. Whether that transaction
+    was committed or rolled back isn't known, so the graph is reloaded
+    from the database rather than updated.
+    """
+    updates = _pending_updates()
+    for using in list(updates):
+        if not transaction.get_connection(using).in_atomic_block:
+            del updates[using]
+            invalidate_graph()
+
+def _sides(relationship_class, endpoints):
+    """
+    Return '(velcro_type, own_key, other_key)' tuples for both directions
+    of a relationship, given its '(content_type_id, object_pk)' endpoints.
+    """
+    velcro_type_1, velcro_type_2 = relationship_class.velcro_types
+    key_1, key_2 = _pack(endpoints[0]), _pack(endpoints[1])
+    return [(velcro_type_1, key_1, key_2), (velcro_type_2, key_2, key_1)]
+
+def get_graph():
+    """
+    Return the relationship graph snapshot of this process, loading it on
+    first use and refreshing it when due, or 'None' if snapshots are
+    disabled.
+    """
+    global _graph
+
+    if not VELCRO_GRAPH_SNAPSHOT:
+        return None
+
+    _resolve_pending_updates()
+    if _graph is None:
+        with _lock:
+            if _graph is None:
+                graph = RelationshipGraph()
+                graph.load()
+                _graph = graph
+    _graph.refresh_if_due()
+    return _graph
+
+@contextmanager
+def graph_atomic(using, savepoint=True):
+    """
+    Run a block in 'transaction.atomic()' on a database. Graph updates made
+    inside it are applied once the outermost atomic block has committed and
+    dropped if it rolls back, so a rolled back change never reaches the
+    graph snapshot.
+
+    If the outermost atomic block isn't a 'graph_atomic()' block, whether
+    it committed isn't known, and the graph is invalidated at the next
+    graph read or write instead (Django has no commit hooks to tell).
+    'savepoint' is passed on to 'transaction.atomic()'.
+
+    Relationship reads from this thread stick to the database written to
+    (see 'VelcroRouter') once the block has committed, or, inside another
+    atomic block, once it has exited without an error.
+    """
+    connection = transaction.get_connection(using)
+    outermost = not connection.in_atomic_block
+    if outermost and VELCRO_GRAPH_SNAPSHOT:
+        _resolve_pending_updates()
+
+    committed = False
+    try:
+        with transaction.atomic(using=using, savepoint=savepoint):
+            yield
+            committed = not connection.needs_rollback
+    finally:
+        if outermost and VELCRO_GRAPH_SNAPSHOT:
+            updates = _pending_updates().pop(using, [])
+            if committed and updates:
+                _apply_updates(updates)
+
+    if committed:
+        mark_written(using)
+
+def invalidate_graph():
+    """
+    Make every process reload its graph snapshot at its next check, for
+    changes that can't be applied edge by edge or replayed from the change
+    log. This process reloads at its next graph read.
+    """
+    if not VELCRO_GRAPH_SNAPSHOT:
+        return
+
+    caches[VELCRO_CACHE].set(GRAPH_RELOAD_KEY, uuid4().hex, None)
+    if _graph is not None:
+        _graph._next_check = 0
+
+def update_graph(relationship_class, op, endpoints, using=None):
+    """
+    Apply relationship changes made by this process to the graph snapshot,
+    if one is loaded, and tell other processes that the graph has changed.
+    'op' is 'RelationshipChange.ADD' or 'RelationshipChange.REMOVE', and
+    'endpoints' is a list of pairs of '(content_type_id, object_pk)' tuples.
+
+    Inside a transaction, the changes wait until it has committed (see
+    'graph_atomic()').
+    """
+    if not VELCRO_GRAPH_SNAPSHOT:
+        return
+
+    using = using or router.db_for_write(relationship_class)
+    update = (relationship_class, op, endpoints)
+    if transaction.get_connection(using).in_atomic_block:
+        _pending_updates().setdefault(using, []).append(update)
+    else:
+        _resolve_pending_updates()
+        _apply_updates([update])
+
+class RelationshipGraph(object):
+    """
+    In-memory snapshot of all relationship tables, for read-heavy processes
+    with fairly static relationships. For each relationship model and each
+    velcro type it holds, neighbours are stored as compressed sparse rows of
+    packed '(content_type_id, object_pk)' integers in 'array' buffers: a
+    sorted array of nodes, an array of offsets and an array of neighbours,
+    in 'order_by' order. Lookups are a binary search, with no SQL and no
+    model instances.
+
+    Changes made by this process are applied to an overlay of added and
+    removed edges once they are committed. Every
+    'VELCRO_GRAPH_SNAPSHOT_CHECK_SECONDS', changes from other processes are
+    replayed from the change log if 'VELCRO_CHANGELOG' is enabled; otherwise
+    the snapshot is reloaded if another process has changed the graph
+    version in the cache.
+    Snapshots are reloaded after 'VELCRO_GRAPH_SNAPSHOT_MAX_AGE' seconds, or
+    when the graph is invalidated, in any case.
+
+    To enable snapshots, add to 'settings.py':
+
+        VELCRO_GRAPH_SNAPSHOT = True
+    """
+    def __init__(self):
+        self._adjacency = {}
+        self._added = {}
+        self._removed = set()
+        self._last_seq = 0
+        self._loaded_at = 0
+        self._next_check = 0
+        self._reload_token = None
+        self._version = None
+
+    def _base_neighbours(self, name, velcro_type, packed):
+        adjacency = self._adjacency.get((name, velcro_type))
+        if adjacency is None:
+            return ()
+        nodes, offsets, neighbours = adjacency
+        i = bisect_left(nodes, packed)
+        if i == len(nodes) or nodes[i] != packed:
+            return ()
+        return neighbours[offsets[i]:offsets[i + 1]]
+
+    def apply(self, relationship_class, op, endpoints):
+        """
+        Add or remove an edge in the overlay. Changes are idempotent, so
+        replaying changes that are already applied is harmless.
+        """
+        name = relationship_class.__name__
+        with _lock:
+            for velcro_type, own, other in _sides(
+                    relationship_class, endpoints):
+                node = (name, velcro_type, own)
+                added = self._added.setdefault(node, [])
+                in_base = other in self._base_neighbours(
+                    name, velcro_type, own)
+                if op == RelationshipChange.ADD:
+                    self._removed.discard(node + (other,))
+                    if not in_base and other not in added:
+                        added.append(other)
+                else:
+                    if other in added:
+                        added.remove(other)
+                    if in_base:
+                        self._removed.add(node + (other,))
+
+    def load(self):
+        """
+        Load all relationship tables. The change log position and graph
+        version are read first, so changes made while loading are picked up
+        by the next refresh.
+        """
+        from .utils import _endpoint_attnames, get_relationship_classes
+
+        tokens = caches[VELCRO_CACHE].get_many(
+            [GRAPH_RELOAD_KEY, GRAPH_VERSION_KEY])
+        last_seq = 0
+        if VELCRO_CHANGELOG:
+            last_seq = RelationshipChange.objects.aggregate(
+                seq=models.Max('seq'))['seq'] or 0
+
+        adjacency = {}
+        for relationship_class in get_relationship_classes():
+            edges = {}
+            rows = relationship_class.objects.values_list(
+                *_endpoint_attnames(relationship_class)).iterator()
+            for ct_1_id, pk_1, ct_2_id, pk_2 in rows:
+                for velcro_type, own, other in _sides(
+                        relationship_class,
+                        ((ct_1_id, pk_1), (ct_2_id, pk_2))):
+                    edges.setdefault(velcro_type, []).append((own, other))
+
+            for velcro_type, pairs in edges.items():
+                # Stable sort keeps neighbours in 'order_by' order
+                pairs.sort(key=itemgetter(0))
+                nodes, offsets, neighbours = array('q'), array('q'), array('q')
+                for own, other in pairs:
+                    if not nodes or nodes[-1] != own:
+                        nodes.append(own)
+                        offsets.append(len(neighbours))
+                    neighbours.append(other)
+                offsets.append(len(neighbours))
+                adjacency[(relationship_class.__name__, velcro_type)] = (
+                    nodes, offsets, neighbours)
+
+        with _lock:
+            self._adjacency = adjacency
+            self._added = {}
+            self._removed = set()
+            self._last_seq = last_seq
+            self._reload_token = tokens.get(GRAPH_RELOAD_KEY)
+            self._version = tokens.get(GRAPH_VERSION_KEY)
+            self._loaded_at = time.time()
+            self._next_check = (
+                self._loaded_at + VELCRO_GRAPH_SNAPSHOT_CHECK_SECONDS)
+
+    def neighbours(self, relationship_class, velcro_type, key):
+        """
+        Return the '(content_type_id, object_pk)' keys related to an object
+        of the given velcro type through a relationship model.
+        """
+        name = relationship_class.__name__
+        packed = _pack(key)
+        # The overlay is changed in place by 'apply()'
+        with _lock:
+            base = self._base_neighbours(name, velcro_type, packed)
+            if self._removed:
+                base = [
+                    other for other in base
+                    if (name, velcro_type, packed, other) not in self._removed
+                ]
+            added = list(self._added.get((name, velcro_type, packed), ()))
+        return [_unpack(other) for other in base] + [
+            _unpack(other) for other in added]
+
+    def refresh_if_due(self):
+        """
+        Pick up changes made by other processes if the check interval has
+        passed, and reload the snapshot if it is older than its maximum age
+        or has been invalidated.
+        """
+        now = time.time()
+        if now < self._next_check:
+            return
+
+        with _lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + VELCRO_GRAPH_SNAPSHOT_CHECK_SECONDS
+
+            tokens = caches[VELCRO_CACHE].get_many(
+                [GRAPH_RELOAD_KEY, GRAPH_VERSION_KEY])
+            if (now - self._loaded_at > VELCRO_GRAPH_SNAPSHOT_MAX_AGE or
+                    tokens.get(GRAPH_RELOAD_KEY) != self._reload_token):
+                self.load()
+            elif VELCRO_CHANGELOG:
+                self.replay()
+            elif tokens.get(GRAPH_VERSION_KEY) != self._version:
+                self.load()
+
+    def replay(self):
+        """
+        Apply changes from the change log that were made since the last
+        load or replay.
+        """
+        from .utils import get_relationship_changes, get_relationship_classes
+
+        relationship_classes = {
+            relationship_class.__name__: relationship_class
+            for relationship_class in get_relationship_classes()
+        }
+        while True:
+            changes = get_relationship_changes(
+                after=self._last_seq, limit=REPLAY_BATCH_SIZE)
+            if not changes:
+                break
+            for change in changes:
+                relationship_class = relationship_classes.get(
+                    change.relationship_class)
+                if relationship_class is not None:
+                    self.apply(relationship_class, change.op, (
+                        (change.a_ct, change.a_pk),
+                        (change.b_ct, change.b_pk)))
+            self._last_seq = changes[-1].seq
@@ -0,0 +1,216 @@
+from collections import OrderedDict
+from functools import partial
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connections, models, router
+
+from django_velcro.graph import graph_atomic, invalidate_graph
+from django_velcro.models import RelationshipChange
+from django_velcro.utils import (_bulk_delete_relationships,
+    _endpoint_attnames, _quoted_column, _record_relationship_changes,
+    get_relationship_classes)
+
+from .velcroorderby import get_relationship_classes_by_name
+
+
+CHECKS = OrderedDict([
+    ('self_links', 'self-links'),
+    ('invalid_content_types', 'content types outside limit_choices_to'),
+    ('duplicates', 'exact duplicates'),
+    ('reversed_duplicates', 'reversed duplicates'),
+])
+
+
+def find_duplicates(relationship_class, connection):
+    """
+    Return the pks of relationships that repeat the endpoints of another
+    relationship, keeping the one with the smallest pk of each group. A
+    'GROUP BY ... HAVING COUNT(*) > 1' subquery finds the groups and is
+    joined back to the table to find the rows.
+    """
+    column = partial(_quoted_column, relationship_class, connection)
+    pk_field = relationship_class._meta.pk.name
+    attnames = _endpoint_attnames(relationship_class)
+
+    sql = (
+        'SELECT r.{pk} FROM {table} r INNER JOIN ('
+        'SELECT {columns}, MIN({pk}) AS velcro_keep FROM {table} '
+        'GROUP BY {columns} HAVING COUNT(*) > 1) d '
+        'ON {join} AND r.{pk} <> d.velcro_keep'.format(
+            pk=column(pk_field),
+            table=connection.ops.quote_name(relationship_class._meta.db_table),
+            columns=', '.join(column(field) for field in attnames),
+            join=' AND '.join(
+                '{} = {}'.format(column(field, 'r'), column(field, 'd'))
+                for field in attnames)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return [row[0] for row in cursor.fetchall()]
+
+def find_reversed_duplicates(relationship_class, connection):
+    """
+    Return the pks of relationships with matching velcro types whose
+    endpoints are those of another relationship, reversed (A-B and B-A),
+    keeping the one with the smallest pk of each pair. Relationships with
+    differing velcro types can't be reversed, so none are returned for them.
+    """
+    velcro_type_1, velcro_type_2 = relationship_class.velcro_types
+    if velcro_type_1 != velcro_type_2:
+        return []
+
+    column = partial(_quoted_column, relationship_class, connection)
+    pk_field = relationship_class._meta.pk.name
+    ct_1, pk_1, ct_2, pk_2 = _endpoint_attnames(relationship_class)
+    table = connection.ops.quote_name(relationship_class._meta.db_table)
+
+    sql = (
+        'SELECT DISTINCT b.{pk} FROM {table} a INNER JOIN {table} b '
+        'ON {join} AND a.{pk} < b.{pk}'.format(
+            pk=column(pk_field),
+            table=table,
+            join=' AND '.join(
+                '{} = {}'.format(column(field_a, 'a'), column(field_b, 'b'))
+                for field_a, field_b in (
+                    (ct_1, ct_2), (pk_1, pk_2), (ct_2, ct_1), (pk_2, pk_1)))))
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return [row[0] for row in cursor.fetchall()]
+
+def find_invalid_content_types(relationship_class, using):
+    """
+    Return '(pk, endpoints)' tuples for relationships with an end whose
+    content type isn't allowed by the 'limit_choices_to' of its field.
+    """
+    query = models.Q()
+    for ct_field, _, _ in relationship_class.velcro_fields:
+        limit = relationship_class._meta.get_field(
+            ct_field).get_limit_choices_to()
+        allowed = list(ContentType.objects.db_manager(using).filter(
+            limit).values_list('pk', flat=True))
+        query |= ~models.Q(**{'{}__in'.format(ct_field): allowed})
+    return endpoint_rows(
+        relationship_class.objects.db_manager(using).filter(query))
+
+def find_self_links(relationship_class, using):
+    """
+    Return '(pk, endpoints)' tuples for relationships of an object to
+    itself.
+    """
+    ct_1, pk_1, ct_2, pk_2 = _endpoint_attnames(relationship_class)
+    return endpoint_rows(relationship_class.objects.db_manager(using).filter(
+        **{ct_1: models.F(ct_2), pk_1: models.F(pk_2)}))
+
+def endpoint_rows(queryset):
+    """
+    Return '(pk, endpoints)' tuples for the relationships of a QuerySet.
+    """
+    return [
+        (pk, ((ct_1_id, pk_1), (ct_2_id, pk_2)))
+        for pk, ct_1_id, pk_1, ct_2_id, pk_2 in queryset.order_by(
+            'pk').values_list('pk', *_endpoint_attnames(queryset.model))
+    ]
+
+class Command(BaseCommand):
+    args = '<relationship_model relationship_model ...>'
+    help = 'Check relationship models for self-links, content types ' \
+           'outside limit_choices_to, exact duplicates and (for matching ' \
+           'velcro types) reversed duplicates, with one set-based query ' \
+           'per check and table, and report the counts. \n' \
+           'With --fix, the offending rows are deleted in batches. Of each ' \
+           'group of duplicates, the relationship with the smallest pk is ' \
+           'kept. If no relationship model is given, all relationship ' \
+           'models are checked.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', default=False,
+            dest='fix',
+            help='Delete the relationships found.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            dest='batch_size',
+            help='Number of relationships to delete per batch.')
+        parser.add_argument('--database', default=None, dest='database',
+            help='Database to check. Defaults to the one chosen by the '
+                 'database router.')
+
+    def handle(self, *args, **kwargs):
+        verbosity = int(kwargs['verbosity'])
+
+        if args:
+            relationship_classes = get_relationship_classes_by_name(args)
+        else:
+            relationship_classes = get_relationship_classes()
+
+        for relationship_class in relationship_classes:
+            using = kwargs['database'] or router.db_for_write(
+                relationship_class)
+            found = self.audit(relationship_class, using)
+
+            if kwargs['fix']:
+                with graph_atomic(using):
+                    self.fix(relationship_class, found, kwargs['batch_size'],
+                             using)
+                # Graph snapshots hold every copy of a duplicated edge,
+                # which can't be removed edge by edge, so they are reloaded
+                if found['duplicates'] or found['reversed_duplicates']:
+                    invalidate_graph()
+
+            if verbosity > 0:
+                self.stdout.write('{}: {}{}'.format(
+                    relationship_class.__name__,
+                    ', '.join(
+                        '{} {}'.format(len(found[check]), description)
+                        for check, description in CHECKS.items()),
+                    ' (deleted)' if kwargs['fix'] else ''))
+
+    def audit(self, relationship_class, using):
+        """
+        Run every check on a relationship model and return a dict mapping
+        each check to the relationships it found. A relationship found by
+        an earlier check isn't repeated by later ones. Self-links and
+        invalid content types are '(pk, endpoints)' tuples; duplicates are
+        pks.
+        """
+        connection = connections[using]
+        found = OrderedDict([
+            ('self_links', find_self_links(relationship_class, using)),
+            ('invalid_content_types', find_invalid_content_types(
+                relationship_class, using)),
+            ('duplicates', find_duplicates(relationship_class, connection)),
+            ('reversed_duplicates', find_reversed_duplicates(
+                relationship_class, connection)),
+        ])
+
+        seen = {pk for pk, _ in found['self_links']}
+        found['invalid_content_types'] = [
+            row for row in found['invalid_content_types']
+            if row[0] not in seen]
+        seen.update(pk for pk, _ in found['invalid_content_types'])
+        for check in ('duplicates', 'reversed_duplicates'):
+            found[check] = sorted(set(found[check]).difference(seen))
+            seen.update(found[check])
+
+        return found
+
+    def fix(self, relationship_class, found, batch_size, using):
+        """
+        Delete the relationships found by 'audit()' with one set-based
+        DELETE per batch, which logs them as removed and updates the
+        relationship versions of their ends once per batch. An equivalent
+        relationship remains for each duplicate, so duplicates are logged
+        as added again after their removal.
+        """
+        _bulk_delete_relationships(
+            relationship_class,
+            found['self_links'] + found['invalid_content_types'], using,
+            batch_size=batch_size)
+
+        pks = found['duplicates'] + found['reversed_duplicates']
+        manager = relationship_class.objects.db_manager(using)
+        for i in range(0, len(pks), batch_size):
+            rows = endpoint_rows(manager.filter(pk__in=pks[i:i + batch_size]))
+            _bulk_delete_relationships(
+                relationship_class, rows, using, batch_size=batch_size)
+            _record_relationship_changes(
+                relationship_class, RelationshipChange.ADD,
+                [endpoints for pk, endpoints in rows], using)
@@ -0,0 +1,61 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from django_velcro.app_settings import VELCRO_CHANGELOG
+from django_velcro.utils import get_relationship_changes
+
+
+class Command(BaseCommand):
+    help = 'Print relationship changes after a sequence number as JSON ' \
+           'lines, reading the change log in batches. \n' \
+           'The change log is only written if VELCRO_CHANGELOG is enabled. ' \
+           'Pass the seq of the last change printed as --after to resume.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--after', type=int, default=0, dest='after',
+            help='Print changes with sequence numbers greater than this.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            dest='batch_size',
+            help='Number of changes to read per batch.')
+        parser.add_argument('--limit', type=int, default=None, dest='limit',
+            help='Maximum number of changes to print.')
+        parser.add_argument('--database', default=None, dest='database',
+            help='Database to read changes from. Defaults to the one chosen '
+                 'by the database router.')
+
+    def handle(self, *args, **kwargs):
+        verbosity = int(kwargs['verbosity'])
+        batch_size = kwargs['batch_size']
+        limit = kwargs['limit']
+        after = kwargs['after']
+
+        if not VELCRO_CHANGELOG and verbosity > 0:
+            self.stderr.write(
+                'VELCRO_CHANGELOG is disabled; no new changes are logged.')
+
+        printed = 0
+        while limit is None or printed < limit:
+            size = batch_size
+            if limit is not None:
+                size = min(size, limit - printed)
+
+            changes = get_relationship_changes(
+                after=after, limit=size, using=kwargs['database'])
+            if not changes:
+                break
+
+            for change in changes:
+                self.stdout.write(json.dumps({
+                    'seq': change.seq,
+                    'op': change.op,
+                    'relationship_class': change.relationship_class,
+                    'a': [change.a_ct, change.a_pk],
+                    'b': [change.b_ct, change.b_pk],
+                }, sort_keys=True))
+            printed += len(changes)
+            after = changes[-1].seq
+
+        if verbosity > 1:
+            self.stderr.write('{} changes printed (last seq: {})'.format(
+                printed, after))
@@ -0,0 +1,197 @@
+import json
+from array import array
+from collections import Counter
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+
+from django_velcro.utils import _endpoint_attnames, get_relationship_classes
+
+from .velcrosimilarity import pack_keys, unpack_keys
+
+
+def iter_relationship_batches(np, relationship_class, batch_size, using):
+    """
+    Stream a relationship table in pk-ordered batches, yielding a pair of
+    aligned int64 key arrays (one per end) for each batch. Only one batch
+    is held in memory at a time.
+    """
+    last_pk = 0
+    while True:
+        rows = list(
+            relationship_class.objects.db_manager(using).filter(
+                pk__gt=last_pk).order_by('pk').values_list(
+                'pk', *_endpoint_attnames(relationship_class))[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+
+        batch = np.array(rows, dtype=np.int64)
+        yield (pack_keys(np, batch[:, 1], batch[:, 2]),
+               pack_keys(np, batch[:, 3], batch[:, 4]))
+
+def collect_nodes(np, batches):
+    """
+    Return a sorted array of the distinct keys in a stream of key array
+    pairs. Keys are deduplicated as they arrive, so memory use is bounded
+    by the number of distinct keys rather than the number of edges.
+    """
+    nodes = np.empty(0, dtype=np.int64)
+    pending, pending_size = [], 0
+    for keys_1, keys_2 in batches:
+        pending.append(np.unique(np.concatenate((keys_1, keys_2))))
+        pending_size += len(pending[-1])
+        if pending_size > max(len(nodes), 1000000):
+            nodes = np.unique(np.concatenate([nodes] + pending))
+            pending, pending_size = [], 0
+    return np.unique(np.concatenate([nodes] + pending))
+
+def find(parent, i):
+    """
+    Return the root of node 'i', halving the path to it on the way.
+    """
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def union_batch(np, parent, nodes, keys_1, keys_2):
+    """
+    Merge the components of both ends of a batch of edges. The root of
+    each component is its smallest node, so component ids don't depend on
+    the order in which edges are read.
+    """
+    for i, j in zip(np.searchsorted(nodes, keys_1).tolist(),
+                    np.searchsorted(nodes, keys_2).tolist()):
+        root_i, root_j = find(parent, i), find(parent, j)
+        if root_i < root_j:
+            parent[root_j] = root_i
+        elif root_j < root_i:
+            parent[root_i] = root_j
+
+class Command(BaseCommand):
+    help = 'Find the connected components of the relationship graph ' \
+           'across all relationship models (requires NumPy). \n' \
+           'Relationship tables are streamed in batches into an ' \
+           'array-backed union-find keyed by (content_type_id, pk), so ' \
+           'memory use grows with the number of related objects, not the ' \
+           'number of relationships. Prints a summary and the largest ' \
+           'components as JSON lines; objects without relationships are ' \
+           'not counted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, dest='top',
+            help='Number of largest components to print.')
+        parser.add_argument('--members', action='store_true', default=False,
+            dest='members',
+            help='Include the members of printed components.')
+        parser.add_argument('--save', action='store_true', default=False,
+            dest='save',
+            help='Replace the contents of RelationshipComponent with the '
+                 'component of every related object.')
+        parser.add_argument('--batch-size', type=int, default=10000,
+            dest='batch_size',
+            help='Number of rows to read or write per batch.')
+        parser.add_argument('--database', default=None, dest='database',
+            help='Database to read relationships from and write results '
+                 'to. Defaults to the ones chosen by the database router.')
+
+    def handle(self, *args, **kwargs):
+        try:
+            import numpy as np
+        except ImportError:
+            raise CommandError(
+                'velcroclusters requires NumPy to be installed.')
+
+        verbosity = int(kwargs['verbosity'])
+        batch_size = kwargs['batch_size']
+        using = kwargs['database']
+        relationship_classes = get_relationship_classes()
+
+        def batches():
+            for relationship_class in relationship_classes:
+                for keys in iter_relationship_batches(
+                        np, relationship_class, batch_size, using):
+                    yield keys
+
+        # First pass: index every related object
+        nodes = collect_nodes(np, batches())
+        if verbosity > 1:
+            self.stderr.write('{} related objects found'.format(len(nodes)))
+
+        # Second pass: merge the ends of every relationship
+        parent = array('q', range(len(nodes)))
+        edges = 0
+        for keys_1, keys_2 in batches():
+            union_batch(np, parent, nodes, keys_1, keys_2)
+            edges += len(keys_1)
+            if verbosity > 1:
+                self.stderr.write('  {} relationships read'.format(edges))
+
+        for i in range(len(parent)):
+            parent[i] = find(parent, i)
+        components = np.frombuffer(parent, dtype=np.int64)
+        roots, sizes = np.unique(components, return_counts=True)
+        order = np.lexsort((roots, -sizes))
+
+        if verbosity > 0:
+            histogram = Counter(sizes.tolist())
+            self.stdout.write(json.dumps({
+                'objects': len(nodes),
+                'relationships': edges,
+                'components': len(roots),
+                'sizes': [[size, histogram[size]]
+                          for size in sorted(histogram, reverse=True)],
+            }, sort_keys=True))
+
+        for i in order[:kwargs['top']].tolist():
+            component = {'component': roots[i].item(),
+                         'size': sizes[i].item()}
+            if kwargs['members']:
+                content_type_ids, object_pks = unpack_keys(
+                    np, nodes[components == roots[i]])
+                component['members'] = [
+                    [ContentType.objects.get_for_id(ct).model, pk]
+                    for ct, pk in zip(
+                        content_type_ids.tolist(), object_pks.tolist())
+                ]
+            self.stdout.write(json.dumps(component, sort_keys=True))
+
+        if kwargs['save']:
+            self.save_components(
+                np, nodes, components, dict(zip(roots.tolist(),
+                                                sizes.tolist())),
+                batch_size, using, verbosity)
+
+    def save_components(self, np, nodes, components, sizes, batch_size,
+                        using, verbosity):
+        """
+        Replace the rows of 'RelationshipComponent' with the component of
+        every related object, writing one batch at a time.
+        """
+        component_class = apps.get_model(
+            'django_velcro', 'RelationshipComponent')
+        write_db = using or router.db_for_write(component_class)
+
+        with transaction.atomic(using=write_db):
+            component_class.objects.db_manager(write_db).all().delete()
+            for start in range(0, len(nodes), batch_size):
+                content_type_ids, object_pks = unpack_keys(
+                    np, nodes[start:start + batch_size])
+                component_class.objects.db_manager(write_db).bulk_create([
+                    component_class(
+                        content_type_id=content_type_id,
+                        object_pk=object_pk,
+                        component=component,
+                        size=sizes[component],
+                    )
+                    for content_type_id, object_pk, component in zip(
+                        content_type_ids.tolist(), object_pks.tolist(),
+                        components[start:start + batch_size].tolist())
+                ])
+
+        if verbosity > 0:
+            self.stderr.write(
+                '{} component rows written'.format(len(nodes)))
@@ -0,0 +1,97 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router
+
+from django_velcro.utils import (_endpoint_attnames, _update_order_by_labels,
+    get_relationship_classes)
+
+
+def get_relationship_classes_by_name(model_names):
+    """
+    Return relationship classes for a list of relationship model names.
+    Raise 'CommandError' if a model name is not a generated relationship
+    model.
+    """
+    relationship_classes = []
+    for model_name in model_names:
+        try:
+            relationship_class = apps.get_model('django_velcro', model_name)
+        except LookupError:
+            relationship_class = None
+        if relationship_class not in get_relationship_classes():
+            raise CommandError(
+                "Relationship model '{}' does not exist.".format(model_name))
+        relationship_classes.append(relationship_class)
+    return relationship_classes
+
+class Command(BaseCommand):
+    args = '<relationship_model relationship_model ...>'
+    help = 'Recompute the order_by labels of relationship models in ' \
+           'batches. \n' \
+           'If no relationship model is given, labels for all ' \
+           'relationship models are recomputed. Each batch is committed ' \
+           'separately, so an interrupted run can be resumed with ' \
+           '--start-after.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+            dest='batch_size',
+            help='Number of relationships to process per batch.')
+        parser.add_argument('--start-after', type=int, default=0,
+            dest='start_after',
+            help='Resume after this relationship pk (applies to the first '
+                 'relationship model only).')
+        parser.add_argument('--database', default=None, dest='database',
+            help='Database to update. Defaults to the one the database '
+                 'router writes relationships to.')
+
+    def handle(self, *args, **kwargs):
+        verbosity = int(kwargs['verbosity'])
+        batch_size = kwargs['batch_size']
+        start_after = kwargs['start_after']
+
+        if args:
+            relationship_classes = get_relationship_classes_by_name(args)
+        else:
+            relationship_classes = get_relationship_classes()
+
+        for relationship_class in relationship_classes:
+            # Labels are read from the database they are written to, since
+            # a replica may lag behind
+            using = kwargs['database'] or router.db_for_write(
+                relationship_class)
+            fields = (['pk'] + _endpoint_attnames(relationship_class) +
+                      ['order_by'])
+            last_pk = start_after
+            checked = updated = 0
+
+            try:
+                while True:
+                    rows = list(
+                        relationship_class.objects.db_manager(using).filter(
+                            pk__gt=last_pk).order_by('pk').values_list(
+                            *fields)[:batch_size])
+                    if not rows:
+                        break
+
+                    updated += _update_order_by_labels(
+                        relationship_class, rows, using=using)
+                    checked += len(rows)
+                    last_pk = rows[-1][0]
+
+                    if verbosity > 1:
+                        self.stdout.write(
+                            '  {}: {} checked (last pk: {})'.format(
+                                relationship_class.__name__, checked,
+                                last_pk))
+            except KeyboardInterrupt:
+                raise CommandError(
+                    'Interrupted. Resume with: velcroorderby {} '
+                    '--start-after {}'.format(
+                        relationship_class.__name__, last_pk))
+
+            if verbosity > 0:
+                self.stdout.write('{}: {} checked, {} updated'.format(
+                    relationship_class.__name__, checked, updated))
+
+            start_after = 0
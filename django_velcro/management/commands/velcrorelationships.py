@@ -17,8 +17,11 @@ class Command(BaseCommand):
         for model_name in sorted([name for name, cls in models.__dict__.items()
             if isinstance(cls, type)]):
 
-            # Ignore models imported within django_velcro.models
-            if model_name in ['ContentType', 'GenericForeignKey']:
+            # Ignore models imported or defined within django_velcro.models
+            if model_name in ['ContentType', 'GenericForeignKey',
+                              'RelationshipChange',
+                              'RelationshipComponent', 'RelationshipMixin',
+                              'SimilarContent']:
                 continue
 
             self.stdout.write('{}'.format(model_name))
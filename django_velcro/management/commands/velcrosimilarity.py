@@ -0,0 +1,236 @@
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+
+from django_velcro.app_settings import VELCRO_METADATA
+from django_velcro.utils import (_endpoint_orientations, get_all_velcro_types,
+    get_or_validate_related_types, get_relationship_class,
+    is_valid_velcro_type)
+
+
+METHODS = ('cooccurrence', 'cosine')
+
+
+def get_content_type_ids(velcro_type):
+    """
+    Return the content type ids of all models of a velcro type.
+    """
+    return [
+        ContentType.objects.get_for_model(apps.get_model(
+            model_metadata['app_label'], model_metadata['model'])).pk
+        for model_metadata in VELCRO_METADATA[velcro_type]['apps']
+    ]
+
+def pack_keys(np, content_type_ids, object_pks):
+    """
+    Pack arrays of content type ids and object pks into a single array of
+    int64 '(content_type_id, pk)' keys.
+    """
+    return ((content_type_ids.astype(np.int64) << 32) |
+            object_pks.astype(np.int64))
+
+def unpack_keys(np, keys):
+    """
+    Unpack an array of int64 keys into content type id and object pk arrays.
+    """
+    return keys >> 32, keys & 0xffffffff
+
+def stream_relationship_table(np, relationship_class, batch_size, using):
+    """
+    Stream a relationship table in pk-ordered batches and return a dict
+    mapping each end's '(content_type_field, object_pk_field)' pair to an
+    int64 key array. Arrays for both ends are aligned row by row.
+    """
+    fields = [
+        (ct_field, pk_field)
+        for ct_field, pk_field, _ in relationship_class.velcro_fields
+    ]
+    chunks = {end: [] for end in fields}
+    last_pk = 0
+
+    while True:
+        queryset = relationship_class.objects.db_manager(using).filter(
+            pk__gt=last_pk).order_by('pk')
+        rows = list(queryset.values_list(
+            'pk', *[field for end in fields for field in end])[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+
+        batch = np.array(rows, dtype=np.int64)
+        for i, end in enumerate(fields):
+            chunks[end].append(
+                pack_keys(np, batch[:, 1 + 2 * i], batch[:, 2 + 2 * i]))
+
+    return {
+        end: (np.concatenate(arrays) if arrays else
+              np.empty(0, dtype=np.int64))
+        for end, arrays in chunks.items()
+    }
+
+def similarity_rows(np, sparse, own_keys, other_keys, method, top_k,
+                    block_size):
+    """
+    Given aligned arrays of '(own, intermediate)' edge keys, build a sparse
+    bipartite adjacency matrix and yield '(key, similar_key, score)' tuples
+    for the 'top_k' most similar objects of each object.
+
+    Similarities are computed for 'block_size' rows at a time with a sparse
+    product of the adjacency matrix and its transpose, which bounds memory
+    use on large catalogues.
+    """
+    if not len(own_keys):
+        return
+
+    row_keys, row_index = np.unique(own_keys, return_inverse=True)
+    col_keys, col_index = np.unique(other_keys, return_inverse=True)
+    adjacency = sparse.csr_matrix(
+        (np.ones(len(row_index)), (row_index, col_index)),
+        shape=(len(row_keys), len(col_keys)))
+    adjacency.sum_duplicates()
+    adjacency.data[:] = 1.0
+    adjacency_t = adjacency.T.tocsr()
+
+    if method == 'cosine':
+        degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+        inverse_norms = sparse.diags(1.0 / np.sqrt(degrees))
+
+    for start in range(0, len(row_keys), block_size):
+        stop = min(start + block_size, len(row_keys))
+        block = adjacency[start:stop].dot(adjacency_t)
+        if method == 'cosine':
+            block = sparse.diags(
+                inverse_norms.diagonal()[start:stop]).dot(block).dot(
+                inverse_norms)
+        block = block.tocsr()
+
+        for r in range(stop - start):
+            cols = block.indices[block.indptr[r]:block.indptr[r + 1]]
+            scores = block.data[block.indptr[r]:block.indptr[r + 1]]
+            keep = cols != start + r
+            cols, scores = cols[keep], scores[keep]
+            for i in np.lexsort((cols, -scores))[:top_k]:
+                yield row_keys[start + r], row_keys[cols[i]], float(scores[i])
+
+def write_similar_content(np, similar_content_class, rows, batch_size, using):
+    """
+    Write '(key, similar_key, score)' rows to the similar content table with
+    one 'bulk_create()' per 'batch_size' rows, and return the number of rows
+    written. Only one batch of model instances is held in memory at a time.
+    """
+    written = 0
+    batch = []
+    for key, similar_key, score in rows:
+        content_type_id, object_pk = unpack_keys(np, key)
+        similar_content_type_id, similar_object_pk = unpack_keys(
+            np, similar_key)
+        batch.append(similar_content_class(
+            content_type_id=int(content_type_id),
+            object_pk=int(object_pk),
+            similar_content_type_id=int(similar_content_type_id),
+            similar_object_pk=int(similar_object_pk),
+            score=score,
+        ))
+        if len(batch) == batch_size:
+            similar_content_class.objects.db_manager(using).bulk_create(batch)
+            written += len(batch)
+            batch = []
+
+    if batch:
+        similar_content_class.objects.db_manager(using).bulk_create(batch)
+        written += len(batch)
+    return written
+
+class Command(BaseCommand):
+    args = '<velcro_type velcro_type ...>'
+    help = 'Precompute similar content for a list of velcro types using ' \
+           'sparse matrix products (requires NumPy and SciPy). \n' \
+           'If no velcro type is given, similar content is computed for ' \
+           'all velcro types. Results are read with ' \
+           'get_similar_content(obj, precomputed=True).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--via', action='append', dest='via',
+            default=None,
+            help='Related type to compute similarity through. Can be '
+                 'given multiple times. Defaults to all related types.')
+        parser.add_argument('--method', choices=METHODS,
+            default='cooccurrence', dest='method',
+            help='Similarity measure: shared-neighbour counts '
+                 '(cooccurrence) or cosine similarity.')
+        parser.add_argument('--top-k', type=int, default=10, dest='top_k',
+            help='Number of similar objects to store per object.')
+        parser.add_argument('--batch-size', type=int, default=10000,
+            dest='batch_size',
+            help='Number of rows to read or write per batch.')
+        parser.add_argument('--block-size', type=int, default=1000,
+            dest='block_size',
+            help='Number of objects to compute similarities for at once.')
+        parser.add_argument('--database', default=None, dest='database',
+            help='Database to read relationships from and write results '
+                 'to. Defaults to the ones chosen by the database router.')
+
+    def handle(self, *args, **kwargs):
+        try:
+            import numpy as np
+            from scipy import sparse
+        except ImportError:
+            raise CommandError(
+                'velcrosimilarity requires NumPy and SciPy to be installed.')
+
+        verbosity = int(kwargs['verbosity'])
+        batch_size = kwargs['batch_size']
+        using = kwargs['database']
+        similar_content_class = apps.get_model(
+            'django_velcro', 'SimilarContent')
+        write_db = using or router.db_for_write(similar_content_class)
+
+        velcro_types = args or get_all_velcro_types()
+        for vt in velcro_types:
+            if not is_valid_velcro_type(vt):
+                raise CommandError(
+                    "Object type '{}' does not exist.".format(vt))
+
+        # Relationship tables are read once, when the first velcro type
+        # that needs them is processed
+        edges = {}
+        for vt in velcro_types:
+            own_keys, other_keys = [], []
+            for rt in get_or_validate_related_types(vt, kwargs['via']):
+                relationship_class = get_relationship_class(vt, rt)
+                if relationship_class not in edges:
+                    edges[relationship_class] = stream_relationship_table(
+                        np, relationship_class, batch_size, using)
+                    if verbosity > 1:
+                        self.stdout.write(
+                            '  {}: {} relationships read'.format(
+                                relationship_class.__name__,
+                                len(next(iter(
+                                    edges[relationship_class].values())))))
+                for own, other in _endpoint_orientations(
+                        relationship_class, vt):
+                    own_keys.append(edges[relationship_class][own])
+                    other_keys.append(edges[relationship_class][other])
+
+            # A velcro type that isn't related to the --via types keeps its
+            # stored similar content
+            if not own_keys:
+                if verbosity > 0:
+                    self.stdout.write('{}: skipped, no related types'.format(
+                        vt))
+                continue
+
+            rows = similarity_rows(
+                np, sparse, np.concatenate(own_keys),
+                np.concatenate(other_keys), kwargs['method'],
+                kwargs['top_k'], kwargs['block_size'])
+            with transaction.atomic(using=write_db):
+                similar_content_class.objects.db_manager(write_db).filter(
+                    content_type__in=get_content_type_ids(vt)).delete()
+                written = write_similar_content(
+                    np, similar_content_class, rows, batch_size, write_db)
+
+            if verbosity > 0:
+                self.stdout.write('{}: {} similar content rows written'.format(
+                    vt, written))
@@ -0,0 +1,224 @@
+import json
+import re
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import Resolver404, resolve
+from django.db import connections
+
+from django_velcro.app_settings import VELCRO_METADATA, VELCRO_RELATED_CACHE
+from django_velcro.utils import (_find_dict_in_list, get_velcro_type,
+    warm_related_content)
+
+
+ACCESS_LOG_PATH_RE = re.compile(r'"(?:GET|HEAD) (\S+)')
+
+
+def get_managed_models(labels=None):
+    """
+    Return velcro-managed models for a list of 'app_label.Model' labels, or
+    all velcro-managed models if no labels are given.
+    """
+    if not labels:
+        return [
+            apps.get_model(model_metadata['app_label'],
+                           model_metadata['model'])
+            for velcro_type_metadata in VELCRO_METADATA.values()
+            for model_metadata in velcro_type_metadata['apps']
+        ]
+
+    models = []
+    for label in labels:
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError):
+            model = None
+        if model is None or get_velcro_type(model) is None:
+            raise CommandError(
+                "'{}' is not a velcro-managed model.".format(label))
+        models.append(model)
+    return models
+
+def objects_from_access_log(path, models):
+    """
+    Return an ordered dict mapping each model to a list of lookups
+    ('{field: value}' dicts) for the objects requested in an access log,
+    most requested first. Detail pages of velcro-managed objects and the
+    velcro JSON view are recognized.
+    """
+    views = {}
+    for model in models:
+        model_metadata = _find_dict_in_list(
+            VELCRO_METADATA[get_velcro_type(model)]['apps'], 'model',
+            model.__name__)
+        views[model_metadata['view']] = (model, model_metadata['url_args'])
+
+    hits = Counter()
+    with open(path) as access_log:
+        for line in access_log:
+            match = ACCESS_LOG_PATH_RE.search(line)
+            if match is None:
+                continue
+            try:
+                resolver_match = resolve(urlsplit(match.group(1)).path)
+            except Resolver404:
+                continue
+
+            args = resolver_match.args or tuple(
+                resolver_match.kwargs.values())
+            if resolver_match.view_name in views:
+                model, url_args = views[resolver_match.view_name]
+                hits[(model, tuple(zip(url_args, args)))] += 1
+            elif resolver_match.url_name == 'related-content':
+                try:
+                    model = apps.get_model(
+                        resolver_match.kwargs['app_label'],
+                        resolver_match.kwargs['model_name'])
+                except LookupError:
+                    continue
+                if model in models:
+                    hits[(model, (('pk', resolver_match.kwargs['pk']),))] += 1
+
+    lookups = OrderedDict((model, []) for model in models)
+    for (model, lookup), _ in hits.most_common():
+        lookups[model].append(dict(lookup))
+    return lookups
+
+def chunks_from_lookups(model, lookups, filters, batch_size):
+    """
+    Yield lists of objects of a model matching a list of lookups, in
+    batches that keep the order of the lookups. Lookups on 'pk' are
+    fetched in bulk; others one at a time.
+    """
+    queryset = model._default_manager.filter(**filters)
+    for i in range(0, len(lookups), batch_size):
+        batch = lookups[i:i + batch_size]
+        if all(list(lookup) == ['pk'] for lookup in batch):
+            pks = [model._meta.pk.to_python(lookup['pk']) for lookup in batch]
+            objects = queryset.in_bulk(pks)
+            yield [objects[pk] for pk in pks if pk in objects]
+        else:
+            yield [
+                obj for lookup in batch
+                for obj in queryset.filter(**lookup)[:1]
+            ]
+
+def chunks_from_queryset(model, filters, batch_size):
+    """
+    Yield lists of objects of a model matching a filter, in pk-ordered
+    batches.
+    """
+    queryset = model._default_manager.filter(**filters).order_by('pk')
+    last_pk = None
+    while True:
+        batch_queryset = queryset
+        if last_pk is not None:
+            batch_queryset = queryset.filter(pk__gt=last_pk)
+        objects = list(batch_queryset[:batch_size])
+        if not objects:
+            break
+        last_pk = objects[-1].pk
+        yield objects
+
+def warm_chunk(objects):
+    """
+    Warm the related content cache for a chunk of objects in a worker
+    thread, closing the thread's database connections afterwards.
+    """
+    try:
+        return len(warm_related_content(objects))
+    finally:
+        for connection in connections.all():
+            connection.close()
+
+class Command(BaseCommand):
+    args = '<app_label.Model app_label.Model ...>'
+    help = 'Precompute related content, counts and URLs for velcro-managed ' \
+           'objects and store them in the related content cache ' \
+           '(VELCRO_RELATED_CACHE). \n' \
+           'Objects are selected by model (default: all velcro-managed ' \
+           'models), optionally narrowed with --filter, or taken from an ' \
+           'access log with --access-log, most requested first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filter', default=None, dest='filter',
+            help='JSON object of queryset filter arguments, e.g. '
+                 '\'{"published": true}\'.')
+        parser.add_argument('--access-log', default=None, dest='access_log',
+            help='Access log to take the requested objects from.')
+        parser.add_argument('--top', type=int, default=None, dest='top',
+            help='With --access-log, only warm the most requested objects '
+                 'of each model.')
+        parser.add_argument('--workers', type=int, default=4,
+            dest='workers',
+            help='Number of chunks to warm in parallel.')
+        parser.add_argument('--batch-size', type=int, default=500,
+            dest='batch_size',
+            help='Number of objects per chunk.')
+
+    def handle(self, *args, **kwargs):
+        if not VELCRO_RELATED_CACHE:
+            raise CommandError(
+                'The related content cache is disabled. Set '
+                'VELCRO_RELATED_CACHE = True to use velcrowarm.')
+
+        verbosity = int(kwargs['verbosity'])
+        batch_size = kwargs['batch_size']
+
+        try:
+            filters = json.loads(kwargs['filter']) if kwargs['filter'] else {}
+        except ValueError as e:
+            raise CommandError('Invalid --filter JSON: {}'.format(e))
+        if not isinstance(filters, dict):
+            raise CommandError('--filter must be a JSON object.')
+
+        models = get_managed_models(args)
+
+        if kwargs['access_log']:
+            lookups = objects_from_access_log(kwargs['access_log'], models)
+            chunks = (
+                chunk for model, model_lookups in lookups.items()
+                for chunk in chunks_from_lookups(
+                    model, model_lookups[:kwargs['top']], filters, batch_size)
+            )
+        else:
+            chunks = (
+                chunk for model in models
+                for chunk in chunks_from_queryset(model, filters, batch_size)
+            )
+
+        start = time.time()
+        warmed = 0
+        with ThreadPoolExecutor(max_workers=kwargs['workers']) as executor:
+            pending = set()
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                pending.add(executor.submit(warm_chunk, chunk))
+                if len(pending) >= kwargs['workers'] * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    warmed += self.report(done, warmed, start, verbosity)
+            done, _ = wait(pending)
+            warmed += self.report(done, warmed, start, verbosity)
+
+        if verbosity > 0:
+            elapsed = time.time() - start
+            self.stdout.write(
+                '{} objects warmed in {:.1f}s ({:.0f} objects/s)'.format(
+                    warmed, elapsed, warmed / elapsed if elapsed else 0))
+
+    def report(self, done, warmed, start, verbosity):
+        """
+        Collect finished chunks, report progress and return the number of
+        objects they warmed.
+        """
+        count = sum(future.result() for future in done)
+        if count and verbosity > 1:
+            elapsed = time.time() - start
+            self.stdout.write('  {} objects warmed ({:.0f} objects/s)'.format(
+                warmed + count, (warmed + count) / elapsed if elapsed else 0))
+        return count
@@ -0,0 +1,75 @@
+from django.db import models
+
+
+class VelcroManagerMixin(object):
+    """
+    Manager mixin with Django Velcro filters for velcro-managed models. Add
+    it to a model's own manager class to opt in; managers aren't changed
+    otherwise.
+
+    Usage:
+
+        # models.py
+        class PublicationManager(VelcroManagerMixin, models.Manager):
+            ...
+
+        class Publication(models.Model):
+            ...
+            objects = PublicationManager()
+
+        Publication.objects.velcro_related_to(data_set)
+    """
+    def velcro_related(self, all_of=(), any_of=(), none_of=(), using=None):
+        """
+        Return the objects of this manager that are related to all objects
+        in 'all_of', any object in 'any_of' and no object in 'none_of' (see
+        'filter_related()').
+        """
+        from .utils import filter_related
+        return filter_related(self.get_queryset(), all_of=all_of,
+            any_of=any_of, none_of=none_of, using=using)
+
+    def velcro_related_to(self, obj, using=None):
+        """
+        Return the objects of this manager that are related to 'obj' (see
+        'filter_related_to()').
+        """
+        from .utils import filter_related_to
+        return filter_related_to(self.get_queryset(), obj, using=using)
+
+class VelcroQuerySet(models.QuerySet):
+    """
+    QuerySet with Django Velcro filters for velcro-managed models. Use this
+    QuerySet (or 'VelcroManager') to chain the filters after other QuerySet
+    methods.
+
+    Usage:
+
+        # models.py
+        class Publication(models.Model):
+            ...
+            objects = VelcroManager()
+
+        Publication.objects.filter(year=2015).velcro_related_to(data_set)
+        Publication.objects.filter(year=2015).velcro_related(
+            all_of=[data_set, scientist], none_of=[project])
+    """
+    def velcro_related(self, all_of=(), any_of=(), none_of=(), using=None):
+        """
+        Return the objects of this QuerySet that are related to all objects
+        in 'all_of', any object in 'any_of' and no object in 'none_of'.
+        """
+        from .utils import filter_related
+        return filter_related(self, all_of=all_of, any_of=any_of,
+            none_of=none_of, using=using)
+
+    def velcro_related_to(self, obj, using=None):
+        """
+        Return the objects of this QuerySet that are related to 'obj'.
+        """
+        from .utils import filter_related_to
+        return filter_related_to(self, obj, using=using)
+
+
+VelcroManager = models.Manager.from_queryset(
+    VelcroQuerySet, class_name='VelcroManager')
@@ -0,0 +1,78 @@
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.loader import render_to_string
+from django.utils.encoding import force_text
+
+from .app_settings import VELCRO_DEBUG
+from .debug import build_report, start_tracing, stop_tracing
+
+
+class VelcroDebugMiddleware(object):
+    """
+    Add a panel to HTML responses that breaks down the SQL run by velcro
+    entry points (e.g., 'get_related_content()', 'get_velcro_*_content()'
+    and the template tags) by entry point and related type, flags repeated
+    statements (N+1 patterns such as single-row generic foreign key
+    fetches) and shows the cumulative time spent on each relationship
+    table.
+
+    To enable it, add to 'settings.py':
+
+        VELCRO_DEBUG = True
+        MIDDLEWARE_CLASSES += (
+            'django_velcro.middleware.VelcroDebugMiddleware',
+        )
+
+    Unless 'VELCRO_DEBUG' is enabled, the middleware removes itself at
+    startup and velcro functions are not wrapped, so it costs nothing.
+    """
+    def __init__(self):
+        if not VELCRO_DEBUG:
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        request._velcro_debug = {}
+        for connection in connections.all():
+            request._velcro_debug[connection.alias] = (
+                connection.force_debug_cursor, len(connection.queries_log))
+            connection.force_debug_cursor = True
+        start_tracing()
+
+    def process_response(self, request, response):
+        state = getattr(request, '_velcro_debug', None)
+        if state is None:
+            return response
+
+        from .utils import get_relationship_classes
+
+        labels = stop_tracing()
+        queries = []
+        for connection in connections.all():
+            force_debug_cursor, start = state.get(
+                connection.alias, (connection.force_debug_cursor, 0))
+            connection.force_debug_cursor = force_debug_cursor
+            for index, query in enumerate(connection.queries_log):
+                if index >= start:
+                    queries.append((connection.alias, index, query))
+
+        if (response.streaming or
+                'html' not in response.get('Content-Type', '') or
+                response.get('Content-Encoding', '')):
+            return response
+
+        content = force_text(response.content, encoding=response.charset)
+        position = content.lower().rfind('</body>')
+        if position == -1:
+            return response
+
+        report = build_report(queries, labels, [
+            relationship_class._meta.db_table
+            for relationship_class in get_relationship_classes()
+        ])
+        panel = render_to_string('django_velcro/debug_panel.html', {
+            'report': report,
+        })
+        response.content = content[:position] + panel + content[position:]
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = len(response.content)
+        return response
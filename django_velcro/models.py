@@ -3,11 +3,15 @@ from functools import reduce
 
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
-from django.db import models
+from django.db import models, router
 
 from .app_settings import VELCRO_METADATA, VELCRO_RELATIONSHIPS
 
 
+ORDER_BY_MAX_LENGTH = 255
+RELATIONSHIP_LABEL_SEPARATOR = ' ⟷  '
+
+
 def _startup():
     """
     Generate relationship classes.
@@ -15,51 +19,217 @@ def _startup():
     for r in VELCRO_RELATIONSHIPS:
         generate_relationship_model(r)
 
+def format_endpoint_label(content_type, obj):
+    """
+    Return the label for one end of a relationship.
+    """
+    return '{}: {}'.format(content_type.name.upper(), obj)
+
+def format_relationship_label(
+        content_type_1, object_1, content_type_2, object_2):
+    """
+    Return the label for a relationship between two objects. This is used for
+    both '__str__()' and the 'order_by' column of relationship models.
+    """
+    return RELATIONSHIP_LABEL_SEPARATOR.join((
+        format_endpoint_label(content_type_1, object_1),
+        format_endpoint_label(content_type_2, object_2),
+    ))
+
+class RelationshipMixin(object):
+    """
+    Methods shared by all generated relationship models.
+
+    Each generated model defines 'velcro_types', a sorted tuple of its two
+    velcro types, and 'velcro_fields', a matching tuple of
+    '(content_type_field, object_pk_field, content_object_field)' triples.
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        endpoint_attnames = set()
+        for ct_field, pk_field, _ in cls.velcro_fields:
+            endpoint_attnames.update(('{}_id'.format(ct_field), pk_field))
+        if endpoint_attnames.issubset(field_names):
+            instance._loaded_endpoints = instance.get_endpoints()
+        return instance
+
+    def delete(self, using=None):
+        # Imported here, since the graph module imports this one
+        from .graph import graph_atomic
+
+        using = using or router.db_for_write(self.__class__, instance=self)
+        with graph_atomic(using, savepoint=False):
+            super().delete(using=using)
+
+    def endpoints_changed(self):
+        """
+        Return 'True' unless this relationship was loaded from the database
+        and its endpoints have not been modified since.
+        """
+        loaded_endpoints = getattr(self, '_loaded_endpoints', None)
+        return loaded_endpoints != self.get_endpoints()
+
+    def get_endpoints(self):
+        """
+        Return a tuple of '(content_type_id, object_pk)' pairs for both ends
+        of the relationship.
+        """
+        return tuple(
+            (getattr(self, '{}_id'.format(ct_field)), getattr(self, pk_field))
+            for ct_field, pk_field, _ in self.velcro_fields
+        )
+
+    def get_order_by(self):
+        """
+        Build the label stored in the 'order_by' column. Content types come
+        from the ContentType cache and content objects are only fetched if
+        they aren't already cached on the relationship.
+        """
+        (ct_1_id, _), (ct_2_id, _) = self.get_endpoints()
+        (_, _, object_1_field), (_, _, object_2_field) = self.velcro_fields
+        return format_relationship_label(
+            ContentType.objects.get_for_id(ct_1_id),
+            getattr(self, object_1_field),
+            ContentType.objects.get_for_id(ct_2_id),
+            getattr(self, object_2_field),
+        )[:ORDER_BY_MAX_LENGTH]
+
+class RelationshipChange(models.Model):
+    """
+    Append-only log of relationship changes, written in the same transaction
+    as the changes themselves when 'VELCRO_CHANGELOG' is enabled. Consumers
+    read entries in 'seq' order with 'get_relationship_changes()' or the
+    'velcrochanges' management command to sync incrementally.
+
+    An endpoint change of an existing relationship is logged as a 'remove'
+    of the old endpoints followed by an 'add' of the new ones.
+    """
+    ADD = 'add'
+    REMOVE = 'remove'
+    OP_CHOICES = (
+        (ADD, 'add'),
+        (REMOVE, 'remove'),
+    )
+
+    seq = models.AutoField(primary_key=True)
+    relationship_class = models.CharField(max_length=100)
+    a_ct = models.PositiveIntegerField()
+    a_pk = models.PositiveIntegerField()
+    b_ct = models.PositiveIntegerField()
+    b_pk = models.PositiveIntegerField()
+    op = models.CharField(max_length=6, choices=OP_CHOICES)
+
+    class Meta:
+        ordering = ['seq']
+
+    def __str__(self):
+        return '{} {} {}:{} {}:{}'.format(
+            self.op, self.relationship_class,
+            self.a_ct, self.a_pk, self.b_ct, self.b_pk)
+
+class RelationshipComponent(models.Model):
+    """
+    Connected component of the relationship graph that a velcro-managed
+    object belongs to, written by the 'velcroclusters' management command
+    with '--save'. Objects without relationships have no row. Component ids
+    are only meaningful within one run of the command.
+    """
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_pk = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_pk')
+
+    component = models.PositiveIntegerField(db_index=True)
+    size = models.PositiveIntegerField()
+
+    class Meta:
+        index_together = [('content_type', 'object_pk')]
+        ordering = ['component']
+
+    def __str__(self):
+        return '{}: {}'.format(self.content_object, self.component)
+
+class SimilarContent(models.Model):
+    """
+    Precomputed similar content for velcro-managed objects. Rows are written
+    by the 'velcrosimilarity' management command and read by
+    'get_similar_content(obj, precomputed=True)'.
+    """
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    object_pk = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_pk')
+
+    similar_content_type = models.ForeignKey(ContentType, related_name='+')
+    similar_object_pk = models.PositiveIntegerField()
+    similar_content_object = GenericForeignKey(
+        'similar_content_type', 'similar_object_pk')
+
+    score = models.FloatField()
+
+    class Meta:
+        index_together = [('content_type', 'object_pk')]
+        ordering = ['-score']
+        verbose_name_plural = 'similar content'
+
+    def __str__(self):
+        return format_relationship_label(
+            self.content_type,
+            self.content_object,
+            self.similar_content_type,
+            self.similar_content_object,
+        )
+
 def _generate_relationship_model_difftype(relationship, typedict):
     """
     Return RelationshipBase model and updated typedict for relationship models
     with differing velcro types.
     """
-    class RelationshipBase(models.Model):
+    class RelationshipBase(RelationshipMixin, models.Model):
         """
         Base class for relationship models with differing velcro types.
         """
         class Meta:
             abstract = True
+            index_together = [
+                ('{}_content_type'.format(vt), '{}_object_pk'.format(vt))
+                for vt in sorted(relationship)
+            ]
             ordering = ['order_by']
 
         def save(self, *args, **kwargs):
-            query = {
-                '{}_content_type'.format(object_1_velcro_type):
-                    getattr(
-                        self, '{}_content_type'.format(object_1_velcro_type)),
-                '{}_object_pk'.format(object_1_velcro_type):
-                    getattr(self, '{}_object_pk'.format(object_1_velcro_type)),
-                '{}_content_type'.format(object_2_velcro_type):
-                    getattr(
-                        self, '{}_content_type'.format(object_2_velcro_type)),
-                '{}_object_pk'.format(object_2_velcro_type):
-                    getattr(self, '{}_object_pk'.format(object_2_velcro_type)),
-            }
-
-            try:
-                relationship = self.__class__.objects.get(**query)
-                self.pk = relationship.pk
-            except:
-                pass
-
-            self.order_by = self.__str__()
-
-            super().save(*args, **kwargs)
+            from .graph import graph_atomic
+
+            using = kwargs.get('using') or router.db_for_write(
+                self.__class__, instance=self)
+            with graph_atomic(using):
+                query = {}
+                for vt in (object_1_velcro_type, object_2_velcro_type):
+                    for field in ('{}_content_type', '{}_object_pk'):
+                        field = field.format(vt)
+                        query[field] = getattr(self, field)
+
+                # A forced insert is a new relationship that the caller has
+                # already looked up
+                if not kwargs.get('force_insert'):
+                    try:
+                        relationship = self.__class__.objects.db_manager(
+                            using).get(**query)
+                        self.pk = relationship.pk
+                    except:
+                        pass
+
+                if not self.order_by or self.endpoints_changed():
+                    self.order_by = self.get_order_by()
+
+                super().save(*args, **kwargs)
+                self._loaded_endpoints = self.get_endpoints()
 
         def __str__(self):
-            return '{}: {} ⟷  {}: {}'.format(
-                getattr(self, '{}_content_type'.format(
-                    object_1_velcro_type)).name.upper(),
+            return format_relationship_label(
+                getattr(self, '{}_content_type'.format(object_1_velcro_type)),
                 getattr(
                     self, '{}_content_object'.format(object_1_velcro_type)),
-                getattr(self, '{}_content_type'.format(
-                    object_2_velcro_type)).name.upper(),
+                getattr(self, '{}_content_type'.format(object_2_velcro_type)),
                 getattr(
                     self, '{}_content_object'.format(object_2_velcro_type)),
             )
@@ -98,7 +268,7 @@ def _generate_relationship_model_sametype(velcro_type):
             k: model_metadata[k].lower() for k in ('app_label', 'model')}))
     limit = reduce(operator.or_, queries, models.Q())
 
-    class RelationshipBase(models.Model):
+    class RelationshipBase(RelationshipMixin, models.Model):
         """
         Base class for relationship models with matching velcro types.
         """
@@ -118,41 +288,56 @@ def _generate_relationship_model_sametype(velcro_type):
 
         class Meta:
             abstract = True
+            index_together = [
+                ('content_type_1', 'object_pk_1'),
+                ('content_type_2', 'object_pk_2'),
+            ]
             ordering = ['order_by']
 
         def save(self, *args, **kwargs):
-            query = models.Q(
-                content_type_1=self.content_type_1,
-                object_pk_1=self.object_pk_1,
-                content_type_2=self.content_type_2,
-                object_pk_2=self.object_pk_2,
-            ) | models.Q(
-                content_type_1=self.content_type_2,
-                object_pk_1=self.object_pk_2,
-                content_type_2=self.content_type_1,
-                object_pk_2=self.object_pk_1,
-            )
-
-            try:
-                relationship = self.__class__.objects.get(query)
-                self.pk = relationship.pk
-            except:
-                pass
-
-            self.order_by = self.__str__()
+            from .graph import graph_atomic
+
+            using = kwargs.get('using') or router.db_for_write(
+                self.__class__, instance=self)
+            with graph_atomic(using):
+                query = models.Q(
+                    content_type_1=self.content_type_1,
+                    object_pk_1=self.object_pk_1,
+                    content_type_2=self.content_type_2,
+                    object_pk_2=self.object_pk_2,
+                ) | models.Q(
+                    content_type_1=self.content_type_2,
+                    object_pk_1=self.object_pk_2,
+                    content_type_2=self.content_type_1,
+                    object_pk_2=self.object_pk_1,
+                )
 
-            if (self.content_type_1 == self.content_type_2 and
-                    self.object_pk_1 == self.object_pk_2):
-                print("Object can't be related to itself.")
-            else:
-                super().save(*args, **kwargs)
+                # A forced insert is a new relationship that the caller has
+                # already looked up
+                if not kwargs.get('force_insert'):
+                    try:
+                        relationship = self.__class__.objects.db_manager(
+                            using).get(query)
+                        self.pk = relationship.pk
+                    except:
+                        pass
+
+                if not self.order_by or self.endpoints_changed():
+                    self.order_by = self.get_order_by()
+
+                if (self.content_type_1 == self.content_type_2 and
+                        self.object_pk_1 == self.object_pk_2):
+                    print("Object can't be related to itself.")
+                else:
+                    super().save(*args, **kwargs)
+                    self._loaded_endpoints = self.get_endpoints()
 
         def __str__(self):
-            return '{}: {} ⟷  {}: {}'.format(
-                self.content_type_1.name.upper(),
+            return format_relationship_label(
+                self.content_type_1,
                 self.content_object_1,
-                self.content_type_2.name.upper(),
-                self.content_object_2
+                self.content_type_2,
+                self.content_object_2,
             )
 
 
@@ -214,7 +399,7 @@ def generate_relationship_model(relationship):
 
     Equivalent To:
 
-        class DataPublicationRelationship(models.Model):
+        class DataPublicationRelationship(RelationshipMixin, models.Model):
 
             data_limit = models.Q(app_label='data', model='data') | \\
                 models.Q(app_label='data', model='dataset')
@@ -234,7 +419,16 @@ def generate_relationship_model(relationship):
             publication_content_object = GenericForeignKey(
                 'publication_content_type', 'publication_object_pk')
 
-            order_by = models.CharField(max_length=255, blank=True)
+            order_by = models.CharField(
+                max_length=255, blank=True, db_index=True)
+
+            velcro_types = ('data', 'publication')
+            velcro_fields = (
+                ('data_content_type', 'data_object_pk',
+                 'data_content_object'),
+                ('publication_content_type', 'publication_object_pk',
+                 'publication_content_object'),
+            )
 
             class Meta:
                 ordering = ['order_by']
@@ -253,15 +447,16 @@ def generate_relationship_model(relationship):
                 except:
                     pass
 
-                self.order_by = self.__str__()
+                if not self.order_by or self.endpoints_changed():
+                    self.order_by = self.get_order_by()
 
                 super().save(*args, **kwargs)
 
             def __str__(self):
-                return '{}: {} ⟷  {}: {}'.format(
-                    self.data_content_type.name.upper(),
+                return format_relationship_label(
+                    self.data_content_type,
                     self.data_content_object,
-                    self.publication_content_type.name.upper(),
+                    self.publication_content_type,
                     self.publication_content_object
                 )
 
@@ -276,13 +471,24 @@ def generate_relationship_model(relationship):
         object_2_velcro_type.capitalize())
     typedict = {
         '__module__': __name__,
-        'order_by': models.CharField(max_length=255, blank=True)
+        'order_by': models.CharField(
+            max_length=ORDER_BY_MAX_LENGTH, blank=True, db_index=True),
+        'velcro_types': (object_1_velcro_type, object_2_velcro_type),
     }
 
     if object_1_velcro_type == object_2_velcro_type:
         RelationshipBase = _generate_relationship_model_sametype(
             object_1_velcro_type)
+        typedict['velcro_fields'] = (
+            ('content_type_1', 'object_pk_1', 'content_object_1'),
+            ('content_type_2', 'object_pk_2', 'content_object_2'),
+        )
     else:
+        typedict['velcro_fields'] = tuple(
+            ('{}_content_type'.format(vt), '{}_object_pk'.format(vt),
+             '{}_content_object'.format(vt))
+            for vt in (object_1_velcro_type, object_2_velcro_type)
+        )
         RelationshipBase, typedict = _generate_relationship_model_difftype(
             relationship, typedict)
 
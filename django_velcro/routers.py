@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+
+from .app_settings import (VELCRO_DATABASE, VELCRO_DATABASE_REPLICAS,
+    VELCRO_DATABASE_STICKY_SECONDS)
+
+
+_state = threading.local()
+
+
+def _is_velcro_model(model):
+    """
+    Return 'True' if a model belongs to Django Velcro (e.g., a generated
+    relationship model).
+    """
+    return model._meta.app_label == 'django_velcro'
+
+def mark_written(using):
+    """
+    Send relationship reads from the current thread to 'VELCRO_DATABASE'
+    for the next 'VELCRO_DATABASE_STICKY_SECONDS' seconds, after a write to
+    it. This is called by 'graph_atomic()' once a write has committed.
+    """
+    if using == VELCRO_DATABASE:
+        _state.last_write = time.time()
+
+def recently_written():
+    """
+    Return 'True' if the current thread has written to the velcro database
+    within the last 'VELCRO_DATABASE_STICKY_SECONDS' seconds.
+    """
+    last_write = getattr(_state, 'last_write', None)
+    return (last_write is not None and
+            time.time() - last_write < VELCRO_DATABASE_STICKY_SECONDS)
+
+class VelcroRouter(object):
+    """
+    Database router for Django Velcro's relationship models.
+
+    Relationship writes go to 'VELCRO_DATABASE' (default: 'default'), which
+    lets relationship tables live on their own database. Relationship reads
+    go to a randomly chosen database from 'VELCRO_DATABASE_REPLICAS', except
+    within 'VELCRO_DATABASE_STICKY_SECONDS' of a committed write from the
+    same thread, when they go to 'VELCRO_DATABASE' so that writes are
+    immediately visible to the code that made them. Models from other apps
+    are left to the remaining routers.
+
+    Relationship rows store content type ids read from the 'contenttypes'
+    table of the database that 'ContentType' is routed to (usually
+    'default'). The 'contenttypes' app is never migrated to a separate
+    'VELCRO_DATABASE', since that would create content types with ids of
+    its own. If relationship tables live on their own database, give it a
+    copy of the 'contenttypes' table that is kept identical to the one on
+    'default' (e.g., by replication, or by loading a dump of it after
+    migrations), so ids match for foreign keys and joins.
+
+    Usage:
+
+        # settings.py:
+        DATABASE_ROUTERS = ['django_velcro.routers.VelcroRouter']
+        VELCRO_DATABASE = 'velcro'
+        VELCRO_DATABASE_REPLICAS = ['velcro_replica_1', 'velcro_replica_2']
+        VELCRO_DATABASE_STICKY_SECONDS = 2
+    """
+    def db_for_read(self, model, **hints):
+        if not _is_velcro_model(model):
+            return None
+
+        if VELCRO_DATABASE_REPLICAS and not recently_written():
+            return random.choice(VELCRO_DATABASE_REPLICAS)
+
+        return VELCRO_DATABASE
+
+    def db_for_write(self, model, **hints):
+        if not _is_velcro_model(model):
+            return None
+
+        return VELCRO_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if (_is_velcro_model(obj1.__class__) or
+                _is_velcro_model(obj2.__class__)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'django_velcro':
+            return db == VELCRO_DATABASE
+        return None
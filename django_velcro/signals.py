@@ -0,0 +1,93 @@
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save
+
+from .app_settings import VELCRO_METADATA, VELCRO_ORDER_BY_SIGNALS
+from .models import RelationshipChange
+from .utils import (_record_relationship_changes, get_relationship_classes,
+    touch_relationship_versions, update_related_order_by)
+
+
+def _startup():
+    """
+    Connect signal receivers that keep relationship versions up to date and
+    relationship 'order_by' labels in sync with the velcro-managed objects
+    they describe.
+
+    To disable the 'order_by' receivers (e.g., if labels are refreshed
+    periodically with the 'velcroorderby' management command instead), add
+    to 'settings.py':
+
+        VELCRO_ORDER_BY_SIGNALS = False
+    """
+    for relationship_class in get_relationship_classes():
+        post_save.connect(
+            relationship_saved,
+            sender=relationship_class,
+            dispatch_uid='velcro_saved_{}'.format(relationship_class.__name__),
+        )
+        post_delete.connect(
+            relationship_deleted,
+            sender=relationship_class,
+            dispatch_uid='velcro_deleted_{}'.format(
+                relationship_class.__name__),
+        )
+
+    if VELCRO_ORDER_BY_SIGNALS == False:
+        return
+
+    for velcro_type, velcro_type_metadata in VELCRO_METADATA.items():
+        for model_metadata in velcro_type_metadata['apps']:
+            app_name = model_metadata['app_label']
+            model_name = model_metadata['model']
+            model = apps.get_model(app_name, model_name)
+            post_save.connect(
+                update_order_by_labels,
+                sender=model,
+                dispatch_uid='velcro_order_by_{}_{}'.format(
+                    app_name, model_name),
+            )
+
+def relationship_deleted(sender, instance, using, **kwargs):
+    """
+    Give new relationship versions to both ends of a deleted relationship
+    and log its removal. Deletions run in a transaction, so the log entry is
+    committed with them.
+    """
+    _record_relationship_changes(
+        sender, RelationshipChange.REMOVE, [instance.get_endpoints()], using)
+    touch_relationship_versions(instance.get_endpoints())
+
+def relationship_saved(sender, instance, created, raw, using, **kwargs):
+    """
+    Give new relationship versions to both ends of a saved relationship, and
+    to its previous ends if they were changed, and log the change.
+    Relationship models save in a transaction, so the log entries are
+    committed with the relationship.
+    """
+    endpoints = instance.get_endpoints()
+    loaded_endpoints = getattr(instance, '_loaded_endpoints', None)
+
+    if created:
+        _record_relationship_changes(
+            sender, RelationshipChange.ADD, [endpoints], using)
+    elif loaded_endpoints is not None and loaded_endpoints != endpoints:
+        _record_relationship_changes(
+            sender, RelationshipChange.REMOVE, [loaded_endpoints], using)
+        _record_relationship_changes(
+            sender, RelationshipChange.ADD, [endpoints], using)
+
+    touch_relationship_versions(endpoints + (loaded_endpoints or ()))
+
+def update_order_by_labels(sender, instance, created, raw, **kwargs):
+    """
+    Refresh the 'order_by' labels of relationships that include a
+    velcro-managed object after it has been saved. Newly created objects
+    can't be part of any relationships yet, so they are skipped.
+    """
+    if created or raw:
+        return
+
+    update_related_order_by(instance)
+
+
+_startup()
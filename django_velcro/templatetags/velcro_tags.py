@@ -1,6 +1,6 @@
 from django import template
 
-from django_velcro.settings import VELCRO_METADATA
+from django_velcro.debug import velcro_trace
 from django_velcro.utils import (get_velcro_type, get_related_content,
     get_url_of_object, has_related_content, plural_velcro_type)
 
@@ -8,6 +8,7 @@ from django_velcro.utils import (get_velcro_type, get_related_content,
 register = template.Library()
 
 @register.assignment_tag
+@velcro_trace
 def get_velcro_related(obj, verbose=False):
     """
     Get related content and assign it to a variable.
@@ -18,6 +19,7 @@ def get_velcro_related(obj, verbose=False):
     return get_related_content(obj, verbose=verbose)
 
 @register.simple_tag
+@velcro_trace
 def velcro_url(related_object, related_type=None):
     """
     Template tag to get the reverse URL for a related object.
@@ -27,6 +29,7 @@ def velcro_url(related_object, related_type=None):
     return get_url_of_object(obj=related_object, velcro_type=related_type)
 
 @register.inclusion_tag('django_velcro/velcro_link.html')
+@velcro_trace
 def velcro_link(related_object, related_type=None):
     """
     Make a link to a related object. Contains entire '<a href>' tag.
@@ -62,6 +65,7 @@ def velcro_plural(value, arg=None):
     return plural.title()
 
 @register.inclusion_tag('django_velcro/related_content.html')
+@velcro_trace
 def velcro_related(obj, label=None, label_tag='h3', prefix=None):
     """
     Template tag to list related content organized by related type.
@@ -0,0 +1,130 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_velcro.utils import add_related_content, set_related_content
+
+from .testapp.models import Data, DataSet, Publication
+
+
+# Fan-out sizes that query budgets are checked at. Budgets must hold at
+# every size, which shows that costs don't grow with the number of
+# related objects.
+SIZES = (1, 5, 25)
+
+
+def create_fan_out(size):
+    """
+    Create and return a 'hub' Data object related to 'size' other Data
+    objects and to 'size' publications. Each publication is also related
+    to a 'peer' Data object of its own, so the hub has 'size' objects of
+    the same type related via publications.
+    """
+    hub = Data.objects.create(name='hub {}'.format(size))
+    friends = [
+        Data.objects.create(name='friend {} {}'.format(size, i))
+        for i in range(size)
+    ]
+    publications = [
+        Publication.objects.create(title='publication {} {}'.format(size, i))
+        for i in range(size)
+    ]
+    set_related_content(hub, 'data', friends)
+    set_related_content(hub, 'publication', publications)
+
+    for i, publication in enumerate(publications):
+        peer = Data.objects.create(name='peer {} {}'.format(size, i))
+        add_related_content(peer, publication)
+
+    return hub
+
+def fan_out_names(hub):
+    """
+    Return a dict with the sorted names of the 'data' and 'publication'
+    objects related to a hub created by 'create_fan_out()', and of its
+    'peer' Data objects related via publications.
+    """
+    size = int(hub.name.split()[1])
+    return {
+        prefix: sorted(
+            '{} {} {}'.format(name, size, i) for i in range(size))
+        for prefix, name in (
+            ('data', 'friend'), ('publication', 'publication'),
+            ('peer', 'peer'))
+    }
+
+def record_deletes(test_case, relationship_class):
+    """
+    Return a list that collects the instances of a relationship class that
+    'post_delete' is sent for until the end of a test.
+    """
+    deleted = []
+    dispatch_uid = 'test_{}'.format(id(deleted))
+    post_delete.connect(
+        lambda **kwargs: deleted.append(kwargs['instance']),
+        sender=relationship_class, weak=False, dispatch_uid=dispatch_uid)
+    test_case.addCleanup(
+        post_delete.disconnect, sender=relationship_class,
+        dispatch_uid=dispatch_uid)
+    return deleted
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Base class for tests that pin the number of queries run by velcro code
+    paths at each fan-out size in 'SIZES'.
+    """
+    def setUp(self):
+        ContentType.objects.clear_cache()
+        ContentType.objects.get_for_models(Data, DataSet, Publication)
+
+    def count_queries(self, func, *args, **kwargs):
+        """
+        Return the number of queries run by 'func(*args, **kwargs)'.
+        """
+        with CaptureQueriesContext(connection) as context:
+            func(*args, **kwargs)
+        return len(context.captured_queries)
+
+    def assertQueryBudget(self, budget, func):
+        """
+        Assert that 'func(hub)' runs exactly 'budget' queries for hubs of
+        every size in 'SIZES', and return a list of '(hub, result)' pairs
+        for checking the results.
+        """
+        results = []
+        for size in SIZES:
+            hub = create_fan_out(size)
+            with self.assertNumQueries(budget):
+                results.append((hub, func(hub)))
+        return results
+
+    def assertConstantCounts(self, counts, maximum):
+        """
+        Assert that a list of query counts, one per size in 'SIZES', are
+        all equal and at most 'maximum'. Use this where the exact count
+        depends on the database backend or Django internals (e.g.,
+        savepoints or admin sessions).
+        """
+        self.assertEqual(
+            len(set(counts)), 1,
+            'Query counts grow with fan-out: {}'.format(
+                dict(zip(SIZES, counts))))
+        self.assertLessEqual(counts[0], maximum)
+
+    def assertConstantQueries(self, maximum, func):
+        """
+        Assert that 'func(hub)' runs the same number of queries, and at most
+        'maximum' queries, for hubs of every size in 'SIZES', and return a
+        list of '(hub, result)' pairs for checking the results.
+        """
+        results = []
+        counts = []
+        for size in SIZES:
+            hub = create_fan_out(size)
+            with CaptureQueriesContext(connection) as context:
+                results.append((hub, func(hub)))
+            counts.append(len(context.captured_queries))
+        self.assertConstantCounts(counts, maximum)
+        return results
@@ -0,0 +1,109 @@
+"""
+Settings for the Django Velcro test suite.
+
+Run the tests from the repository root with:
+
+    django-admin test django_velcro --settings=django_velcro.tests.settings \
+        --pythonpath=.
+"""
+SECRET_KEY = 'django-velcro-tests'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+INSTALLED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.messages',
+    'django.contrib.sessions',
+    'genericadmin',
+    'django_velcro.tests.testapp',
+    'django_velcro',
+)
+
+# Relationship models are generated from the settings below, so there are
+# no shipped migrations for django_velcro. Pointing it at a missing module
+# makes Django create its tables directly, as for an unmigrated app.
+MIGRATION_MODULES = {
+    'django_velcro': 'django_velcro.tests.no_migrations',
+}
+
+MIDDLEWARE_CLASSES = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+)
+
+ROOT_URLCONF = 'django_velcro.tests.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+                'django.template.context_processors.request',
+            ],
+        },
+    },
+]
+
+VELCRO_METADATA = {
+    'data': {
+        'apps': [
+            {
+                'app_label': 'testapp',
+                'model': 'Data',
+                'view': 'testapp:data-detail',
+                'url_args': ['pk'],
+                'label_fields': ['name'],
+            },
+            {
+                'app_label': 'testapp',
+                'model': 'DataSet',
+                'view': 'testapp:dataset-detail',
+                'url_args': ['pk'],
+                'label_fields': ['name'],
+            },
+        ],
+        'options': {
+            'verbose_name': 'data',
+            'verbose_name_plural': 'data',
+        },
+    },
+    'publication': {
+        'apps': [
+            {
+                'app_label': 'testapp',
+                'model': 'Publication',
+                'view': 'testapp:publication-detail',
+                'url_args': ['pk'],
+                'label_fields': ['title'],
+            },
+        ],
+        'options': {
+            'verbose_name': 'publication',
+            'verbose_name_plural': 'publications',
+        },
+    },
+}
+
+VELCRO_RELATIONSHIPS = [
+    ('data', 'data'),
+    ('data', 'publication'),
+]
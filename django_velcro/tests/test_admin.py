@@ -1,3 +1,264 @@
-from django.test import TestCase
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.db.models import Q
+from django.test import RequestFactory
+from genericadmin.admin import GenericAdminModelAdmin
 
-# Create your tests here.
+from django_velcro.admin import (DataToDataRelationshipReverseInline,
+    LargeTableAdminMixin, estimate_row_count)
+from django_velcro.utils import (_endpoint_orientations, add_related_content,
+    get_related_content, get_relationship_class, has_related_content)
+
+from .base import QueryBudgetTestCase, create_fan_out, fan_out_names
+from .testapp.models import Data, Publication
+
+
+class AdminQueryTests(QueryBudgetTestCase):
+    """
+    Admin pages run a fixed number of queries for the session, user and
+    page, whatever the number of relationships shown.
+    """
+    def setUp(self):
+        super().setUp()
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertListsHub(self, results, related_type):
+        """
+        Assert that each changelist response lists the relationships of
+        its hub with objects of a related type.
+        """
+        relationship_class = get_relationship_class('data', related_type)
+        content_type = ContentType.objects.get_for_model(Data)
+        for hub, response in results:
+            query = Q()
+            for (ct_field, pk_field), _ in _endpoint_orientations(
+                    relationship_class, 'data'):
+                query |= Q(**{ct_field: content_type, pk_field: hub.pk})
+            hub_pks = set(relationship_class.objects.filter(
+                query).values_list('pk', flat=True))
+            self.assertEqual(len(hub_pks), int(hub.name.split()[1]))
+            self.assertLessEqual(hub_pks, {
+                relationship.pk
+                for relationship in response.context_data['cl'].result_list
+            })
+
+    def test_relationship_changelist(self):
+        url = reverse(
+            'admin:django_velcro_datapublicationrelationship_changelist')
+        self.assertListsHub(
+            self.assertConstantQueries(20, lambda hub: self.get(url)),
+            'publication')
+
+    def test_sametype_relationship_changelist(self):
+        url = reverse('admin:django_velcro_datadatarelationship_changelist')
+        self.assertListsHub(
+            self.assertConstantQueries(20, lambda hub: self.get(url)),
+            'data')
+
+    def test_change_view_inlines(self):
+        for hub, response in self.assertConstantQueries(40, lambda hub: (
+                self.get(reverse('admin:testapp_data_change',
+                                 args=[hub.pk])))):
+            expected = fan_out_names(hub)
+            formsets = [
+                inline_admin_formset.formset for inline_admin_formset in
+                response.context_data['inline_admin_formsets']
+            ]
+            self.assertEqual(
+                [formset.initial_form_count() for formset in formsets],
+                [len(expected['data']), len(expected['publication'])])
+
+    def test_symmetric_inline(self):
+        hub = create_fan_out(3)
+        other = Data.objects.create(name='other')
+        add_related_content(other, hub)
+
+        response = self.client.get(
+            reverse('admin:testapp_data_change', args=[hub.pk]))
+        formsets = [
+            inline_admin_formset.formset
+            for inline_admin_formset in response.context[
+                'inline_admin_formsets']
+            if inline_admin_formset.formset.model._meta.model_name ==
+            'datadatarelationship'
+        ]
+        self.assertEqual(len(formsets), 1)
+
+        related = [
+            relationship.content_object_2
+            for relationship in formsets[0].get_queryset()
+        ]
+        self.assertEqual(len(related), 4)
+        self.assertIn(other, related)
+        self.assertNotIn(hub, related)
+
+    def test_symmetric_inline_save(self):
+        hub = Data.objects.create(name='hub')
+        other = Data.objects.create(name='other')
+        moved = Data.objects.create(name='moved')
+        model = apps.get_model('django_velcro', 'DataDataRelationship')
+        relationship = model.objects.create(
+            content_object_1=other, content_object_2=hub)
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='admin')
+        inline = DataToDataRelationshipReverseInline(Data, admin.site)
+        formset_class = inline.get_formset(request, hub)
+        formset = formset_class(instance=hub)
+        self.assertEqual(formset.forms[0].initial['object_pk_2'], other.pk)
+
+        data = {
+            '{}-TOTAL_FORMS'.format(formset.prefix): '1',
+            '{}-INITIAL_FORMS'.format(formset.prefix): '1',
+            '{}-0-id'.format(formset.prefix): relationship.pk,
+            '{}-0-content_type_2'.format(formset.prefix): (
+                ContentType.objects.get_for_model(Data).pk),
+            '{}-0-object_pk_2'.format(formset.prefix): moved.pk,
+        }
+        formset = formset_class(data, instance=hub)
+        self.assertTrue(formset.is_valid())
+        formset.save()
+
+        relationship = model.objects.get(pk=relationship.pk)
+        self.assertEqual(
+            (relationship.object_pk_1, relationship.object_pk_2),
+            (moved.pk, hub.pk))
+        self.assertEqual(relationship.order_by, relationship.get_order_by())
+        self.assertEqual(
+            get_related_content(hub, 'data')['data'], [moved])
+
+        data['{}-0-DELETE'.format(formset.prefix)] = 'on'
+        formset = formset_class(data, instance=hub)
+        self.assertTrue(formset.is_valid())
+        formset.save()
+        self.assertFalse(has_related_content(hub))
+
+    def test_symmetric_inline_queryset(self):
+        hub = Data.objects.create(name='hub')
+        first = Data.objects.create(name='first')
+        second = Data.objects.create(name='second')
+        model = apps.get_model('django_velcro', 'DataDataRelationship')
+        model.objects.create(content_object_1=hub, content_object_2=first)
+        reversed_relationship = model.objects.create(
+            content_object_1=second, content_object_2=hub)
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='admin')
+        inline = DataToDataRelationshipReverseInline(Data, admin.site)
+        formset_class = inline.get_formset(request, hub)
+
+        # Rows are listed with the other end second, whichever end the
+        # object is on
+        formset = formset_class(instance=hub)
+        self.assertIsInstance(formset.get_queryset(), list)
+        self.assertEqual(
+            [(row.object_pk_1, row.object_pk_2)
+             for row in formset.get_queryset()],
+            [(hub.pk, first.pk), (hub.pk, second.pk)])
+
+        formset = formset_class(
+            instance=hub,
+            queryset=model.objects.filter(pk=reversed_relationship.pk))
+        self.assertEqual(len(formset.forms), 1 + formset.extra)
+        self.assertEqual(
+            formset.forms[0].initial['object_pk_2'], second.pk)
+
+    def test_relate_selected_action(self):
+        publication = Publication.objects.create(title='target')
+        data = [Data.objects.create(name=str(i)) for i in range(5)]
+        url = reverse('admin:testapp_data_changelist')
+        params = {
+            'action': 'relate_selected',
+            ACTION_CHECKBOX_NAME: [obj.pk for obj in data],
+        }
+
+        response = self.client.post(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(
+            response, 'admin/django_velcro/relate_selected.html')
+
+        params.update({
+            'apply': 'yes',
+            'content_type': ContentType.objects.get_for_model(Publication).pk,
+            'object_pk': publication.pk,
+        })
+        response = self.client.post(url, params)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            len(get_related_content(publication, 'data')['data']), 5)
+
+        params['action'] = 'unrelate_selected'
+        response = self.client.post(url, params)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(has_related_content(publication))
+
+
+class LargeTableAdminTests(QueryBudgetTestCase):
+    """
+    The large-table changelist pages by primary key without counting the
+    filtered rows.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'admin')
+        self.model = apps.get_model(
+            'django_velcro', 'DataPublicationRelationship')
+        self.model_admin = type(
+            'LargeTableAdmin',
+            (LargeTableAdminMixin, GenericAdminModelAdmin),
+            {})(self.model, admin.site)
+
+    def changelist(self, **params):
+        request = RequestFactory().get('/', params)
+        request.user = self.user
+        response = self.model_admin.changelist_view(request)
+        self.assertEqual(response.status_code, 200)
+        return response.context_data['cl']
+
+    def test_estimate_row_count(self):
+        create_fan_out(5)
+        self.assertEqual(
+            estimate_row_count(self.model, 'default'),
+            self.model.objects.count())
+
+    def test_keyset_pages(self):
+        create_fan_out(5)
+        self.model_admin.list_per_page = 4
+        pks = list(self.model.objects.order_by('pk').values_list(
+            'pk', flat=True))
+
+        seen = []
+        cl = self.changelist()
+        while True:
+            seen.extend(obj.pk for obj in cl.result_list)
+            if cl.next_after is None:
+                break
+            cl = self.changelist(after=cl.next_after)
+        self.assertEqual(seen, pks)
+
+    def test_invalid_after(self):
+        create_fan_out(5)
+        self.model_admin.list_per_page = 4
+        first_page = [obj.pk for obj in self.changelist().result_list]
+
+        cl = self.changelist(after='abc')
+        self.assertEqual([obj.pk for obj in cl.result_list], first_page)
+
+    def test_search_ignores_case(self):
+        create_fan_out(2)
+        label = self.model.objects.order_by('pk')[0].order_by
+        cl = self.changelist(q=label[:8].lower())
+        self.assertTrue(cl.result_list)
+        for obj in cl.result_list:
+            self.assertTrue(obj.order_by.startswith(label[:8]))
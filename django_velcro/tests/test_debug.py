@@ -0,0 +1,78 @@
+from unittest import mock
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse, JsonResponse
+from django.test import RequestFactory
+
+from django_velcro import debug, middleware
+from django_velcro.utils import get_related_content, get_relationship_class
+
+from .base import QueryBudgetTestCase, create_fan_out
+
+
+class VelcroDebugMiddlewareTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        for module in (debug, middleware):
+            patcher = mock.patch.object(module, 'VELCRO_DEBUG', True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.hub = create_fan_out(3)
+        self.middleware = middleware.VelcroDebugMiddleware()
+        self.request = RequestFactory().get('/')
+
+    def trace(self, response):
+        """
+        Run a traced velcro lookup nested in a traced view through the
+        middleware and return the processed response.
+        """
+        lookup = debug.velcro_trace(get_related_content)
+
+        @debug.velcro_trace(name='view')
+        def view(request):
+            lookup(self.hub, 'publication')
+            return response
+
+        self.middleware.process_request(self.request)
+        self.assertTrue(connection.force_debug_cursor)
+        return self.middleware.process_response(
+            self.request, view(self.request))
+
+    def test_not_used(self):
+        with mock.patch.object(middleware, 'VELCRO_DEBUG', False):
+            with self.assertRaises(MiddlewareNotUsed):
+                middleware.VelcroDebugMiddleware()
+
+    def test_panel(self):
+        response = HttpResponse('<html><body><p>page</p></body></html>')
+        response['Content-Length'] = len(response.content)
+        response = self.trace(response)
+        content = response.content.decode()
+        self.assertIn('<p>page</p><div id="velcro-debug"', content)
+        self.assertIn('view &gt; get_related_content (publication)', content)
+        self.assertIn(
+            get_relationship_class('data', 'publication')._meta.db_table,
+            content)
+        self.assertEqual(
+            int(response['Content-Length']), len(response.content))
+        self.assertFalse(connection.force_debug_cursor)
+
+    def test_not_html(self):
+        response = self.trace(JsonResponse({'page': 1}))
+        self.assertEqual(response.content, b'{"page": 1}')
+        self.assertFalse(connection.force_debug_cursor)
+
+    def test_labels(self):
+        traced = debug.velcro_trace(get_related_content)
+        debug.start_tracing()
+        start = len(connection.queries_log)
+        with mock.patch.object(connection, 'force_debug_cursor', True):
+            traced(self.hub, 'data')
+            end = len(connection.queries_log)
+        labels = debug.stop_tracing()
+        self.assertEqual(
+            {labels[('default', i)] for i in range(start, end)},
+            {('get_related_content', 'data')})
+        # Tracing is off until it is started again
+        self.assertIsNone(getattr(debug._state, 'labels'))
@@ -0,0 +1,56 @@
+from django_velcro.expressions import VelcroCount, VelcroExists
+from django_velcro.utils import add_related_content
+
+from .base import QueryBudgetTestCase, create_fan_out
+from .testapp.models import Data, DataSet, Publication
+
+
+class ExpressionTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hub = create_fan_out(3)
+        self.lonely = Data.objects.create(name='lonely')
+        self.data_set = DataSet.objects.create(name='data set')
+        add_related_content(
+            self.data_set, Publication.objects.create(title='publication'))
+
+    def test_count(self):
+        with self.assertNumQueries(1):
+            counts = dict(Data.objects.annotate(
+                n=VelcroCount('publication')).values_list('name', 'n'))
+        self.assertEqual(counts['hub 3'], 3)
+        self.assertEqual(counts['peer 3 0'], 1)
+        self.assertEqual(counts['lonely'], 0)
+        self.assertEqual(DataSet.objects.annotate(
+            n=VelcroCount('publication')).get().n, 1)
+
+    def test_count_sametype(self):
+        # Same-type relationships are counted from both ends
+        friend = Data.objects.get(name='friend 3 0')
+        add_related_content(friend, self.lonely)
+        counts = dict(Data.objects.annotate(
+            n=VelcroCount('data')).values_list('name', 'n'))
+        self.assertEqual(counts['hub 3'], 3)
+        self.assertEqual(counts['friend 3 0'], 2)
+        self.assertEqual(counts['lonely'], 1)
+
+    def test_filter(self):
+        self.assertEqual(
+            list(Data.objects.annotate(n=VelcroCount('publication')).filter(
+                n__gte=2)),
+            [self.hub])
+        self.assertEqual(
+            set(Data.objects.annotate(e=VelcroExists('data')).filter(
+                e=False).values_list('name', flat=True)),
+            {'peer 3 0', 'peer 3 1', 'peer 3 2', 'lonely'})
+
+    def test_exists(self):
+        with self.assertNumQueries(1):
+            exists = dict(Data.objects.annotate(
+                e=VelcroExists('publication')).values_list('name', 'e'))
+        self.assertTrue(exists['hub 3'])
+        self.assertFalse(exists['lonely'])
+
+    def test_invalid_related_type(self):
+        with self.assertRaises(ValueError):
+            Publication.objects.annotate(n=VelcroCount('publication'))
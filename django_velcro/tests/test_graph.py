@@ -0,0 +1,115 @@
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from django_velcro import graph
+from django_velcro.utils import (add_related_content, get_related_content,
+    get_related_content_sametype, has_related_content,
+    remove_related_content)
+
+from .base import SIZES, QueryBudgetTestCase, create_fan_out, fan_out_names
+from .testapp.models import Publication
+
+
+class GraphSnapshotTests(QueryBudgetTestCase):
+    """
+    With a graph snapshot, relationships are resolved in memory, so only the
+    related objects themselves are fetched.
+    """
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(graph, 'VELCRO_GRAPH_SNAPSHOT', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        graph._graph = None
+        self.addCleanup(setattr, graph, '_graph', None)
+
+    def load(self, hub):
+        graph._graph = None
+        graph.get_graph()
+        return hub
+
+    def test_query_budgets(self):
+        for size in SIZES:
+            hub = self.load(create_fan_out(size))
+            expected = fan_out_names(hub)
+            with self.assertNumQueries(2):
+                related_content = get_related_content(hub)
+            for rt in ('data', 'publication'):
+                self.assertEqual(
+                    sorted(str(obj) for obj in related_content[rt]),
+                    expected[rt])
+            with self.assertNumQueries(0):
+                self.assertTrue(has_related_content(hub))
+            with self.assertNumQueries(1):
+                related_content = get_related_content_sametype(
+                    hub, 'publication')
+            self.assertEqual(
+                sorted(str(obj) for obj in related_content), expected['peer'])
+
+class GraphTransactionTests(TransactionTestCase):
+    """
+    Changes made by this process reach the graph snapshot once they are
+    committed, and never if they are rolled back.
+    """
+    def setUp(self):
+        patcher = mock.patch.object(graph, 'VELCRO_GRAPH_SNAPSHOT', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ContentType.objects.clear_cache()
+        graph._graph = None
+        self.addCleanup(setattr, graph, '_graph', None)
+
+    def related_publications(self, hub):
+        return get_related_content(hub, 'publication')['publication']
+
+    def test_local_changes(self):
+        hub = create_fan_out(3)
+        graph.get_graph()
+        publication = Publication.objects.create(title='new')
+
+        add_related_content(hub, publication)
+        self.assertIn(publication, self.related_publications(hub))
+
+        remove_related_content(hub, publication)
+        self.assertNotIn(publication, self.related_publications(hub))
+
+    def test_no_reload_for_local_changes(self):
+        hub = create_fan_out(3)
+        graph.get_graph()
+        publication = Publication.objects.create(title='new')
+        add_related_content(hub, publication)
+
+        # Without the change log, this process's own changes don't make it
+        # reload its snapshot at the next check
+        graph._graph._next_check = 0
+        with mock.patch.object(graph.RelationshipGraph, 'load') as load:
+            self.assertIn(publication, self.related_publications(hub))
+        self.assertFalse(load.called)
+
+    def test_reload_for_other_changes(self):
+        hub = create_fan_out(3)
+        graph.get_graph()
+        # Another process changes the graph
+        cache.incr(graph.GRAPH_VERSION_KEY)
+        add_related_content(hub, Publication.objects.create(title='new'))
+
+        graph._graph._next_check = 0
+        with mock.patch.object(graph.RelationshipGraph, 'load') as load:
+            graph.get_graph()
+        self.assertTrue(load.called)
+
+    def test_rollback(self):
+        hub = create_fan_out(3)
+        graph.get_graph()
+        publication = Publication.objects.create(title='new')
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                add_related_content(hub, publication)
+                raise RuntimeError
+        self.assertNotIn(publication, self.related_publications(hub))
+        self.assertEqual(len(self.related_publications(hub)), 3)
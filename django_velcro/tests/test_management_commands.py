@@ -1,3 +1,296 @@
+import json
+import unittest
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import CommandError, call_command
 from django.test import TestCase
 
-# Create your tests here.
+from django_velcro import graph, utils
+from django_velcro.management.commands.velcrowarm import chunks_from_lookups
+from django_velcro.models import RelationshipChange
+from django_velcro.utils import (add_related_content, get_relationship_class,
+    get_similar_content, remove_related_content)
+
+from .base import record_deletes
+from .testapp.models import Data, Publication
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import scipy
+except ImportError:
+    scipy = None
+
+
+def create_relationships(relationship_class, pairs):
+    """
+    Insert relationships with 'bulk_create()', bypassing the checks in
+    'save()', to simulate rows written concurrently or by old versions.
+    """
+    (_, _, field_1), (_, _, field_2) = relationship_class.velcro_fields
+    relationship_class.objects.bulk_create([
+        relationship_class(**{field_1: object_1, field_2: object_2})
+        for object_1, object_2 in pairs
+    ])
+
+
+@unittest.skipIf(numpy is None, 'velcroclusters requires NumPy')
+class VelcroClustersTests(TestCase):
+    def setUp(self):
+        data = [Data.objects.create(name=str(i)) for i in range(4)]
+        publication = Publication.objects.create(title='publication')
+        add_related_content(data[0], data[1])
+        add_related_content(data[1], publication)
+        add_related_content(data[2], data[3])
+
+    def run_command(self, *args):
+        stdout = StringIO()
+        call_command('velcroclusters', *args, stdout=stdout, stderr=StringIO())
+        return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+    def test_components(self):
+        summary, largest, second = self.run_command('--members')
+        self.assertEqual(summary['objects'], 5)
+        self.assertEqual(summary['relationships'], 3)
+        self.assertEqual(summary['components'], 2)
+        self.assertEqual(summary['sizes'], [[3, 1], [2, 1]])
+        self.assertEqual(largest['size'], 3)
+        self.assertEqual(len(largest['members']), 3)
+        self.assertEqual(second['size'], 2)
+
+    def test_save(self):
+        self.run_command('--save')
+        component_class = apps.get_model(
+            'django_velcro', 'RelationshipComponent')
+        self.assertEqual(component_class.objects.count(), 5)
+        self.assertEqual(
+            sorted(component_class.objects.values_list('size', flat=True)),
+            [2, 2, 3, 3, 3])
+
+
+@unittest.skipIf(
+    numpy is None or scipy is None,
+    'velcrosimilarity requires NumPy and SciPy')
+class VelcroSimilarityTests(TestCase):
+    def setUp(self):
+        self.a, self.b, self.c = [
+            Data.objects.create(name=name) for name in 'abc']
+        self.p, self.q = [
+            Publication.objects.create(title=title) for title in 'pq']
+        for obj, publications in (
+                (self.a, [self.p, self.q]),
+                (self.b, [self.p, self.q]),
+                (self.c, [self.p])):
+            for publication in publications:
+                add_related_content(obj, publication)
+
+    def run_command(self, *args):
+        stdout = StringIO()
+        call_command('velcrosimilarity', *args, stdout=stdout)
+        return stdout.getvalue().splitlines()
+
+    def test_precomputed(self):
+        self.assertEqual(self.run_command('--batch-size', '4'), [
+            'data: 6 similar content rows written',
+            'publication: 2 similar content rows written',
+        ])
+        self.assertEqual(
+            get_similar_content(self.a, precomputed=True),
+            [(self.b, 2.0), (self.c, 1.0)])
+        self.assertEqual(
+            get_similar_content(self.a, precomputed=True, top_k=1),
+            [(self.b, 2.0)])
+        self.assertEqual(
+            get_similar_content(self.p, precomputed=True), [(self.q, 2.0)])
+
+    def test_top_k(self):
+        self.run_command('--top-k', '1', 'data')
+        self.assertEqual(
+            get_similar_content(self.c, precomputed=True), [(self.a, 1.0)])
+        self.assertEqual(
+            get_similar_content(self.p, precomputed=True), [])
+
+    def test_batches(self):
+        similar_content_class = apps.get_model(
+            'django_velcro', 'SimilarContent')
+        manager = similar_content_class.objects
+        with mock.patch.object(
+                manager, 'bulk_create',
+                wraps=manager.bulk_create) as bulk_create:
+            self.run_command('--batch-size', '4', 'data')
+        self.assertEqual(
+            [len(call[0][0]) for call in bulk_create.call_args_list], [4, 2])
+
+class VelcroChangesTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(utils, 'VELCRO_CHANGELOG', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data = [Data.objects.create(name=str(i)) for i in range(3)]
+        self.publication = Publication.objects.create(title='publication')
+        for data in self.data:
+            add_related_content(data, self.publication)
+        remove_related_content(self.data[0], self.publication)
+
+    def run_command(self, *args):
+        stdout = StringIO()
+        call_command('velcrochanges', *args, stdout=stdout, stderr=StringIO())
+        return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+    def test_output(self):
+        data_ct = ContentType.objects.get_for_model(Data).pk
+        publication_ct = ContentType.objects.get_for_model(Publication).pk
+        changes = self.run_command('--batch-size', '3')
+        self.assertEqual(
+            [change['seq'] for change in changes],
+            list(RelationshipChange.objects.values_list('seq', flat=True)))
+        self.assertEqual([
+            (change['op'], change['relationship_class'], change['a'],
+             change['b'])
+            for change in changes
+        ], [
+            (RelationshipChange.ADD, 'DataPublicationRelationship',
+             [data_ct, data.pk], [publication_ct, self.publication.pk])
+            for data in self.data
+        ] + [
+            (RelationshipChange.REMOVE, 'DataPublicationRelationship',
+             [data_ct, self.data[0].pk],
+             [publication_ct, self.publication.pk]),
+        ])
+
+    def test_after_and_limit(self):
+        seqs = list(
+            RelationshipChange.objects.values_list('seq', flat=True))
+        changes = self.run_command('--after', str(seqs[0]), '--limit', '2')
+        self.assertEqual([change['seq'] for change in changes], seqs[1:3])
+
+class VelcroWarmTests(TestCase):
+    def test_chunks_from_lookups(self):
+        a, b, c = [Data.objects.create(name=name) for name in 'abc']
+        lookups = [
+            {'pk': str(c.pk)}, {'pk': str(a.pk)}, {'pk': '0'},
+            {'pk': str(b.pk)},
+        ]
+        # Most requested objects come first; missing ones are skipped
+        self.assertEqual(
+            list(chunks_from_lookups(Data, lookups, {}, 3)), [[c, a], [b]])
+        self.assertEqual(
+            list(chunks_from_lookups(
+                Data, [{'name': 'b'}, {'name': 'a'}], {}, 10)),
+            [[b, a]])
+
+class VelcroOrderByTests(TestCase):
+    def setUp(self):
+        self.data = [Data.objects.create(name=str(i)) for i in range(3)]
+        self.data_data = get_relationship_class('data', 'data')
+        add_related_content(self.data[0], self.data[1])
+        add_related_content(self.data[1], self.data[2])
+        # Labels left behind by renames that bypassed the signals
+        self.data_data.objects.filter(
+            object_pk_1=self.data[0].pk).update(order_by='stale')
+
+    def run_command(self, *args):
+        stdout = StringIO()
+        call_command('velcroorderby', *args, stdout=stdout)
+        return stdout.getvalue().splitlines()
+
+    def test_resync(self):
+        self.assertEqual(
+            self.run_command('DataDataRelationship', '--batch-size', '1'),
+            ['DataDataRelationship: 2 checked, 1 updated'])
+        self.assertEqual(
+            sorted(self.data_data.objects.values_list('order_by', flat=True)),
+            ['DATA: 0 ⟷  DATA: 1', 'DATA: 1 ⟷  DATA: 2'])
+        self.assertEqual(
+            self.run_command('DataDataRelationship'),
+            ['DataDataRelationship: 2 checked, 0 updated'])
+
+    def test_start_after(self):
+        last_pk = self.data_data.objects.order_by('pk').last().pk
+        self.assertEqual(
+            self.run_command(
+                'DataDataRelationship', '--start-after', str(last_pk)),
+            ['DataDataRelationship: 0 checked, 0 updated'])
+
+    def test_unknown_model(self):
+        with self.assertRaises(CommandError):
+            self.run_command('NoSuchRelationship')
+
+class VelcroAuditTests(TestCase):
+    def setUp(self):
+        self.data = [Data.objects.create(name=str(i)) for i in range(3)]
+        self.publication = Publication.objects.create(title='publication')
+        self.data_data = get_relationship_class('data', 'data')
+        self.data_publication = get_relationship_class('data', 'publication')
+
+        a, b, c = self.data
+        create_relationships(self.data_data, [
+            (a, b), (a, b), (a, b), (b, a), (c, c), (b, c)])
+        create_relationships(self.data_publication, [
+            (a, self.publication), (a, self.publication)])
+
+    def run_command(self, *args):
+        stdout = StringIO()
+        call_command('velcroaudit', *args, stdout=stdout)
+        return stdout.getvalue().splitlines()
+
+    def test_report(self):
+        self.assertEqual(self.run_command(), [
+            'DataDataRelationship: 1 self-links, 0 content types outside '
+            'limit_choices_to, 2 exact duplicates, 1 reversed duplicates',
+            'DataPublicationRelationship: 0 self-links, 0 content types '
+            'outside limit_choices_to, 1 exact duplicates, 0 reversed '
+            'duplicates',
+        ])
+        self.assertEqual(self.data_data.objects.count(), 6)
+
+    def test_fix(self):
+        self.run_command('--fix')
+        a, b, c = self.data
+        self.assertEqual(
+            sorted(self.data_data.objects.values_list(
+                'object_pk_1', 'object_pk_2')),
+            sorted([(a.pk, b.pk), (b.pk, c.pk)]))
+        self.assertEqual(self.data_publication.objects.count(), 1)
+        self.assertEqual(self.run_command()[0], (
+            'DataDataRelationship: 0 self-links, 0 content types outside '
+            'limit_choices_to, 0 exact duplicates, 0 reversed duplicates'))
+
+    def test_fix_changelog(self):
+        patcher = mock.patch.object(utils, 'VELCRO_CHANGELOG', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        deleted = record_deletes(self, self.data_data)
+
+        self.run_command('--fix', '--batch-size', '2')
+        # Rows are deleted without loading them or sending signals
+        self.assertEqual(deleted, [])
+        self.assertEqual(RelationshipChange.objects.filter(
+            op=RelationshipChange.REMOVE).count(), 5)
+        # Duplicates are logged as added again, since a copy remains
+        self.assertEqual(RelationshipChange.objects.filter(
+            op=RelationshipChange.ADD).count(), 4)
+
+    def test_fix_graph(self):
+        patcher = mock.patch.object(graph, 'VELCRO_GRAPH_SNAPSHOT', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        graph._graph = None
+        self.addCleanup(setattr, graph, '_graph', None)
+
+        a, b, c = self.data
+        content_type_id = ContentType.objects.get_for_model(Data).pk
+        key = (content_type_id, a.pk)
+        self.assertEqual(
+            len(graph.get_graph().neighbours(self.data_data, 'data', key)), 4)
+
+        self.run_command('--fix')
+        self.assertEqual(
+            graph.get_graph().neighbours(self.data_data, 'data', key),
+            [(content_type_id, b.pk)])
@@ -1,3 +1,148 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.db import router
+
+from django_velcro import routers
+from django_velcro.models import ORDER_BY_MAX_LENGTH
+from django_velcro.utils import (_endpoint_orientations, add_related_content,
+    get_relationship_class, update_related_order_by)
+
+from .base import SIZES, QueryBudgetTestCase, create_fan_out, fan_out_names
+from .testapp.models import Data, Publication
+
+
+class GenericRelationTests(QueryBudgetTestCase):
+    def test_prefetch_related(self):
+        # Hubs, their relationships, then publications
+        for size in SIZES:
+            create_fan_out(size)
+        with self.assertNumQueries(3):
+            hubs = list(Data.objects.filter(
+                name__startswith='hub').prefetch_related(
+                'velcro_publication_links__publication_content_object'))
+        with self.assertNumQueries(0):
+            for hub in hubs:
+                self.assertEqual(
+                    sorted(
+                        str(link.publication_content_object)
+                        for link in hub.velcro_publication_links.all()),
+                    fan_out_names(hub)['publication'])
+
+    def test_join(self):
+        hub = create_fan_out(3)
+        publication = hub.get_velcro_publication_content()[0]
+        self.assertIn(hub, Data.objects.filter(
+            velcro_publication_links__publication_object_pk=publication.pk))
+
+    def test_cascade_delete(self):
+        hub = create_fan_out(3)
+        content_type = ContentType.objects.get_for_model(hub)
+        hub_pk = hub.pk
+        hub.delete()
+        for related_type in ('data', 'publication'):
+            relationship_class = get_relationship_class('data', related_type)
+            for (ct_field, pk_field), _ in _endpoint_orientations(
+                    relationship_class, 'data'):
+                self.assertFalse(relationship_class.objects.filter(**{
+                    ct_field: content_type, pk_field: hub_pk}).exists())
+
+
+class RelationshipIndexTests(QueryBudgetTestCase):
+    def test_index_together(self):
+        # Each end is looked up by content type and object pk
+        self.assertEqual(
+            get_relationship_class('data', 'publication')._meta.index_together,
+            (('data_content_type', 'data_object_pk'),
+             ('publication_content_type', 'publication_object_pk')))
+        self.assertEqual(
+            get_relationship_class('data', 'data')._meta.index_together,
+            (('content_type_1', 'object_pk_1'),
+             ('content_type_2', 'object_pk_2')))
+
+class ManagerTests(QueryBudgetTestCase):
+    def test_velcro_related(self):
+        hub = create_fan_out(3)
+        other = Publication.objects.create(title='other')
+        add_related_content(Data.objects.create(name='other'), other)
+        related = Publication.objects.velcro_related_to(hub)
+        self.assertEqual(set(related),
+                         set(hub.get_velcro_publication_content()))
+        self.assertNotIn(other, Publication.objects.velcro_related(
+            all_of=[hub]))
+
+    def test_replica_reads_stay_lazy(self):
+        # The relationship table is migrated to the QuerySet's database, so
+        # the subquery runs there even if reads would go to a replica
+        hub = create_fan_out(3)
+        with mock.patch.object(router, 'routers', [routers.VelcroRouter()]), \
+                mock.patch.object(
+                    routers, 'VELCRO_DATABASE_REPLICAS', ['replica']), \
+                mock.patch.object(routers, 'recently_written',
+                                  return_value=False):
+            with self.assertNumQueries(0):
+                related = Publication.objects.velcro_related_to(hub)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(related), 3)
+
+    def test_opt_in(self):
+        # Managers are only extended by models that opt in
+        self.assertFalse(hasattr(Data.objects, 'velcro_related_to'))
+
+class OrderByTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data_data = get_relationship_class('data', 'data')
+        self.data_publication = get_relationship_class('data', 'publication')
+
+    def labels(self, relationship_class):
+        return list(relationship_class.objects.order_by(
+            'pk').values_list('order_by', flat=True))
+
+    def test_rename(self):
+        data = Data.objects.create(name='old')
+        other = Data.objects.create(name='other')
+        publication = Publication.objects.create(title='publication')
+        add_related_content(other, data)
+        add_related_content(data, publication)
+
+        # Saving runs the post_save receiver
+        data.name = 'new'
+        data.save()
+        self.assertEqual(self.labels(self.data_data), [
+            'DATA: other ⟷  DATA: new'])
+        self.assertEqual(self.labels(self.data_publication), [
+            'DATA: new ⟷  PUBLICATION: publication'])
+
+    def test_unchanged(self):
+        hub = create_fan_out(5)
+        # One query per related type, and no rows to rewrite
+        with self.assertNumQueries(2):
+            self.assertEqual(update_related_order_by(hub), 0)
+
+    def test_truncated(self):
+        long_data = Data.objects.create(name='a' * 300)
+        data = Data.objects.create(name='data')
+        add_related_content(long_data, data)
+        self.assertEqual(
+            len(self.labels(self.data_data)[0]), ORDER_BY_MAX_LENGTH)
+
+        # Neither label is rewritten or fetched again
+        for obj in (long_data, data):
+            with self.assertNumQueries(2):
+                self.assertEqual(update_related_order_by(obj), 0)
+
+    def test_partly_truncated(self):
+        # The second end's label is cut off part of the way
+        long_data = Data.objects.create(name='a' * 235)
+        data = Data.objects.create(name='data' * 10)
+        add_related_content(long_data, data)
+        with self.assertNumQueries(2):
+            self.assertEqual(update_related_order_by(data), 0)
+
+        Data.objects.filter(pk=data.pk).update(name='new' * 10)
+        data.refresh_from_db()
+        self.assertEqual(update_related_order_by(data), 1)
+        self.assertEqual(self.labels(self.data_data), [
+            'DATA: {} ⟷  DATA: {}'.format('a' * 235, 'new' * 10)[
+                :ORDER_BY_MAX_LENGTH]])
@@ -0,0 +1,72 @@
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import router
+from django.test import TestCase
+
+from django_velcro import routers
+from django_velcro.graph import graph_atomic
+from django_velcro.utils import (add_related_content, get_related_content,
+    get_relationship_class, remove_related_content)
+
+from .testapp.models import Data, Publication
+
+
+class VelcroRouterTests(TestCase):
+    def setUp(self):
+        self.router = routers.VelcroRouter()
+        self.relationship_class = get_relationship_class('data', 'publication')
+        for patcher in (
+                mock.patch.object(router, 'routers', [self.router]),
+                mock.patch.object(
+                    routers, 'VELCRO_DATABASE_REPLICAS', ['replica'])):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        routers._state.last_write = None
+        self.addCleanup(setattr, routers._state, 'last_write', None)
+
+    def test_reads_and_writes(self):
+        self.assertEqual(
+            self.router.db_for_read(self.relationship_class), 'replica')
+        self.assertEqual(
+            self.router.db_for_write(self.relationship_class), 'default')
+        self.assertIsNone(self.router.db_for_read(Data))
+        self.assertIsNone(self.router.db_for_write(Data))
+
+    def test_allow_migrate(self):
+        self.assertTrue(self.router.allow_migrate('default', 'django_velcro'))
+        self.assertFalse(self.router.allow_migrate('replica', 'django_velcro'))
+        # Content types only come from the database they are routed to
+        self.assertIsNone(self.router.allow_migrate('default', 'contenttypes'))
+        self.assertIsNone(self.router.allow_migrate('replica', 'contenttypes'))
+
+    def test_sticky_after_write(self):
+        # Choosing a database to write to doesn't make reads sticky
+        self.router.db_for_write(self.relationship_class)
+        self.assertFalse(routers.recently_written())
+
+        add_related_content(
+            Data.objects.create(name='data'),
+            Publication.objects.create(title='publication'))
+        self.assertTrue(routers.recently_written())
+        self.assertEqual(
+            self.router.db_for_read(self.relationship_class), 'default')
+
+    def test_not_sticky_after_failed_write(self):
+        with self.assertRaises(RuntimeError):
+            with graph_atomic('default'):
+                raise RuntimeError
+        self.assertFalse(routers.recently_written())
+
+    def test_remove_using(self):
+        # Relationships are deleted from the requested database, not the
+        # one the router would choose
+        data = Data.objects.create(name='data')
+        publication = Publication.objects.create(title='publication')
+        add_related_content(data, publication)
+        ContentType.objects.get_for_models(Data, Publication)
+        with mock.patch.object(routers, 'VELCRO_DATABASE', 'velcro'):
+            remove_related_content(data, publication, using='default')
+        self.assertEqual(
+            get_related_content(data, 'publication', using='default'),
+            {'publication': []})
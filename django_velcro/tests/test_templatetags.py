@@ -0,0 +1,43 @@
+import re
+
+from django.template import Context, Template
+
+from .base import QueryBudgetTestCase, fan_out_names
+
+
+LINK_RE = re.compile(r'<a href="[^"]+">([^<]+)</a>')
+
+
+def render(template, **context):
+    return Template('{% load velcro_tags %}' + template).render(
+        Context(context))
+
+
+class TemplateTagQueryTests(QueryBudgetTestCase):
+    def test_velcro_related(self):
+        # 'has_related_content()' stops at the first related type, then
+        # 'get_related_content()' runs 1 + 2 queries
+        for hub, content in self.assertQueryBudget(
+                4, lambda hub: render('{% velcro_related obj %}', obj=hub)):
+            expected = fan_out_names(hub)
+            self.assertIn('Publications', content)
+            self.assertEqual(
+                LINK_RE.findall(content),
+                expected['data'] + expected['publication'])
+
+    def test_get_velcro_related(self):
+        for hub, content in self.assertQueryBudget(3, lambda hub: render(
+                '{% get_velcro_related obj as related_content %}'
+                '{% for rt, objects in related_content.items %}'
+                '{% for related_object in objects %}'
+                '{% velcro_link related_object %}'
+                '{% endfor %}{% endfor %}', obj=hub)):
+            expected = fan_out_names(hub)
+            self.assertEqual(
+                LINK_RE.findall(content),
+                expected['data'] + expected['publication'])
+
+    def test_velcro_url(self):
+        for hub, content in self.assertQueryBudget(
+                0, lambda hub: render('{% velcro_url obj %}', obj=hub)):
+            self.assertEqual(content, '/testapp/data/{}/'.format(hub.pk))
@@ -1,3 +1,515 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
+from django_velcro import utils
+from django_velcro.models import RelationshipChange
+from django_velcro.utils import (add_related_content,
+    bulk_add_related_content, bulk_remove_related_content, filter_related,
+    get_cached_related_content, get_related_content,
+    get_related_content_sametype, get_relationship_class,
+    get_relationship_changes, get_similar_content,
+    has_related_content, merge_related_content, remove_related_content,
+    set_related_content, warm_related_content)
+
+from .base import (SIZES, QueryBudgetTestCase, create_fan_out,
+    fan_out_names, record_deletes)
+from .testapp.models import Data, DataSet, Publication
+
+
+class GetRelatedContentQueryTests(QueryBudgetTestCase):
+    """
+    'get_related_content()' runs one 'UNION ALL' query across relationship
+    tables plus one query per related content type for the objects. The
+    hub's related types are 'data' (Data objects) and 'publication'
+    (Publication objects), so most paths run 1 + 2 queries. With one
+    related type, the relationship table is queried directly.
+    """
+    def names(self, objects):
+        return [str(obj) for obj in objects]
+
+    def test_grouped(self):
+        for hub, related_content in self.assertQueryBudget(
+                3, lambda hub: get_related_content(hub)):
+            expected = fan_out_names(hub)
+            self.assertEqual(list(related_content), ['data', 'publication'])
+            for rt in ('data', 'publication'):
+                self.assertEqual(
+                    self.names(related_content[rt]), expected[rt])
+
+    def test_flat(self):
+        for hub, related_content in self.assertQueryBudget(
+                3, lambda hub: get_related_content(hub, grouped=False)):
+            expected = fan_out_names(hub)
+            self.assertEqual(
+                self.names(related_content),
+                expected['data'] + expected['publication'])
+
+    def test_limit(self):
+        for hub, related_content in self.assertQueryBudget(
+                3, lambda hub: get_related_content(hub, limit=1)):
+            expected = fan_out_names(hub)
+            for rt in ('data', 'publication'):
+                self.assertEqual(
+                    self.names(related_content[rt]), expected[rt][:1])
+
+    def test_verbose(self):
+        for hub, related_content in self.assertQueryBudget(
+                3, lambda hub: get_related_content(hub, verbose=True)):
+            self.assertEqual(
+                self.names(related_content['publications']),
+                fan_out_names(hub)['publication'])
+
+    def test_values(self):
+        for hub, related_content in self.assertQueryBudget(
+                3, lambda hub: get_related_content(hub, values=True)):
+            values = related_content['publication'][0]
+            publication = Publication.objects.get(pk=values.pk)
+            self.assertEqual(values.velcro_type, 'publication')
+            self.assertEqual(values.label, publication.title)
+            self.assertEqual(
+                values.url, '/testapp/publication/{}/'.format(publication.pk))
+            self.assertEqual(
+                [values.label for values in related_content['data']],
+                fan_out_names(hub)['data'])
+
+    def test_one_related_type(self):
+        for hub, related_content in self.assertQueryBudget(
+                2, lambda hub: get_related_content(hub, 'publication')):
+            self.assertEqual(list(related_content), ['publication'])
+            self.assertEqual(
+                self.names(related_content['publication']),
+                fan_out_names(hub)['publication'])
+
+    def test_model_methods(self):
+        for hub, publications in self.assertQueryBudget(
+                2, lambda hub: hub.get_velcro_publication_content()):
+            self.assertEqual(
+                self.names(publications), fan_out_names(hub)['publication'])
+        for hub, data in self.assertQueryBudget(
+                2, lambda hub: hub.get_velcro_data_content()):
+            self.assertEqual(self.names(data), fan_out_names(hub)['data'])
+
+    def test_results(self):
+        hub = create_fan_out(3)
+        related_content = get_related_content(hub)
+        self.assertEqual(len(related_content['data']), 3)
+        self.assertEqual(len(related_content['publication']), 3)
+
+    def test_union_matches_per_type_queries(self):
+        hub = create_fan_out(5)
+        for kwargs in ({}, {'limit': 2}, {'values': True}):
+            self.assertEqual(dict(get_related_content(hub, **kwargs)), {
+                rt: get_related_content(hub, rt, **kwargs)[rt]
+                for rt in ('data', 'publication')
+            })
+
+class GetRelatedContentSametypeQueryTests(QueryBudgetTestCase):
+    def test_via_one_related_type(self):
+        # Publications, their Data objects, then the peer Data objects
+        for hub, related_content in self.assertQueryBudget(
+                3, lambda hub: get_related_content_sametype(
+                    hub, 'publication')):
+            self.assertEqual(
+                sorted(str(obj) for obj in related_content),
+                fan_out_names(hub)['peer'])
+
+    def test_via_all_related_types(self):
+        # Related Data objects and both orientations of their
+        # relationships, then the publication path as above. Friends
+        # are only related to the hub, so only peers are found.
+        for hub, related_content in self.assertQueryBudget(
+                6, lambda hub: get_related_content_sametype(hub)):
+            self.assertEqual(
+                sorted(str(obj) for obj in related_content),
+                fan_out_names(hub)['peer'])
+
+    def test_results(self):
+        hub = create_fan_out(3)
+        related_content = get_related_content_sametype(hub, 'publication')
+        self.assertEqual(len(related_content), 3)
+        self.assertNotIn(hub, related_content)
+
+class HasRelatedContentQueryTests(QueryBudgetTestCase):
+    def test_with_related_content(self):
+        # Stops after the first related type with relationships
+        for hub, result in self.assertQueryBudget(
+                1, lambda hub: has_related_content(hub)):
+            self.assertTrue(result)
+
+    def test_without_related_content(self):
+        data = Data.objects.create(name='lonely')
+        with self.assertNumQueries(2):
+            self.assertFalse(has_related_content(data))
+
+class AddRemoveRelatedContentQueryTests(QueryBudgetTestCase):
+    def test_add_difftype(self):
+        counts = []
+        for size in SIZES:
+            hub = create_fan_out(size)
+            publication = Publication.objects.create(title='new')
+            counts.append(
+                self.count_queries(add_related_content, hub, publication))
+            self.assertIn(
+                publication,
+                get_related_content(hub, 'publication')['publication'])
+        self.assertConstantCounts(counts, 7)
+
+    def test_add_sametype(self):
+        counts = []
+        for size in SIZES:
+            hub = create_fan_out(size)
+            data = Data.objects.create(name='new')
+            counts.append(self.count_queries(add_related_content, hub, data))
+            self.assertIn(data, get_related_content(hub, 'data')['data'])
+            self.assertIn(hub, get_related_content(data, 'data')['data'])
+        self.assertConstantCounts(counts, 7)
+
+    def test_remove(self):
+        counts = []
+        for size in SIZES:
+            hub = create_fan_out(size)
+            publication = get_related_content(hub, 'publication')[
+                'publication'][0]
+            counts.append(
+                self.count_queries(remove_related_content, hub, publication))
+            related_content = get_related_content(hub, 'publication')
+            self.assertNotIn(publication, related_content['publication'])
+            self.assertEqual(len(related_content['publication']), size - 1)
+        self.assertConstantCounts(counts, 3)
+
+class BulkRelatedContentQueryTests(QueryBudgetTestCase):
+    def create_objects(self, size):
+        publication = Publication.objects.create(title='target')
+        data = [Data.objects.create(name=str(i)) for i in range(size + 1)]
+        add_related_content(data[0], publication)
+        return publication, data
+
+    def test_add(self):
+        counts = []
+        for size in SIZES:
+            publication, data = self.create_objects(size)
+            counts.append(self.count_queries(
+                bulk_add_related_content, data, publication))
+            self.assertEqual(
+                len(get_related_content(publication, 'data')['data']),
+                size + 1)
+        self.assertConstantCounts(counts, 5)
+
+    def test_remove(self):
+        counts = []
+        for size in SIZES:
+            publication, data = self.create_objects(size)
+            bulk_add_related_content(data, publication)
+            counts.append(self.count_queries(
+                bulk_remove_related_content, data[1:], publication))
+            self.assertEqual(
+                get_related_content(publication, 'data')['data'], [data[0]])
+        self.assertConstantCounts(counts, 5)
+
+    def test_remove_without_signals(self):
+        publication, data = self.create_objects(3)
+        bulk_add_related_content(data, publication)
+        deleted = record_deletes(
+            self, get_relationship_class('data', 'publication'))
+        self.assertEqual(bulk_remove_related_content(data, publication), 4)
+        self.assertEqual(deleted, [])
+        self.assertFalse(has_related_content(publication))
+
+    def test_sametype(self):
+        hub = create_fan_out(3)
+        data = [Data.objects.create(name=str(i)) for i in range(3)]
+        self.assertEqual(bulk_add_related_content(data, hub), 3)
+        self.assertEqual(bulk_add_related_content(data, hub), 0)
+        self.assertEqual(len(get_related_content(hub, 'data')['data']), 6)
+        self.assertEqual(bulk_remove_related_content(data, hub), 3)
+        self.assertEqual(len(get_related_content(hub, 'data')['data']), 3)
+
+class FilterRelatedTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.a, self.b, self.c, self.d = [
+            Data.objects.create(name=name) for name in 'abcd']
+        self.p, self.q = [
+            Publication.objects.create(title=title) for title in 'pq']
+        # A DataSet has the same velcro type as Data, but its own model
+        self.s = DataSet.objects.create(name='s')
+        for object_1, object_2 in (
+                (self.a, self.p), (self.b, self.p), (self.a, self.q),
+                (self.c, self.q), (self.a, self.s), (self.s, self.c),
+                (self.b, self.d)):
+            add_related_content(object_1, object_2)
+
+    def assertFiltered(self, expected, **kwargs):
+        # The filter is built without queries and evaluated in one
+        with self.assertNumQueries(0):
+            queryset = filter_related(Data.objects.all(), **kwargs)
+        with self.assertNumQueries(1):
+            self.assertEqual(set(queryset), set(expected))
+
+    def test_all_of(self):
+        self.assertFiltered([self.a], all_of=[self.p, self.q])
+        self.assertFiltered([self.a], all_of=[self.p, self.s])
+
+    def test_any_of(self):
+        self.assertFiltered([self.a, self.b, self.c], any_of=[self.p, self.q])
+        self.assertFiltered([self.a, self.c], any_of=[self.q, self.s])
+        # Same-type relationships match in both orientations
+        self.assertFiltered([self.b], any_of=[self.d])
+
+    def test_none_of(self):
+        self.assertFiltered([self.c, self.d], none_of=[self.p])
+        self.assertFiltered([self.b], all_of=[self.p], none_of=[self.q])
+
+    def test_combined(self):
+        self.assertFiltered(
+            [self.b], all_of=[self.p], any_of=[self.s, self.d],
+            none_of=[self.q])
+
+class SetRelatedContentTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = Data.objects.create(name='data')
+        self.publications = [
+            Publication.objects.create(title=str(i)) for i in range(3)]
+
+    def test_diff(self):
+        first, second, third = self.publications
+        set_related_content(self.data, 'publication', [first, second])
+        relationship_class = get_relationship_class('data', 'publication')
+        kept = relationship_class.objects.get(publication_object_pk=second.pk)
+        deleted = record_deletes(self, relationship_class)
+
+        self.assertEqual(set_related_content(
+            self.data, 'publication', [second, third]), (1, 1))
+        self.assertEqual(deleted, [])
+        self.assertEqual(
+            self.data.get_velcro_publication_content(), [second, third])
+        # Unchanged relationships are left alone
+        self.assertTrue(relationship_class.objects.filter(pk=kept.pk).exists())
+
+    def test_no_changes(self):
+        set_related_content(self.data, 'publication', self.publications)
+        # One SELECT, inside the savepoint of the test's transaction
+        with self.assertNumQueries(3):
+            self.assertEqual(set_related_content(
+                self.data, 'publication', self.publications), (0, 0))
+
+    def test_sametype(self):
+        first, second, third = [
+            Data.objects.create(name=str(i)) for i in range(3)]
+        # 'self.data' is the first end of one row and the second of another
+        add_related_content(self.data, first)
+        add_related_content(second, self.data)
+
+        self.assertEqual(
+            set_related_content(self.data, 'data', [second, third]), (1, 1))
+        self.assertEqual(
+            self.data.get_velcro_data_content(), [second, third])
+        self.assertEqual(
+            set_related_content(self.data, 'data', []), (0, 2))
+        self.assertFalse(has_related_content(self.data))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            set_related_content(self.data, 'nonsense', [])
+        with self.assertRaises(ValueError):
+            set_related_content(
+                self.data, 'publication', [Data.objects.create(name='x')])
+        with self.assertRaises(ValueError):
+            set_related_content(self.data, 'data', [self.data])
+        self.assertFalse(has_related_content(self.data))
+
+class MergeRelatedContentQueryTests(QueryBudgetTestCase):
+    def test_query_count(self):
+        counts = []
+        for size in SIZES:
+            hub = create_fan_out(size)
+            target = Data.objects.create(name='target {}'.format(size))
+            counts.append(
+                self.count_queries(merge_related_content, hub, target))
+            self.assertFalse(has_related_content(hub))
+            related_content = get_related_content(target)
+            expected = fan_out_names(hub)
+            for rt in ('data', 'publication'):
+                self.assertEqual(
+                    sorted(str(obj) for obj in related_content[rt]),
+                    expected[rt])
+        self.assertConstantCounts(counts, 16)
+
+    def test_results(self):
+        hub = create_fan_out(3)
+        target = Data.objects.create(name='target')
+        friend = get_related_content(hub, 'data')['data'][0]
+        publication = get_related_content(
+            hub, 'publication')['publication'][0]
+        add_related_content(target, publication)
+        add_related_content(target, hub)
+
+        # One shared publication and the link to the hub are dropped
+        self.assertEqual(merge_related_content(hub, target), (5, 2))
+        self.assertFalse(has_related_content(hub))
+
+        related_content = get_related_content(target)
+        self.assertEqual(len(related_content['data']), 3)
+        self.assertIn(friend, related_content['data'])
+        self.assertNotIn(hub, related_content['data'])
+        self.assertEqual(len(related_content['publication']), 3)
+
+    def test_source_duplicates(self):
+        source, target, other = [
+            Data.objects.create(name=name)
+            for name in ('source', 'target', 'other')
+        ]
+        relationship_class = get_relationship_class('data', 'data')
+        relationship_class.objects.bulk_create([
+            relationship_class(
+                content_object_1=object_1, content_object_2=object_2)
+            for object_1, object_2 in ((source, other), (other, source))
+        ])
+
+        self.assertEqual(merge_related_content(source, target), (1, 1))
+        self.assertEqual(
+            get_related_content(target, 'data')['data'], [other])
+
+    def test_deletes_without_signals(self):
+        source, target, other = [
+            Data.objects.create(name=name)
+            for name in ('source', 'target', 'other')
+        ]
+        add_related_content(source, other)
+        add_related_content(target, other)
+        relationship_class = get_relationship_class('data', 'data')
+        deleted = record_deletes(self, relationship_class)
+
+        self.assertEqual(merge_related_content(source, target), (0, 1))
+        self.assertEqual(deleted, [])
+        self.assertEqual(relationship_class.objects.count(), 1)
+
+    def test_not_velcro_managed(self):
+        user = User.objects.create(username='user')
+        with self.assertRaises(ValueError):
+            merge_related_content(user, Data.objects.create(name='target'))
+
+class ChangelogTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(utils, 'VELCRO_CHANGELOG', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data = Data.objects.create(name='data')
+        self.publication = Publication.objects.create(title='publication')
+        self.data_key = (
+            ContentType.objects.get_for_model(Data).pk, self.data.pk)
+        self.publication_key = (
+            ContentType.objects.get_for_model(Publication).pk,
+            self.publication.pk)
+
+    def changes(self, after=0):
+        return [
+            (change.op, change.relationship_class,
+             (change.a_ct, change.a_pk), (change.b_ct, change.b_pk))
+            for change in get_relationship_changes(after=after)
+        ]
+
+    def test_add_and_remove(self):
+        add_related_content(self.data, self.publication)
+        remove_related_content(self.data, self.publication)
+        self.assertEqual(self.changes(), [
+            (RelationshipChange.ADD, 'DataPublicationRelationship',
+             self.data_key, self.publication_key),
+            (RelationshipChange.REMOVE, 'DataPublicationRelationship',
+             self.data_key, self.publication_key),
+        ])
+
+    def test_merge(self):
+        add_related_content(self.data, self.publication)
+        target = Data.objects.create(name='target')
+        after = get_relationship_changes()[-1].seq
+        merge_related_content(self.data, target)
+        # A moved relationship is logged as removed and added again
+        self.assertEqual(self.changes(after), [
+            (RelationshipChange.REMOVE, 'DataPublicationRelationship',
+             self.data_key, self.publication_key),
+            (RelationshipChange.ADD, 'DataPublicationRelationship',
+             (self.data_key[0], target.pk), self.publication_key),
+        ])
+
+    def test_disabled(self):
+        with mock.patch.object(utils, 'VELCRO_CHANGELOG', False):
+            add_related_content(self.data, self.publication)
+        self.assertEqual(self.changes(), [])
+
+class SimilarContentTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.a, self.b, self.c, self.d = [
+            Data.objects.create(name=name) for name in 'abcd']
+        self.p, self.q = [
+            Publication.objects.create(title=title) for title in 'pq']
+        for obj, publications in (
+                (self.a, [self.p, self.q]),
+                (self.b, [self.p, self.q]),
+                (self.c, [self.p])):
+            for publication in publications:
+                add_related_content(obj, publication)
+        add_related_content(self.d, self.c)
+
+    def test_ranking(self):
+        self.assertEqual(
+            get_similar_content(self.a, via='publication'),
+            [(self.b, 2), (self.c, 1)])
+
+    def test_top_k(self):
+        self.assertEqual(
+            get_similar_content(self.a, via='publication', top_k=1),
+            [(self.b, 2)])
+
+    def test_via(self):
+        self.assertEqual(get_similar_content(self.a, via='data'), [])
+        # Shared neighbours of all related types are added up
+        self.assertEqual(
+            get_similar_content(self.c),
+            [(self.a, 1), (self.b, 1)])
+
+class RelatedContentCacheQueryTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(utils, 'VELCRO_RELATED_CACHE', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_warm_related_content(self):
+        # Per related type: relationships (both orientations for 'data'),
+        # then labels and URLs
+        for hub, warmed in self.assertQueryBudget(
+                5, lambda hub: warm_related_content([hub])):
+            expected = fan_out_names(hub)
+            for rt in ('data', 'publication'):
+                self.assertEqual(
+                    warmed[hub.pk][rt]['count'], len(expected[rt]))
+                self.assertEqual(
+                    [values.label for values in warmed[hub.pk][rt]['values']],
+                    expected[rt])
+            with self.assertNumQueries(0):
+                self.assertEqual(
+                    get_cached_related_content(hub), warmed[hub.pk])
+
+    def test_cache_hits(self):
+        for size in SIZES:
+            hub = create_fan_out(size)
+            warm_related_content([hub])
+            with self.assertNumQueries(0):
+                related_content = get_related_content(hub, values=True)
+            self.assertEqual(len(related_content['publication']), size)
+            with self.assertNumQueries(0):
+                self.assertTrue(has_related_content(hub))
+
+    def test_invalidation(self):
+        hub = create_fan_out(3)
+        warm_related_content([hub])
+        publication = Publication.objects.create(title='new')
+        add_related_content(hub, publication)
+        self.assertEqual(
+            get_cached_related_content(hub)['publication']['count'], 4)
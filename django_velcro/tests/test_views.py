@@ -0,0 +1,47 @@
+import json
+from unittest import mock
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from django_velcro import utils
+from django_velcro.utils import add_related_content
+
+from .testapp.models import Data, Publication
+
+
+class RelatedContentJsonTests(TestCase):
+    def setUp(self):
+        self.data = Data.objects.create(name='data')
+        self.publication = Publication.objects.create(title='publication')
+        add_related_content(self.data, self.publication)
+        self.url = reverse('velcro:related-content', kwargs={
+            'app_label': 'testapp', 'model_name': 'data', 'pk': self.data.pk})
+
+    def test_related_content(self):
+        response = self.client.get(self.url, {'type': 'publication'})
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(list(content['related']), ['publication'])
+        self.assertEqual(
+            content['related']['publication']['results'][0]['pk'],
+            self.publication.pk)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_invalid_type(self):
+        response = self.client.get(self.url, {'type': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_request(self):
+        patcher = mock.patch.object(
+            utils, 'VELCRO_RELATIONSHIP_VERSIONS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        add_related_content(self.data, Publication.objects.create(title='new'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,8 @@
+from django.contrib import admin
+
+from .models import Data, DataSet, Publication
+
+
+admin.site.register(Data)
+admin.site.register(DataSet)
+admin.site.register(Publication)
@@ -0,0 +1,24 @@
+from django.db import models
+
+from django_velcro.managers import VelcroManager
+
+
+class Data(models.Model):
+    name = models.CharField(max_length=100)
+
+    def __str__(self):
+        return self.name
+
+class DataSet(models.Model):
+    name = models.CharField(max_length=100)
+
+    def __str__(self):
+        return self.name
+
+class Publication(models.Model):
+    title = models.CharField(max_length=100)
+
+    objects = VelcroManager()
+
+    def __str__(self):
+        return self.title
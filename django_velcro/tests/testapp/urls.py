@@ -0,0 +1,11 @@
+from django.conf.urls import url
+
+from . import views
+
+
+urlpatterns = [
+    url(r'^data/(?P<pk>\d+)/$', views.detail, name='data-detail'),
+    url(r'^dataset/(?P<pk>\d+)/$', views.detail, name='dataset-detail'),
+    url(r'^publication/(?P<pk>\d+)/$', views.detail,
+        name='publication-detail'),
+]
@@ -0,0 +1,10 @@
+from django.conf.urls import include, url
+from django.contrib import admin
+
+
+urlpatterns = [
+    url(r'^admin/', include(admin.site.urls)),
+    url(r'^testapp/', include(
+        'django_velcro.tests.testapp.urls', namespace='testapp')),
+    url(r'^velcro/', include('django_velcro.urls', namespace='velcro')),
+]
@@ -0,0 +1,11 @@
+from django.conf.urls import url
+
+from .views import related_content_json
+
+
+# Usage (project 'urls.py'):
+#     url(r'^velcro/', include('django_velcro.urls', namespace='velcro')),
+urlpatterns = [
+    url(r'^(?P<app_label>\w+)/(?P<model_name>\w+)/(?P<pk>\d+)/$',
+        related_content_json, name='related-content'),
+]
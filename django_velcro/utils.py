@@ -1,20 +1,50 @@
 import inspect
-from collections import OrderedDict
+import operator
+from collections import OrderedDict, defaultdict, namedtuple
+from contextlib import ExitStack
+from functools import partial, reduce
 from importlib import import_module
+from uuid import uuid4
 
 from django.apps import apps
 from django.contrib import admin
+from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import connections, models, router
+from django.utils import timezone
 
-from .app_settings import VELCRO_METADATA, VELCRO_METHODS, VELCRO_RELATIONSHIPS
+from .app_settings import (VELCRO_CACHE, VELCRO_CHANGELOG,
+    VELCRO_GENERIC_RELATIONS, VELCRO_METADATA, VELCRO_METHODS,
+    VELCRO_RELATED_CACHE, VELCRO_RELATED_CACHE_TIMEOUT, VELCRO_RELATIONSHIPS,
+    VELCRO_RELATIONSHIP_VERSIONS)
+from .debug import velcro_trace
+from .graph import get_graph, graph_atomic, update_graph
+from .models import (ORDER_BY_MAX_LENGTH, RELATIONSHIP_LABEL_SEPARATOR,
+    RelationshipChange, format_endpoint_label, format_relationship_label)
+
+
+BULK_BATCH_SIZE = 500
+
+RelatedValues = namedtuple(
+    'RelatedValues', ['velcro_type', 'content_type', 'pk', 'label', 'url'])
 
 
 def _startup():
     """
-    Add methods to velcro-managed models to add, get, and remove related content.
+    Add methods to velcro-managed models to add, get, and remove related
+    content, and 'GenericRelation' fields for their relationships.
     """
+    if VELCRO_GENERIC_RELATIONS:
+        for velcro_type, velcro_type_metadata in VELCRO_METADATA.items():
+            for model_metadata in velcro_type_metadata['apps']:
+                add_generic_relations(
+                    apps.get_model(
+                        model_metadata['app_label'], model_metadata['model']),
+                    velcro_type)
+        apps.clear_cache()
+
     if VELCRO_METHODS == False:
         return
 
@@ -26,7 +56,10 @@ def _startup():
             model.add_velcro_content = add_related_content
             model.get_velcro_content = get_related_content
             model.get_velcro_content_sametype = get_related_content_sametype
+            model.get_velcro_similar_content = get_similar_content
+            model.merge_velcro_content = merge_related_content
             model.remove_velcro_content = remove_related_content
+            model.set_velcro_content = set_related_content
             model.velcro_url = get_url_of_object
 
             for related_type in get_related_types(velcro_type):
@@ -41,24 +74,48 @@ def _startup():
                 setattr(
                     model,
                     'get_velcro_{}_content'.format(related_type),
-                    get_velcro_content_for_related_type
+                    velcro_trace(
+                        get_velcro_content_for_related_type,
+                        name='get_velcro_{}_content'.format(related_type),
+                        related_type=related_type,
+                    )
                 )
 
                 def get_velcro_content_sametype_for_related_type(
-                        self, related_type=related_type):
+                        self, related_type=related_type, using=None):
                     related_content = get_related_content_sametype(
-                        self, related_type)
+                        self, related_type, using=using)
                     return related_content
 
                 setattr(
                     model,
                     'get_velcro_{}_content_sametype'.format(related_type),
-                    get_velcro_content_sametype_for_related_type
+                    velcro_trace(
+                        get_velcro_content_sametype_for_related_type,
+                        name='get_velcro_{}_content_sametype'.format(
+                            related_type),
+                        related_type=related_type,
+                    )
+                )
+
+                def set_velcro_content_for_related_type(
+                        self, objects, related_type=related_type, **kwargs):
+                    return set_related_content(
+                        self, related_type, objects, **kwargs)
+
+                setattr(
+                    model,
+                    'set_velcro_{}_content'.format(related_type),
+                    velcro_trace(
+                        set_velcro_content_for_related_type,
+                        name='set_velcro_{}_content'.format(related_type),
+                        related_type=related_type,
+                    )
                 )
 
 def _add_or_remove_related_content_difftype(
         object_1, object_2, object_1_velcro_type, object_2_velcro_type,
-        add_or_remove):
+        add_or_remove, using=None):
     """
     Add or remove a relationship between two objects with differing velcro
     types depending on whether 'add_or_remove' equals 'add' or 'remove'.
@@ -68,17 +125,22 @@ def _add_or_remove_related_content_difftype(
     """
     relationship_class = get_relationship_class(
         object_1_velcro_type, object_2_velcro_type)
+    using = using or router.db_for_write(relationship_class)
     query = _relationship_query(
         object_1, object_1_velcro_type, object_2, object_2_velcro_type)
 
     if add_or_remove == 'add':
-        return relationship_class.objects.get_or_create(**query)
+        return _get_or_create_relationship(relationship_class, {
+            '{}_content_object'.format(object_1_velcro_type): object_1,
+            '{}_content_object'.format(object_2_velcro_type): object_2,
+        }, models.Q(**query), using)
     elif add_or_remove == 'remove':
-        relationship_class.objects.get(**query).delete()
+        relationship_class.objects.db_manager(using).get(
+            **query).delete(using=using)
 
 def _add_or_remove_related_content_sametype(
         object_1, object_2, object_1_velcro_type, object_2_velcro_type,
-        add_or_remove):
+        add_or_remove, using=None):
     """
     Add or remove a relationship between two objects with matching velcro
     types depending on whether 'add_or_remove' equals 'add' or 'remove'.
@@ -91,6 +153,7 @@ def _add_or_remove_related_content_sametype(
 
     relationship_class = get_relationship_class(
         object_1_velcro_type, object_2_velcro_type)
+    using = using or router.db_for_write(relationship_class)
 
     query = models.Q(
         content_type_1=ContentType.objects.get_for_model(object_1),
@@ -105,22 +168,200 @@ def _add_or_remove_related_content_sametype(
     )
 
     if add_or_remove == 'add':
-        try:
-            relationship = relationship_class.objects.get(query)
-            created = False
-        except:
-            params = {
-                'content_type_1': ContentType.objects.get_for_model(object_1),
-                'object_pk_1': object_1.pk,
-                'content_type_2': ContentType.objects.get_for_model(object_2),
-                'object_pk_2': object_2.pk,
-            }
-            relationship = relationship_class.objects.create(**params)
-            created = True
-
-        return relationship, created
+        return _get_or_create_relationship(relationship_class, {
+            'content_object_1': object_1,
+            'content_object_2': object_2,
+        }, query, using)
     elif add_or_remove == 'remove':
-        relationship_class.objects.get(query).delete()
+        relationship_class.objects.db_manager(using).get(
+            query).delete(using=using)
+
+def _bulk_add_or_remove_related_content(
+        objects, target, add_or_remove, using=None):
+    """
+    Add or remove relationships between each of a list of objects and a
+    target object depending on whether 'add_or_remove' equals 'add' or
+    'remove'. Existing relationships are looked up with one query per batch
+    of objects, then missing ones are inserted with 'bulk_create()' or
+    existing ones deleted with bulk DELETEs, all in one transaction per
+    database. No per-object 'get()' or 'save()' calls are made.
+
+    Returns the number of relationships added or removed.
+    """
+    target_velcro_type = get_velcro_type(target)
+    target_key = (ContentType.objects.get_for_model(target).pk, target.pk)
+
+    objects_by_class = OrderedDict()
+    for obj in objects:
+        velcro_type = get_velcro_type(obj)
+        if velcro_type not in get_related_types(target_velcro_type):
+            raise ValueError(
+                "'{}' is not a related velcro type for '{}'.".format(
+                    velcro_type, target_velcro_type))
+        key = (ContentType.objects.get_for_model(obj).pk, obj.pk)
+        if key == target_key:
+            raise ValueError("{} can't be related to itself.".format(obj))
+        relationship_class = get_relationship_class(
+            target_velcro_type, velcro_type)
+        objects_by_class.setdefault(relationship_class, OrderedDict())[
+            key] = obj
+
+    databases = {
+        relationship_class: using or router.db_for_write(relationship_class)
+        for relationship_class in objects_by_class
+    }
+
+    count = 0
+    with ExitStack() as stack:
+        for db in set(databases.values()):
+            stack.enter_context(graph_atomic(db))
+
+        for relationship_class, keyed_objects in objects_by_class.items():
+            db = databases[relationship_class]
+            keys = list(keyed_objects)
+            for i in range(0, len(keys), BULK_BATCH_SIZE):
+                batch_keys = keys[i:i + BULK_BATCH_SIZE]
+                batch = set(batch_keys)
+                query = reduce(operator.or_, [
+                    models.Q(**{
+                        own[0]: target_key[0],
+                        own[1]: target_key[1],
+                        '{}__in'.format(other[0]): {ct for ct, _ in batch},
+                        '{}__in'.format(other[1]): {pk for _, pk in batch},
+                    })
+                    for own, other in _endpoint_orientations(
+                        relationship_class, target_velcro_type)
+                ])
+
+                existing = OrderedDict()
+                rows = (
+                    relationship_class.objects.db_manager(db).filter(query)
+                    .order_by().values_list(
+                        'pk', *_endpoint_attnames(relationship_class)))
+                for pk, ct_1_id, pk_1, ct_2_id, pk_2 in rows:
+                    endpoints = ((ct_1_id, pk_1), (ct_2_id, pk_2))
+                    other_key = _other_end(
+                        relationship_class, target_velcro_type, target_key,
+                        endpoints)
+                    if other_key in batch:
+                        existing.setdefault(other_key, []).append(
+                            (pk, endpoints))
+
+                if add_or_remove == 'add':
+                    added = [
+                        keyed_objects[key] for key in batch_keys
+                        if key not in existing
+                    ]
+                    if added:
+                        _bulk_create_relationships(
+                            relationship_class, target_velcro_type, target,
+                            added, db)
+                    count += len(added)
+                elif add_or_remove == 'remove':
+                    removed = [
+                        row for key_rows in existing.values()
+                        for row in key_rows]
+                    if removed:
+                        _bulk_delete_relationships(
+                            relationship_class, removed, db)
+                    count += len(removed)
+
+    return count
+
+def _bulk_create_relationships(
+        relationship_class, velcro_type, obj, related_objects, using):
+    """
+    Insert relationships between an object and a list of related objects
+    with 'bulk_create()'. Labels are built from the objects in memory, so no
+    related objects are fetched, and no per-row 'save()' or signals run.
+    The caller is responsible for not inserting existing relationships.
+    """
+    own_index = relationship_class.velcro_types.index(velcro_type)
+    own_object_field = relationship_class.velcro_fields[own_index][2]
+    other_object_field = relationship_class.velcro_fields[1 - own_index][2]
+
+    relationships = []
+    for related in related_objects:
+        # Assigned after construction, so the objects are cached and
+        # 'get_order_by()' doesn't fetch them
+        relationship = relationship_class()
+        setattr(relationship, own_object_field, obj)
+        setattr(relationship, other_object_field, related)
+        relationship.order_by = relationship.get_order_by()
+        relationships.append(relationship)
+
+    relationship_class.objects.db_manager(using).bulk_create(
+        relationships, batch_size=BULK_BATCH_SIZE)
+    _record_relationship_changes(
+        relationship_class, RelationshipChange.ADD,
+        [relationship.get_endpoints() for relationship in relationships],
+        using)
+    touch_relationship_versions(
+        key for relationship in relationships
+        for key in relationship.get_endpoints())
+
+def _bulk_delete_relationships(
+        relationship_class, rows, using, batch_size=BULK_BATCH_SIZE):
+    """
+    Delete relationships with one set-based DELETE per batch, given a list
+    of '(pk, endpoints)' tuples. Relationships aren't loaded and no
+    'post_delete' signals are sent; instead, the removals of each batch are
+    logged with one 'bulk_create()' and the relationship versions of their
+    ends are updated with one cache write.
+    """
+    rows = list(rows)
+    using = using or router.db_for_write(relationship_class)
+    with graph_atomic(using, savepoint=False):
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            relationship_class.objects.db_manager(using).filter(
+                pk__in=[pk for pk, endpoints in batch])._raw_delete(using)
+            _record_relationship_changes(
+                relationship_class, RelationshipChange.REMOVE,
+                [endpoints for pk, endpoints in batch], using)
+            touch_relationship_versions(
+                key for pk, endpoints in batch for key in endpoints)
+
+def _endpoint_attnames(relationship_class):
+    """
+    Return the content type and object pk field names for both ends of a
+    relationship class, in the order used by '_update_order_by_labels()'.
+    """
+    return [
+        field for ct_field, pk_field, _ in relationship_class.velcro_fields
+        for field in (ct_field, pk_field)
+    ]
+
+def _endpoint_query(relationship_class, velcro_type, content_type, object_pk):
+    """
+    Return a Q object matching relationships in which the given object is
+    an end of the given velcro type. For matching velcro types, both ends
+    are matched.
+    """
+    queries = [
+        models.Q(**{ct_field: content_type, pk_field: object_pk})
+        for vt, (ct_field, pk_field, _) in zip(
+            relationship_class.velcro_types, relationship_class.velcro_fields)
+        if vt == velcro_type
+    ]
+    return reduce(operator.or_, queries)
+
+def _endpoint_orientations(relationship_class, velcro_type):
+    """
+    Return a list of '((own_ct_field, own_pk_field), (other_ct_field,
+    other_pk_field))' tuples, one for each end of a relationship class that
+    can hold an object of the given velcro type. Relationship classes with
+    matching velcro types have two orientations; all others have one.
+    """
+    fields = [
+        (ct_field, pk_field)
+        for ct_field, pk_field, _ in relationship_class.velcro_fields
+    ]
+    return [
+        (fields[i], fields[1 - i])
+        for i, vt in enumerate(relationship_class.velcro_types)
+        if vt == velcro_type
+    ]
 
 def _find_dict_in_list(list_, key, value):
     """
@@ -132,6 +373,300 @@ def _find_dict_in_list(list_, key, value):
             return list_[idx]
     return []
 
+def _get_or_create_relationship(relationship_class, objects, query, using):
+    """
+    Return the relationship matching a Q object and 'False', or create one
+    between the given objects (a dict keyed by content object field) and
+    return it and 'True'. The objects are assigned after construction, so
+    they are cached on the relationship and its label is built without
+    fetching them again. The lookup is done once, here, rather than again
+    in 'save()'.
+    """
+    using = using or router.db_for_write(relationship_class)
+    with graph_atomic(using):
+        try:
+            return relationship_class.objects.db_manager(using).get(
+                query), False
+        except relationship_class.DoesNotExist:
+            pass
+
+        relationship = relationship_class()
+        for field, obj in objects.items():
+            setattr(relationship, field, obj)
+        relationship.save(using=using, force_insert=True)
+        return relationship, True
+
+def _get_relationship_version(content_type_id, object_pk):
+    """
+    Return the '(version, last_modified)' tuple for the relationships of the
+    object with the given content type id and pk. An object without a
+    recorded version gets a new one.
+    """
+    cache = caches[VELCRO_CACHE]
+    key = _relationship_version_key(content_type_id, object_pk)
+    version = cache.get(key)
+    if version is None:
+        version = (uuid4().hex, timezone.now())
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+def _hydrate(keys):
+    """
+    Given an iterable of '(content_type_id, object_pk)' pairs, return a dict
+    mapping each pair to its object. Objects are fetched with one query per
+    content type (per batch) instead of one query per object. Pairs whose
+    objects no longer exist are left out.
+    """
+    pks_by_content_type = defaultdict(set)
+    for content_type_id, object_pk in keys:
+        pks_by_content_type[content_type_id].add(object_pk)
+
+    objects = {}
+    for content_type_id, object_pks in pks_by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            continue
+        object_pks = sorted(object_pks)
+        for i in range(0, len(object_pks), BULK_BATCH_SIZE):
+            batch = object_pks[i:i + BULK_BATCH_SIZE]
+            for object_pk, obj in model._base_manager.in_bulk(batch).items():
+                objects[(content_type_id, object_pk)] = obj
+
+    return objects
+
+def _merge_relationships(
+        relationship_class, velcro_type, source_key, target_key, using):
+    """
+    Repoint the rows of a relationship class that have the object with
+    '(content_type_id, object_pk)' 'source_key' at an end of the given
+    velcro type to 'target_key' (see 'merge_related_content()').
+
+    Rows that would relate 'target_key' to itself or repeat a relationship
+    are found with one SELECT, using 'EXISTS' subqueries, and deleted
+    first with set-based DELETEs. The rest are repointed with one UPDATE
+    per end.
+
+    Returns a tuple of the numbers of rows moved and deleted.
+    """
+    connection = connections[using]
+    manager = relationship_class.objects.db_manager(using)
+    attnames = _endpoint_attnames(relationship_class)
+    orientations = _endpoint_orientations(relationship_class, velcro_type)
+    column = partial(_quoted_column, relationship_class, connection)
+    table = connection.ops.quote_name(relationship_class._meta.db_table)
+    pk_field = relationship_class._meta.pk.name
+
+    def holds(alias, fields):
+        return '{} = %s AND {} = %s'.format(
+            column(fields[0], alias), column(fields[1], alias))
+
+    def links_to(alias, key, other, extra=''):
+        # An 'alias' row with 'key' at one end and the other end of the
+        # 'r' row at the other
+        return 'EXISTS (SELECT 1 FROM {} {} WHERE ({}){})'.format(
+            table, alias, ' OR '.join(
+                '({} AND {} = {} AND {} = {})'.format(
+                    holds(alias, linked_own),
+                    column(linked_other[0], alias), column(other[0], 'r'),
+                    column(linked_other[1], alias), column(other[1], 'r'))
+                for linked_own, linked_other in orientations),
+            extra), list(key) * len(orientations)
+
+    # Rows that would relate the target to itself, repeat one of its
+    # relationships or repeat another source row with a smaller pk
+    conditions, params = [], []
+    for own, other in orientations:
+        merged = [
+            (holds('r', other), list(source_key)),
+            (holds('r', other), list(target_key)),
+            links_to('t', target_key, other),
+            links_to('s', source_key, other, ' AND {} < {}'.format(
+                column(pk_field, 's'), column(pk_field, 'r'))),
+        ]
+        conditions.append('({} AND ({}))'.format(holds('r', own), ' OR '.join(
+            '({})'.format(sql) for sql, _ in merged)))
+        params.extend(list(source_key))
+        params.extend(param for _, merged_params in merged
+                      for param in merged_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT {} FROM {} r WHERE {}'.format(
+            ', '.join(column(field, 'r') for field in [pk_field] + attnames),
+            table, ' OR '.join(conditions)), params)
+        deleted_rows = [
+            (pk, ((ct_1_id, pk_1), (ct_2_id, pk_2)))
+            for pk, ct_1_id, pk_1, ct_2_id, pk_2 in cursor.fetchall()
+        ]
+    if deleted_rows:
+        _bulk_delete_relationships(relationship_class, deleted_rows, using)
+
+    source_query = _endpoint_query(
+        relationship_class, velcro_type,
+        ContentType.objects.get_for_id(source_key[0]), source_key[1])
+    rows = []
+    for pk, ct_1_id, pk_1, ct_2_id, pk_2, order_by in manager.filter(
+            source_query).order_by().values_list(
+            'pk', *attnames + ['order_by']):
+        endpoints = ((ct_1_id, pk_1), (ct_2_id, pk_2))
+        new_endpoints = tuple(
+            target_key if endpoint == source_key else endpoint
+            for endpoint in endpoints)
+        rows.append((pk, endpoints, new_endpoints, order_by))
+    if not rows:
+        return 0, len(deleted_rows)
+
+    for own, other in orientations:
+        manager.filter(**dict(zip(own, source_key))).update(
+            **dict(zip(own, target_key)))
+
+    _update_order_by_labels(relationship_class, [
+        (pk,) + new_endpoints[0] + new_endpoints[1] + (order_by,)
+        for pk, endpoints, new_endpoints, order_by in rows
+    ], using=using)
+    _record_relationship_changes(
+        relationship_class, RelationshipChange.REMOVE,
+        [endpoints for pk, endpoints, new_endpoints, order_by in rows], using)
+    _record_relationship_changes(
+        relationship_class, RelationshipChange.ADD,
+        [new_endpoints for pk, endpoints, new_endpoints, order_by in rows],
+        using)
+    touch_relationship_versions(
+        key for pk, endpoints, new_endpoints, order_by in rows
+        for key in endpoints + new_endpoints)
+
+    return len(rows), len(deleted_rows)
+
+def _other_end(relationship_class, velcro_type, object_key, endpoints):
+    """
+    Given the '(content_type_id, object_pk)' endpoints of a relationship row
+    and the key of the object of the given velcro type at one end, return
+    the key at the other end.
+    """
+    velcro_type_1, velcro_type_2 = relationship_class.velcro_types
+    if velcro_type_1 == velcro_type_2:
+        return endpoints[1] if endpoints[0] == object_key else endpoints[0]
+    return endpoints[1 - relationship_class.velcro_types.index(velcro_type)]
+
+def _quoted_column(relationship_class, connection, field_name, alias=None):
+    """
+    Return the quoted database column for a relationship class field,
+    optionally qualified by a table alias.
+    """
+    column = connection.ops.quote_name(
+        relationship_class._meta.get_field(field_name).column)
+    if alias is None:
+        return column
+    return '{}.{}'.format(alias, column)
+
+def _record_relationship_changes(relationship_class, op, endpoints, using):
+    """
+    Append entries for relationships added or removed to the change log, if
+    'VELCRO_CHANGELOG' is enabled, and apply them to the relationship graph
+    snapshot, if 'VELCRO_GRAPH_SNAPSHOT' is enabled. 'endpoints' is a list
+    of pairs of '(content_type_id, object_pk)' tuples. Call this inside the
+    transaction that makes the changes, so entries are committed or rolled
+    back with them. Graph updates wait until the transaction has committed
+    (see 'graph_atomic()').
+    """
+    if not endpoints:
+        return
+
+    update_graph(relationship_class, op, endpoints, using)
+
+    if not VELCRO_CHANGELOG:
+        return
+
+    RelationshipChange.objects.db_manager(using).bulk_create([
+        RelationshipChange(
+            relationship_class=relationship_class.__name__,
+            a_ct=a_ct, a_pk=a_pk, b_ct=b_ct, b_pk=b_pk, op=op)
+        for (a_ct, a_pk), (b_ct, b_pk) in endpoints
+    ], batch_size=BULK_BATCH_SIZE)
+
+def _related_cache_key(content_type_id, object_pk, version):
+    """
+    Return the cache key for the cached related content of an object at a
+    relationship version.
+    """
+    return 'django_velcro:related:{}:{}:{}'.format(
+        content_type_id, object_pk, version)
+
+def _related_to_q(queryset, objects, using=None):
+    """
+    Return a Q object matching the objects of a QuerySet that are related to
+    any of the given objects. The Q object contains one 'pk__in' subquery
+    per relationship table (and direction) involved, so the QuerySet stays
+    lazy and the filtering happens in the database.
+
+    Unless a database alias is given, the subquery runs on the QuerySet's
+    database if the relationship table is migrated there (e.g., even if
+    reads would otherwise go to a replica). Only if the relationship table
+    lives in a different database is the subquery evaluated first and its
+    pks inlined.
+    """
+    model = queryset.model
+    velcro_type = get_velcro_type(model)
+    content_type = ContentType.objects.get_for_model(model)
+
+    objects_by_class = OrderedDict()
+    for obj in objects:
+        related_type = get_velcro_type(obj)
+        if related_type not in get_related_types(velcro_type):
+            raise ValueError(
+                "'{}' is not a related velcro type for '{}'.".format(
+                    related_type, velcro_type))
+        relationship_class = get_relationship_class(velcro_type, related_type)
+        objects_by_class.setdefault(relationship_class, []).append(obj)
+
+    queries = []
+    for relationship_class, related_objects in objects_by_class.items():
+        db = using
+        if db is None:
+            if router.allow_migrate_model(queryset.db, relationship_class):
+                db = queryset.db
+            else:
+                db = router.db_for_read(relationship_class)
+        for own, other in _endpoint_orientations(
+                relationship_class, velcro_type):
+            object_query = reduce(operator.or_, [
+                models.Q(**{
+                    other[0]: ContentType.objects.get_for_model(obj),
+                    other[1]: obj.pk,
+                })
+                for obj in related_objects
+            ])
+            subquery = relationship_class.objects.db_manager(db).filter(
+                object_query, **{own[0]: content_type}).values_list(
+                own[1], flat=True)
+            if db != queryset.db:
+                subquery = list(subquery)
+            queries.append(models.Q(pk__in=subquery))
+
+    if not queries:
+        return models.Q(pk__in=[])
+    return reduce(operator.or_, queries)
+
+def _related_values_sort_key(related_values):
+    """
+    Sort key for 'RelatedValues' named tuples: by model, then label.
+    """
+    return (related_values.content_type.model,
+            (related_values.label or '').lower())
+
+def _relationship_version_key(content_type_id, object_pk):
+    """
+    Return the cache key for the relationship version of an object.
+    """
+    return 'django_velcro:version:{}:{}'.format(content_type_id, object_pk)
+
+def _relationship_versions_enabled():
+    """
+    Return whether relationship versions are kept. They are needed for
+    'VELCRO_RELATIONSHIP_VERSIONS' and for the related content cache.
+    """
+    return VELCRO_RELATIONSHIP_VERSIONS or VELCRO_RELATED_CACHE
+
 def _relationship_query(
         object_1, object_1_velcro_type, object_2, object_2_velcro_type):
     """
@@ -146,12 +681,117 @@ def _relationship_query(
         '{}_object_pk'.format(object_2_velcro_type): object_2.pk,
     }
 
-def add_related_content(object_1, object_2):
+def _truncated_label_ends_with(label, suffix):
+    """
+    Return whether an 'order_by' label that was cut off at
+    'ORDER_BY_MAX_LENGTH' characters ends with as much of 'suffix' (a
+    separator and an endpoint label) as fits in it. The label of the other
+    end, before the first separator, is assumed not to contain one.
+    """
+    if len(label) < ORDER_BY_MAX_LENGTH:
+        return False
+    i = label.find(RELATIONSHIP_LABEL_SEPARATOR)
+    if i == -1:
+        # Nothing of the suffix fits
+        return True
+    return label[i:] == suffix[:len(label) - i]
+
+def _update_order_by_labels(
+        relationship_class, rows, objects=None, using=None):
+    """
+    Recompute the 'order_by' labels for a list of relationship rows and
+    write the ones that changed with a single bulk UPDATE per batch.
+
+    Each row is a tuple of '(pk, content_type_1, object_pk_1, content_type_2,
+    object_pk_2, order_by)', with ends ordered as in 'velcro_fields'.
+    Objects that are already loaded can be passed in 'objects', a dict keyed
+    by '(content_type_id, object_pk)'; the rest are fetched in bulk.
+
+    Returns the number of labels updated.
+    """
+    rows = list(rows)
+    objects = dict(objects or {})
+    keys = set()
+    for pk, ct_1_id, pk_1, ct_2_id, pk_2, order_by in rows:
+        keys.update(((ct_1_id, pk_1), (ct_2_id, pk_2)))
+    objects.update(_hydrate(keys.difference(objects)))
+
+    labels = []
+    for pk, ct_1_id, pk_1, ct_2_id, pk_2, order_by in rows:
+        object_1 = objects.get((ct_1_id, pk_1))
+        object_2 = objects.get((ct_2_id, pk_2))
+        if object_1 is None or object_2 is None:
+            continue
+        label = format_relationship_label(
+            ContentType.objects.get_for_id(ct_1_id), object_1,
+            ContentType.objects.get_for_id(ct_2_id), object_2,
+        )[:ORDER_BY_MAX_LENGTH]
+        if label != order_by:
+            labels.append((pk, label))
+
+    for i in range(0, len(labels), BULK_BATCH_SIZE):
+        batch = labels[i:i + BULK_BATCH_SIZE]
+        relationship_class.objects.db_manager(using).filter(
+            pk__in=[pk for pk, label in batch]).update(
+            order_by=models.Case(
+                *[models.When(pk=pk, then=models.Value(label))
+                  for pk, label in batch],
+                output_field=models.CharField()))
+
+    return len(labels)
+
+def add_generic_relations(model, velcro_type):
+    """
+    Add a 'GenericRelation' field to a velcro-managed model for each side of
+    each relationship model that can hold it, so the ORM can see its
+    relationships: 'prefetch_related()', joins in 'filter()' and cascade
+    deletion of relationships when the object is deleted all work natively.
+
+    Fields are named 'velcro_<related_type>_links'. For relationships with
+    matching velcro types, the second side is
+    'velcro_<velcro_type>_reverse_links'. Existing attributes with the same
+    names are left alone.
+
+    Usage:
+        Data.objects.prefetch_related(
+            'velcro_publication_links__publication_content_object')
+        Data.objects.filter(
+            velcro_publication_links__publication_object_pk=publication.pk)
+
+    Joins and cascade deletes need relationship tables in the same database
+    as the models, so disable this when 'VELCRO_DATABASE' is a separate
+    database.
+
+    This is done at startup for all velcro-managed models. To disable it,
+    add to 'settings.py':
+
+        VELCRO_GENERIC_RELATIONS = False
+    """
+    for related_type in get_related_types(velcro_type):
+        relationship_class = get_relationship_class(velcro_type, related_type)
+        orientations = _endpoint_orientations(relationship_class, velcro_type)
+        names = ['velcro_{}_links'.format(related_type),
+                 'velcro_{}_reverse_links'.format(related_type)]
+
+        for name, ((ct_field, pk_field), _) in zip(names, orientations):
+            if hasattr(model, name):
+                continue
+            model.add_to_class(name, GenericRelation(
+                relationship_class,
+                content_type_field=ct_field,
+                object_id_field=pk_field,
+            ))
+
+@velcro_trace
+def add_related_content(object_1, object_2, using=None):
     """
     Get or create a relationship between two objects.
 
     Returns the relationship object and a boolean indicating whether
     the relationship was created.
+
+    Use the 'using' argument to write to a specific database instead of the
+    one chosen by the database router.
     """
     object_1_velcro_type = get_velcro_type(object_1)
     object_2_velcro_type = get_velcro_type(object_2)
@@ -162,6 +802,7 @@ def add_related_content(object_1, object_2):
         'object_2': object_2,
         'object_1_velcro_type': object_1_velcro_type,
         'object_2_velcro_type': object_2_velcro_type,
+        'using': using,
     }
 
     if object_1_velcro_type == object_2_velcro_type:
@@ -169,6 +810,116 @@ def add_related_content(object_1, object_2):
     else:
         return _add_or_remove_related_content_difftype(**kwargs)
 
+@velcro_trace
+def bulk_add_related_content(objects, target, using=None):
+    """
+    Relate each of a list (or QuerySet) of objects to a target object,
+    skipping objects that are already related to it. Relationships are
+    inserted in batches with 'bulk_create()' in one transaction.
+
+    Returns the number of relationships created.
+
+    Usage:
+        bulk_add_related_content(DataSet.objects.filter(pk__in=pks), pub)
+    """
+    return _bulk_add_or_remove_related_content(
+        objects, target, 'add', using=using)
+
+@velcro_trace
+def bulk_remove_related_content(objects, target, using=None):
+    """
+    Delete the relationships between each of a list (or QuerySet) of
+    objects and a target object, with batched DELETEs in one transaction.
+
+    Returns the number of relationships deleted.
+    """
+    return _bulk_add_or_remove_related_content(
+        objects, target, 'remove', using=using)
+
+def filter_related(queryset, all_of=(), any_of=(), none_of=(), using=None):
+    """
+    Filter a QuerySet of velcro-managed objects with a set expression over
+    their relationships: keep objects related to every object in 'all_of',
+    to at least one object in 'any_of' and to none of the objects in
+    'none_of'. Objects may be of any related type.
+
+    The whole expression is compiled into a single SQL query: 'all_of'
+    intersects one 'pk IN (...)' subquery per object, 'any_of' unions one
+    subquery per relationship table, and 'none_of' excludes them with
+    'NOT IN'. The result is a lazy QuerySet.
+
+    This is available as 'velcro_related()' on managers and QuerySets that
+    opt in with 'django_velcro.managers.VelcroManagerMixin',
+    'VelcroManager' or 'VelcroQuerySet'.
+
+    Usage:
+        # Publications related to data_set and scientist but not project
+        Publication.objects.velcro_related(
+            all_of=[data_set, scientist], none_of=[project])
+
+        # Publications related to either scientist
+        Publication.objects.velcro_related(any_of=[scientist_1, scientist_2])
+    """
+    queries = [
+        _related_to_q(queryset, [obj], using=using) for obj in all_of]
+    if any_of:
+        queries.append(_related_to_q(queryset, any_of, using=using))
+    if queries:
+        queryset = queryset.filter(*queries)
+    if none_of:
+        queryset = queryset.exclude(
+            _related_to_q(queryset, none_of, using=using))
+    return queryset
+
+def filter_related_to(queryset, obj, using=None):
+    """
+    Filter a QuerySet of velcro-managed objects down to the ones related to
+    an object. The result is a lazy QuerySet built from a subquery over the
+    relationship table, so related content can be filtered, annotated,
+    ordered and paginated in the database.
+
+    This is available as 'velcro_related_to()' on managers and QuerySets
+    that opt in with 'django_velcro.managers.VelcroManagerMixin',
+    'VelcroManager' or 'VelcroQuerySet'.
+
+    Usage:
+        data_set = DataSet.objects.first()
+        Publication.objects.velcro_related_to(data_set).filter(
+            year__gte=2010).order_by('-year')[:20]
+        filter_related_to(Publication.objects.filter(year=2015), data_set)
+    """
+    return queryset.filter(_related_to_q(queryset, [obj], using=using))
+
+def get_cached_related_content(obj, velcro_type=None):
+    """
+    Return the cached related content of an object, computing and caching it
+    first on a cache miss. The result is a dict mapping each related type to
+    a dict with:
+      - 'keys': '(content_type_id, object_pk)' pairs of related content, in
+        'order_by' order
+      - 'count': the number of related objects
+      - 'values': 'RelatedValues' named tuples with labels and URLs
+
+    Entries are stored in the 'VELCRO_CACHE' cache under the object's
+    relationship version, so they are replaced whenever its relationships
+    change. Once enabled, 'get_related_content()', 'has_related_content()'
+    and the JSON view read related content from this cache when no database
+    alias is given. Use the 'velcrowarm' management command to fill the
+    cache for hot objects after a deploy.
+
+    To enable the cache, add to 'settings.py':
+
+        VELCRO_RELATED_CACHE = True
+        VELCRO_RELATED_CACHE_TIMEOUT = 3600  # seconds (default)
+    """
+    content_type = ContentType.objects.get_for_model(obj)
+    version, _ = _get_relationship_version(content_type.pk, obj.pk)
+    related = caches[VELCRO_CACHE].get(
+        _related_cache_key(content_type.pk, obj.pk, version))
+    if related is None:
+        related = warm_related_content([obj], velcro_type)[obj.pk]
+    return related
+
 def get_all_velcro_types():
     """
     Return a list of all velcro types defined in 'settings.VELCRO_METADATA'.
@@ -208,57 +959,194 @@ def get_or_validate_related_types(velcro_type, related_types=None):
 
 def _get_related_content_difftype(
         obj, velcro_type, related_type, content_type, relationship_class,
-        limit):
+        limit, using, objects=None):
     """
     Get related content for a related type that differs from the query object's
-    type.
+    type. Related objects are fetched with one query per content type,
+    however many there are, unless they are given in 'objects', a dict
+    keyed by '(content_type_id, object_pk)'.
     """
-    query = {
-        '{}_object_pk'.format(velcro_type): obj.pk,
-        '{}_content_type'.format(velcro_type): content_type,
-    }
-    relationships = relationship_class.objects.filter(**query)[:limit]
-    related_content_object = '{}_content_object'.format(related_type)
+    if objects is None:
+        objects = _hydrate(_get_related_keys(
+            obj, velcro_type, related_type, content_type, relationship_class,
+            limit, using))
 
-    return [
-        getattr(related, related_content_object) for related in
-        sorted(relationships, key=lambda x: (
-            type(getattr(x, related_content_object)).__name__.lower(),
-            getattr(x, related_content_object).__str__().lower()))
-    ]
+    return sorted(objects.values(), key=lambda x: (
+        type(x).__name__.lower(), x.__str__().lower()))
 
 def _get_related_content_sametype(
-        obj, content_type, relationship_class, limit):
+        obj, velcro_type, content_type, relationship_class, limit, using,
+        objects=None):
     """
     Get related content for a related type that matches the query object's
-    type.
+    type. Related objects are fetched with one query per content type,
+    however many there are, unless they are given in 'objects', a dict
+    keyed by '(content_type_id, object_pk)'.
     """
-    query = models.Q(
-        content_type_1=content_type,
-        object_pk_1=obj.pk,
-    ) | models.Q(
-        content_type_2=content_type,
-        object_pk_2=obj.pk,
-    )
+    if objects is None:
+        objects = _hydrate(_get_related_keys(
+            obj, velcro_type, velcro_type, content_type, relationship_class,
+            limit, using))
 
-    related_content = []
-    relationships = [
-        (r.content_object_1, r.content_object_2)
-        for r in relationship_class.objects.filter(query)[:limit]
+    return sorted(objects.values(),
+        key=lambda x: (type(x).__name__.lower(), x.__str__()))
+
+def _get_related_keys(
+        obj, velcro_type, related_type, content_type, relationship_class,
+        limit, using, offset=0):
+    """
+    Get '(content_type_id, object_pk)' pairs of related content for a related
+    type, without fetching the related objects. If no database alias is
+    given, pairs come from the relationship graph snapshot or the related
+    content cache instead of the database, if either is enabled.
+    """
+    stop = None if limit is None else offset + limit
+    graph = get_graph() if using is None else None
+    if graph is not None:
+        return graph.neighbours(
+            relationship_class, velcro_type,
+            (content_type.pk, obj.pk))[offset:stop]
+    if using is None and VELCRO_RELATED_CACHE:
+        return get_cached_related_content(obj, velcro_type)[related_type][
+            'keys'][offset:stop]
+
+    query = _endpoint_query(
+        relationship_class, velcro_type, content_type, obj.pk)
+    rows = relationship_class.objects.db_manager(using).filter(
+        query).values_list(
+        *_endpoint_attnames(relationship_class))[offset:stop]
+
+    object_key = (content_type.pk, obj.pk)
+    return [
+        _other_end(relationship_class, velcro_type, object_key,
+                   ((ct_1_id, pk_1), (ct_2_id, pk_2)))
+        for ct_1_id, pk_1, ct_2_id, pk_2 in rows
     ]
 
-    for relationship in relationships:
-        if relationship.index(obj) == 0:
-            related_content.append(relationship[1])
+def _get_related_keys_union(
+        obj, velcro_type, related_types, content_type, limit, using):
+    """
+    Get '(content_type_id, object_pk)' pairs of related content for several
+    related types with a single 'UNION ALL' query across their relationship
+    tables, instead of one query per related type. Each branch of the query
+    projects a branch number (standing in for the related type), the
+    content type id and pk at the other end and the 'order_by' label, and
+    is limited to 'limit' rows on its own. For relationships with matching
+    velcro types, 'CASE' expressions pick whichever end isn't the object.
+
+    Returns a dict mapping each related type to its pairs, in 'order_by'
+    order, or 'None' if the pairs should come from the relationship graph
+    snapshot or the related content cache, or if the relationship tables
+    are not all in the same database.
+    """
+    if using is None and (VELCRO_RELATED_CACHE or get_graph() is not None):
+        return None
+
+    relationship_classes = [
+        get_relationship_class(velcro_type, rt) for rt in related_types]
+    databases = {
+        using or router.db_for_read(relationship_class)
+        for relationship_class in relationship_classes
+    }
+    if len(databases) != 1:
+        return None
+    connection = connections[databases.pop()]
+
+    branches = []
+    params = []
+    for i, relationship_class in enumerate(relationship_classes):
+        column = partial(_quoted_column, relationship_class, connection)
+        orientations = _endpoint_orientations(relationship_class, velcro_type)
+        conditions = [
+            '({} = %s AND {} = %s)'.format(column(ct_field), column(pk_field))
+            for (ct_field, pk_field), _ in orientations
+        ]
+
+        if len(orientations) == 1:
+            (_, (other_ct_field, other_pk_field)), = orientations
+            other_ct = column(other_ct_field)
+            other_pk = column(other_pk_field)
         else:
-            related_content.append(relationship[0])
-
-    return sorted(
-        related_content, key=lambda x: (type(x).__name__.lower(), x.__str__()))
-
+            (own_ct_field, own_pk_field), (other_ct_field, other_pk_field) = (
+                orientations[0])
+            case = 'CASE WHEN {} THEN {{}} ELSE {{}} END'.format(conditions[0])
+            other_ct = case.format(
+                column(other_ct_field), column(own_ct_field))
+            other_pk = case.format(
+                column(other_pk_field), column(own_pk_field))
+            params.extend([content_type.pk, obj.pk] * 2)
+
+        branch = (
+            'SELECT {} AS velcro_branch, {} AS content_type_id, '
+            '{} AS object_pk, {} AS label FROM {} WHERE {}'.format(
+                i, other_ct, other_pk, column('order_by'),
+                connection.ops.quote_name(relationship_class._meta.db_table),
+                ' OR '.join(conditions)))
+        params.extend([content_type.pk, obj.pk] * len(orientations))
+
+        if limit is not None:
+            branch = 'SELECT * FROM ({} ORDER BY {} LIMIT {}) {}'.format(
+                branch, column('order_by'), int(limit), 'velcro_{}'.format(i))
+        branches.append(branch)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '{} ORDER BY 1, 4'.format(' UNION ALL '.join(branches)), params)
+        rows = cursor.fetchall()
+
+    keys = OrderedDict((rt, []) for rt in related_types)
+    for branch, content_type_id, object_pk, label in rows:
+        keys[related_types[branch]].append((content_type_id, object_pk))
+    return keys
+
+def _get_related_values(keys, related_type):
+    """
+    Given '(content_type_id, object_pk)' pairs of related content, return a
+    sorted list of 'RelatedValues' named tuples. Each related model is
+    queried once with 'values()', selecting only its 'label_fields' and
+    'url_args', so no model instances are created.
+    """
+    pks_by_content_type = defaultdict(set)
+    for content_type_id, object_pk in keys:
+        pks_by_content_type[content_type_id].add(object_pk)
+
+    related_values = []
+    for content_type_id, object_pks in pks_by_content_type.items():
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        model = content_type.model_class()
+        if model is None:
+            continue
+
+        model_metadata = _find_dict_in_list(
+            VELCRO_METADATA[related_type]['apps'], 'model', model.__name__)
+        label_fields = model_metadata.get('label_fields', [])
+        url_args = model_metadata['url_args']
+        fields = ['pk']
+        for field in label_fields + url_args:
+            if field not in fields:
+                fields.append(field)
+
+        object_pks = sorted(object_pks)
+        for i in range(0, len(object_pks), BULK_BATCH_SIZE):
+            batch = object_pks[i:i + BULK_BATCH_SIZE]
+            for row in model._base_manager.filter(pk__in=batch).values(
+                    *fields):
+                if label_fields:
+                    label = ' '.join(
+                        str(row[field]) for field in label_fields)
+                else:
+                    label = None
+                url = reverse(model_metadata['view'],
+                    args=[row[arg] for arg in url_args])
+                related_values.append(RelatedValues(
+                    related_type, content_type, row['pk'], label, url))
+
+    return sorted(related_values, key=_related_values_sort_key)
+
+@velcro_trace
 def get_related_content(
-        obj, *related_types, grouped=True, limit=None, velcro_type=None,
-        verbose=False):
+        obj, *related_types, grouped=True, limit=None, using=None,
+        values=False, velcro_type=None, verbose=False):
     """
     Return a dictionary of related content (of given related type(s)) for an
     object. Each key is a related type and its value is a list of related
@@ -270,6 +1158,33 @@ def get_related_content(
     Related content queries can be restricted using the 'limit' argument.
     For example, 'limit=500' restricts results to 500 objects per related type.
 
+    Relationships are read from the database chosen by the database router,
+    unless a database alias is given with the 'using' argument.
+
+    For callers that only need labels and URLs (e.g., JSON endpoints or
+    sitemaps), use 'values=True' to get 'RelatedValues(velcro_type,
+    content_type, pk, label, url)' named tuples instead of model instances.
+    These are built with one 'values()' query per related model that selects
+    only the fields listed in the model's 'label_fields' and 'url_args'
+    metadata, or read from the related content cache if it is enabled (see
+    'get_cached_related_content()'). Labels join the 'label_fields' values
+    with spaces and are 'None' for models without 'label_fields':
+
+        # settings.py:
+        VELCRO_METADATA = {
+            'publication': {
+                'apps': [
+                    {
+                        'app_label': 'publication',
+                        'model': 'Publication',
+                        'view': 'publications:publication-detail',
+                        'url_args': ['pk'],
+                        'label_fields': ['title'],
+                    },
+                ],
+            },
+        }
+
     Usage:
         from data.models import Data
         data_set = DataSet.objects.first()
@@ -282,25 +1197,52 @@ def get_related_content(
 
     related_types = get_or_validate_related_types(velcro_type, related_types)
     related_content = {}
+    content_type = ContentType.objects.get_for_model(obj)
+
+    cached = None
+    if values and limit is None and using is None and VELCRO_RELATED_CACHE:
+        cached = get_cached_related_content(obj, velcro_type)
+
+    # With several related types, fetch all relationships in one query and
+    # all related objects in one batch per model
+    keys = objects = None
+    if cached is None and len(related_types) > 1:
+        keys = _get_related_keys_union(
+            obj, velcro_type, related_types, content_type, limit, using)
+    if keys is not None and not values:
+        objects = _hydrate(key for rt in keys for key in keys[rt])
 
     for rt in related_types:
         relationship_class = get_relationship_class(velcro_type, rt)
 
-        content_type = ContentType.objects.get_for_model(obj)
-
         kwargs = {
             'content_type': content_type,
             'limit': limit,
             'obj': obj,
             'relationship_class': relationship_class,
+            'using': using,
         }
 
         rt_raw = rt
         if verbose:
             rt = plural_velcro_type(rt)
 
-        if velcro_type == rt_raw:
-            related_content[rt] = _get_related_content_sametype(**kwargs)
+        if objects is not None:
+            kwargs['objects'] = {
+                key: objects[key] for key in keys[rt_raw] if key in objects}
+
+        if cached is not None:
+            related_content[rt] = list(cached[rt_raw]['values'])
+        elif values and keys is not None:
+            related_content[rt] = _get_related_values(keys[rt_raw], rt_raw)
+        elif values:
+            related_content[rt] = _get_related_values(
+                _get_related_keys(
+                    velcro_type=velcro_type, related_type=rt_raw, **kwargs),
+                rt_raw)
+        elif velcro_type == rt_raw:
+            related_content[rt] = _get_related_content_sametype(
+                velcro_type=velcro_type, **kwargs)
         else:
             related_content[rt] = _get_related_content_difftype(
                 velcro_type=velcro_type, related_type=rt_raw, **kwargs)
@@ -314,7 +1256,9 @@ def get_related_content(
         related_list = list(related_dict.values())
         return [item for sublist in related_list for item in sublist]
 
-def get_related_content_sametype(obj, *related_types, velcro_type=None):
+@velcro_trace
+def get_related_content_sametype(
+        obj, *related_types, using=None, velcro_type=None):
     """
     Return a list of related content for an object of the same velcro type as
     that object. This related content of the same type is retrieved indirectly
@@ -332,22 +1276,43 @@ def get_related_content_sametype(obj, *related_types, velcro_type=None):
         velcro_type = get_velcro_type(obj)
 
     related_types = get_or_validate_related_types(velcro_type, related_types)
-    related_content_sametype = []
-
-    for related_type, related_objects in get_related_content(
-            obj, *related_types, velcro_type=velcro_type).items():
-
-        for r in related_objects:
-            related_content_sametype.extend(
-                get_related_content(
-                    r, velcro_type, velcro_type=related_type)[velcro_type])
-
-    related_content_sametype = list(set(related_content_sametype))
-
-    if related_content_sametype:
-        related_content_sametype.remove(obj)
+    content_type = ContentType.objects.get_for_model(obj)
+    object_key = (content_type.pk, obj.pk)
+    graph = get_graph() if using is None else None
+    keys = set()
 
-    return sorted(related_content_sametype,
+    for rt in related_types:
+        relationship_class = get_relationship_class(velcro_type, rt)
+        manager = relationship_class.objects.db_manager(using)
+        related_keys = _get_related_keys(
+            obj, velcro_type, rt, content_type, relationship_class, None,
+            using)
+
+        if graph is not None:
+            for related_key in related_keys:
+                keys.update(
+                    graph.neighbours(relationship_class, rt, related_key))
+            continue
+
+        # Objects related to 'obj', grouped by content type
+        pks_by_content_type = defaultdict(list)
+        for related_key in related_keys:
+            pks_by_content_type[related_key[0]].append(related_key[1])
+
+        # Objects of the query object's type related to any of them
+        for (own_ct, own_pk), (other_ct, other_pk) in _endpoint_orientations(
+                relationship_class, rt):
+            for content_type_id, object_pks in pks_by_content_type.items():
+                for i in range(0, len(object_pks), BULK_BATCH_SIZE):
+                    keys.update(manager.filter(**{
+                        own_ct: content_type_id,
+                        '{}__in'.format(own_pk):
+                            object_pks[i:i + BULK_BATCH_SIZE],
+                    }).order_by().values_list(other_ct, other_pk).distinct())
+
+    keys.discard(object_key)
+
+    return sorted(_hydrate(keys).values(),
         key=lambda x: (type(x).__name__.lower(), x.__str__().lower()))
 
 def get_related_types(velcro_type):
@@ -370,6 +1335,37 @@ def get_relationship_class(object_1_velcro_type, object_2_velcro_type):
                  object_2_velcro_type.capitalize())))
     return apps.get_model(__package__, relationship_class_name)
 
+def get_relationship_changes(after=0, limit=1000, using=None):
+    """
+    Return a list of up to 'limit' entries from the relationship change log
+    with sequence numbers greater than 'after', in sequence order. Pass the
+    'seq' of the last entry received as 'after' to read the next batch.
+
+    Sequence numbers are assigned when entries are inserted, so an entry of
+    a long-running transaction can become visible after entries with
+    higher numbers. Consumers that need every entry should re-read a window
+    of recent sequence numbers.
+
+    Usage:
+        after = 0
+        while True:
+            changes = get_relationship_changes(after=after)
+            if not changes:
+                break
+            for change in changes:
+                sync(change)
+            after = changes[-1].seq
+    """
+    return list(
+        RelationshipChange.objects.db_manager(using).filter(
+            seq__gt=after).order_by('seq')[:limit])
+
+def get_relationship_classes():
+    """
+    Return a list of all generated relationship classes.
+    """
+    return [get_relationship_class(*r) for r in VELCRO_RELATIONSHIPS]
+
 def get_relationship_inlines(velcro_type, related_types=None):
     """
     Given a velcro type and, optionally, a list of related types, import
@@ -386,17 +1382,146 @@ def get_relationship_inlines(velcro_type, related_types=None):
         globals()[inline_class_name] = inline_class
         inlines.append(inline_class)
 
-        if velcro_type == related:
-            inline_class_name = '{}To{}RelationshipReverseInline'.format(
-                velcro_type.capitalize(), related.capitalize())
-            inline_class = getattr(
-                import_module(
-                    '.admin', package=__package__), inline_class_name)
-            globals()[inline_class_name] = inline_class
-            inlines.append(inline_class)
-
     return inlines
 
+def _get_similar_content_precomputed(obj, top_k, using):
+    """
+    Get similar content for an object from the precomputed similar content
+    table.
+    """
+    similar_content_class = apps.get_model(__package__, 'SimilarContent')
+    scores = [
+        ((ct_id, object_pk), score)
+        for ct_id, object_pk, score in
+        similar_content_class.objects.db_manager(using).filter(
+            content_type=ContentType.objects.get_for_model(obj),
+            object_pk=obj.pk,
+        ).values_list(
+            'similar_content_type', 'similar_object_pk', 'score')[:top_k]
+    ]
+
+    objects = _hydrate(key for key, score in scores)
+    return [
+        (objects[key], score) for key, score in scores if key in objects]
+
+def get_relationship_version(obj):
+    """
+    Return a '(version, last_modified)' tuple for an object's relationships.
+    The version is an opaque string that changes whenever a relationship
+    of the object is added, changed or removed, or when a related object's
+    label changes, and 'last_modified' is the time of that change.
+
+    Versions are only kept if 'VELCRO_RELATIONSHIP_VERSIONS' (or
+    'VELCRO_RELATED_CACHE') is enabled. They are stored in the
+    'VELCRO_CACHE' cache (default: 'default'), which must be shared by all
+    processes, e.g. memcached, for versions to agree between them.
+
+    Usage (e.g., for an ETag):
+        version, last_modified = get_relationship_version(data_set)
+    """
+    return _get_relationship_version(
+        ContentType.objects.get_for_model(obj).pk, obj.pk)
+
+@velcro_trace
+def get_similar_content(
+        obj, via=None, top_k=10, precomputed=False, using=None,
+        velcro_type=None):
+    """
+    Return a list of '(similar_object, score)' tuples for objects of the same
+    velcro type as an object, ranked by the number of related objects
+    ('intermediates') they share with it. By default, intermediates of all
+    related types are considered; use 'via' to restrict them to one related
+    type or a list of related types.
+
+    Shared-neighbour counts are computed in the database with a self-join of
+    each relevant relationship table and a 'GROUP BY', so only the 'top_k'
+    most similar objects are fetched.
+
+    With 'precomputed=True', scores are instead read from the table written
+    by the 'velcrosimilarity' management command. Precomputed scores reflect
+    the related types and similarity measure of the last run of that
+    command, so 'via' is ignored.
+
+    Usage:
+        data_set = DataSet.objects.first()
+        # via all related types
+        get_similar_content(data_set)
+        # via one related type
+        get_similar_content(data_set, via='scientist')
+        # via two related types
+        get_similar_content(data_set, via=['scientist', 'project'])
+    """
+    if precomputed:
+        return _get_similar_content_precomputed(obj, top_k, using)
+
+    if velcro_type is None:
+        velcro_type = get_velcro_type(obj)
+    if isinstance(via, str):
+        via = [via]
+
+    related_types = get_or_validate_related_types(velcro_type, via)
+    relationship_classes = [
+        get_relationship_class(velcro_type, rt) for rt in related_types]
+    if not relationship_classes:
+        return []
+
+    if using is None:
+        using = router.db_for_read(relationship_classes[0])
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    content_type = ContentType.objects.get_for_model(obj)
+
+    branches = []
+    params = []
+    for relationship_class in relationship_classes:
+        table = qn(relationship_class._meta.db_table)
+        column_1 = partial(
+            _quoted_column, relationship_class, connection, alias='r1')
+        column_2 = partial(
+            _quoted_column, relationship_class, connection, alias='r2')
+        orientations = _endpoint_orientations(relationship_class, velcro_type)
+        for (own_1, other_1) in orientations:
+            for (own_2, other_2) in orientations:
+                branches.append(
+                    'SELECT {similar_ct} AS similar_ct, '
+                    '{similar_pk} AS similar_pk, COUNT(*) AS score '
+                    'FROM {table} r1 INNER JOIN {table} r2 '
+                    'ON {other_ct_1} = {other_ct_2} '
+                    'AND {other_pk_1} = {other_pk_2} '
+                    'WHERE {own_ct_1} = %s AND {own_pk_1} = %s '
+                    'GROUP BY {similar_ct}, {similar_pk}'.format(
+                        table=table,
+                        similar_ct=column_2(own_2[0]),
+                        similar_pk=column_2(own_2[1]),
+                        other_ct_1=column_1(other_1[0]),
+                        other_pk_1=column_1(other_1[1]),
+                        other_ct_2=column_2(other_2[0]),
+                        other_pk_2=column_2(other_2[1]),
+                        own_ct_1=column_1(own_1[0]),
+                        own_pk_1=column_1(own_1[1]),
+                    ))
+                params.extend([content_type.pk, obj.pk])
+
+    sql = (
+        'SELECT similar_ct, similar_pk, SUM(score) AS total_score '
+        'FROM ({}) similar '
+        'WHERE NOT (similar_ct = %s AND similar_pk = %s) '
+        'GROUP BY similar_ct, similar_pk '
+        'ORDER BY total_score DESC, similar_ct, similar_pk '
+        'LIMIT %s'.format(' UNION ALL '.join(branches)))
+    params.extend([content_type.pk, obj.pk, top_k])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        scores = [
+            ((ct_id, object_pk), int(score))
+            for ct_id, object_pk, score in cursor.fetchall()
+        ]
+
+    objects = _hydrate(key for key, score in scores)
+    return [
+        (objects[key], score) for key, score in scores if key in objects]
+
 def get_url_of_object(obj, velcro_type=None):
     """
     Get the reverse URL for an object.
@@ -413,21 +1538,26 @@ def get_url_of_object(obj, velcro_type=None):
     url_args = model_metadata['url_args']
     return reverse(view, args=[getattr(obj, arg) for arg in url_args])
 
-def has_related_content(obj, *related_types, velcro_type=None):
+@velcro_trace
+def has_related_content(obj, *related_types, using=None, velcro_type=None):
     """
     Return Boolean True/False depending on whether object has related content.
+    At most one query is run per related type, and no related objects are
+    fetched.
     """
-    related_content = get_related_content(
-        obj, *related_types, limit=1, velcro_type=velcro_type)
+    if velcro_type is None:
+        velcro_type = get_velcro_type(obj)
 
-    has_related = False
+    related_types = get_or_validate_related_types(velcro_type, related_types)
+    content_type = ContentType.objects.get_for_model(obj)
 
-    for related_type, related_objects in related_content.items():
-        if related_objects:
-            has_related = True
-            break
+    for rt in related_types:
+        if _get_related_keys(
+                obj, velcro_type, rt, content_type,
+                get_relationship_class(velcro_type, rt), 1, using):
+            return True
 
-    return has_related
+    return False
 
 def is_valid_velcro_type(velcro_type):
     """
@@ -437,9 +1567,63 @@ def is_valid_velcro_type(velcro_type):
     if velcro_type in VELCRO_METADATA.keys():
         return True
 
-def remove_related_content(object_1, object_2):
+@velcro_trace
+def merge_related_content(source, target, using=None):
+    """
+    Move all relationships of 'source' to 'target', e.g. before deleting
+    'source' when two records turn out to be duplicates. Both objects must
+    have the same velcro type.
+
+    Relationship rows are repointed with bulk UPDATEs, one per relationship
+    table and end, and their labels are rewritten. Rows that would relate
+    'target' to itself, or duplicate a relationship 'target' already has,
+    are found in the database and deleted first. Everything happens in one
+    transaction per database. Raises 'ValueError' unless both objects are
+    velcro-managed objects of the same velcro type.
+
+    Returns a tuple of the numbers of relationships moved and deleted.
+
+    Usage:
+        merge_related_content(duplicate, data_set)
+        duplicate.delete()
+    """
+    velcro_type = get_velcro_type(source)
+    if velcro_type is None:
+        raise ValueError('{} is not managed by Django Velcro.'.format(source))
+    if get_velcro_type(target) != velcro_type:
+        raise ValueError("{} and {} don't have the same velcro type.".format(
+            source, target))
+
+    source_key = (ContentType.objects.get_for_model(source).pk, source.pk)
+    target_key = (ContentType.objects.get_for_model(target).pk, target.pk)
+    if source_key == target_key:
+        raise ValueError("{} can't be merged into itself.".format(source))
+
+    relationship_classes = OrderedDict()
+    for related_type in get_related_types(velcro_type):
+        relationship_class = get_relationship_class(velcro_type, related_type)
+        relationship_classes[relationship_class] = (
+            using or router.db_for_write(relationship_class))
+
+    moved = deleted = 0
+    with ExitStack() as stack:
+        for db in set(relationship_classes.values()):
+            stack.enter_context(graph_atomic(db))
+        for relationship_class, db in relationship_classes.items():
+            counts = _merge_relationships(
+                relationship_class, velcro_type, source_key, target_key, db)
+            moved += counts[0]
+            deleted += counts[1]
+
+    return moved, deleted
+
+@velcro_trace
+def remove_related_content(object_1, object_2, using=None):
     """
     Delete a relationship between two objects.
+
+    Use the 'using' argument to write to a specific database instead of the
+    one chosen by the database router.
     """
     object_1_velcro_type = get_velcro_type(object_1)
     object_2_velcro_type = get_velcro_type(object_2)
@@ -450,6 +1634,7 @@ def remove_related_content(object_1, object_2):
         'object_2': object_2,
         'object_1_velcro_type': object_1_velcro_type,
         'object_2_velcro_type': object_2_velcro_type,
+        'using': using,
     }
 
     if object_1_velcro_type == object_2_velcro_type:
@@ -469,6 +1654,76 @@ def plural_velcro_type(velcro_type):
 
     return(plural)
 
+@velcro_trace
+def set_related_content(
+        obj, related_type, objects, using=None, velcro_type=None):
+    """
+    Make 'objects' the complete list of related content of a related type
+    for an object.
+
+    The current relationships are read once and compared with the desired
+    ones, and only the missing relationships are inserted (with
+    'bulk_create()') and the unwanted ones deleted (with bulk DELETEs), all
+    in one transaction. Unchanged relationships are left alone.
+
+    Returns a tuple of the numbers of relationships added and removed.
+
+    Usage:
+        data_set = DataSet.objects.first()
+        set_related_content(data_set, 'publication', [pub_1, pub_2])
+        data_set.set_velcro_publication_content([pub_1, pub_2])
+    """
+    if velcro_type is None:
+        velcro_type = get_velcro_type(obj)
+    if related_type not in get_related_types(velcro_type):
+        raise ValueError("'{}' is not a related velcro type for '{}'.".format(
+            related_type, velcro_type))
+
+    relationship_class = get_relationship_class(velcro_type, related_type)
+    if using is None:
+        using = router.db_for_write(relationship_class)
+    content_type = ContentType.objects.get_for_model(obj)
+    object_key = (content_type.pk, obj.pk)
+
+    desired = OrderedDict()
+    for related in objects:
+        if get_velcro_type(related) != related_type:
+            raise ValueError("{} is not of velcro type '{}'.".format(
+                related, related_type))
+        key = (ContentType.objects.get_for_model(related).pk, related.pk)
+        if key == object_key:
+            raise ValueError("{} can't be related to itself.".format(obj))
+        desired[key] = related
+
+    with graph_atomic(using):
+        query = _endpoint_query(
+            relationship_class, velcro_type, content_type, obj.pk)
+        rows = (
+            relationship_class.objects.db_manager(using).filter(query)
+            .order_by().values_list(
+                'pk', *_endpoint_attnames(relationship_class)))
+        current = defaultdict(list)
+        for pk, ct_1_id, pk_1, ct_2_id, pk_2 in rows:
+            endpoints = ((ct_1_id, pk_1), (ct_2_id, pk_2))
+            current[_other_end(
+                relationship_class, velcro_type, object_key, endpoints)
+            ].append((pk, endpoints))
+
+        removed_rows = [
+            row for key, key_rows in current.items() if key not in desired
+            for row in key_rows
+        ]
+        added_objects = [
+            related for key, related in desired.items() if key not in current]
+
+        if removed_rows:
+            _bulk_delete_relationships(relationship_class, removed_rows, using)
+        if added_objects:
+            _bulk_create_relationships(
+                relationship_class, velcro_type, obj, added_objects, using)
+
+    return len(added_objects), len(removed_rows)
+
 def singular_velcro_type(velcro_type):
     """
     Take a velcro type and return the singular version of it.
@@ -481,6 +1736,86 @@ def singular_velcro_type(velcro_type):
 
     return(singular)
 
+def touch_relationship_versions(keys):
+    """
+    Give new relationship versions to the objects with the given
+    '(content_type_id, object_pk)' pairs, if relationship versions are kept.
+    """
+    if not _relationship_versions_enabled():
+        return
+
+    now = timezone.now()
+    caches[VELCRO_CACHE].set_many({
+        _relationship_version_key(*key): (uuid4().hex, now)
+        for key in set(keys)
+    }, None)
+
+@velcro_trace
+def update_related_order_by(obj, using=None, velcro_type=None):
+    """
+    Refresh the 'order_by' labels of all relationships that an object is
+    part of, e.g. after the object has been renamed. Rows whose labels
+    don't contain the object's current label are found with one query per
+    relationship table, so unchanged labels aren't read at all. Only those
+    rows are rewritten, with one bulk UPDATE per relationship table, and
+    the objects at the other end of those rows get new relationship
+    versions.
+
+    Rows are read from the database that relationships are written to (not
+    a replica, which may lag behind), unless a database alias is given.
+
+    Returns the number of labels updated.
+    """
+    if velcro_type is None:
+        velcro_type = get_velcro_type(obj)
+
+    content_type = ContentType.objects.get_for_model(obj)
+    endpoint_label = format_endpoint_label(content_type, obj)
+    # Labels are cut off at 'ORDER_BY_MAX_LENGTH', and so are prefixes
+    prefix = (endpoint_label + RELATIONSHIP_LABEL_SEPARATOR)[
+        :ORDER_BY_MAX_LENGTH]
+    suffix = RELATIONSHIP_LABEL_SEPARATOR + endpoint_label
+    object_key = (content_type.pk, obj.pk)
+    touched_keys = set()
+    updated = 0
+
+    for related_type in get_related_types(velcro_type):
+        relationship_class = get_relationship_class(velcro_type, related_type)
+        db = using or router.db_for_write(relationship_class)
+        first_end = relationship_class.velcro_fields[0][:2]
+        queries = []
+        for own, other in _endpoint_orientations(
+                relationship_class, velcro_type):
+            if own == first_end:
+                label_query = ~models.Q(order_by__startswith=prefix)
+            else:
+                label_query = ~models.Q(order_by__endswith=suffix)
+            queries.append(label_query & models.Q(
+                **{own[0]: content_type, own[1]: obj.pk}))
+        rows = relationship_class.objects.db_manager(db).filter(
+            reduce(operator.or_, queries)).order_by().values_list(
+            'pk', *(_endpoint_attnames(relationship_class) + ['order_by']))
+
+        stale_rows = []
+        for row in rows:
+            pk, ct_1_id, pk_1, ct_2_id, pk_2, order_by = row
+            if ((ct_1_id, pk_1) != object_key and
+                    _truncated_label_ends_with(order_by, suffix)):
+                continue
+            stale_rows.append(row)
+            touched_keys.update(((ct_1_id, pk_1), (ct_2_id, pk_2)))
+
+        if stale_rows:
+            updated += _update_order_by_labels(
+                relationship_class, stale_rows,
+                objects={object_key: obj}, using=db)
+
+    touched_keys.discard(object_key)
+    if touched_keys:
+        touch_relationship_versions(touched_keys)
+
+    return updated
+
 def validate_related_types(velcro_type, related_types):
     """
     Given a velcro type and a list of related types, return a list of the
@@ -507,5 +1842,73 @@ def validate_related_types(velcro_type, related_types):
 
     return valid_related_types
 
+def warm_related_content(objects, velcro_type=None):
+    """
+    Compute the related content of a list of objects of one model in bulk,
+    store it in the related content cache and return a dict mapping each
+    object's pk to its related content (see 'get_cached_related_content()').
+
+    Relationships are read with one query per related type (and orientation)
+    for every 500 objects, and labels and URLs with one 'values()' query per
+    related model, rather than per object. Relationship versions are read
+    from the cache with one 'get_many()'.
+    """
+    objects = list(objects)
+    if not objects:
+        return {}
+    if velcro_type is None:
+        velcro_type = get_velcro_type(objects[0])
+
+    content_type = ContentType.objects.get_for_model(objects[0])
+    pks = [obj.pk for obj in objects]
+    version_keys = {
+        pk: _relationship_version_key(content_type.pk, pk) for pk in pks}
+    cached_versions = caches[VELCRO_CACHE].get_many(version_keys.values())
+    versions = {}
+    for pk, key in version_keys.items():
+        version = cached_versions.get(key)
+        if version is None:
+            version = _get_relationship_version(content_type.pk, pk)
+        versions[pk] = version[0]
+    related = {pk: {} for pk in pks}
+
+    for rt in get_related_types(velcro_type):
+        relationship_class = get_relationship_class(velcro_type, rt)
+        rows_by_pk = defaultdict(list)
+        for (own_ct, own_pk), (other_ct, other_pk) in _endpoint_orientations(
+                relationship_class, velcro_type):
+            for i in range(0, len(pks), BULK_BATCH_SIZE):
+                rows = relationship_class.objects.filter(**{
+                    own_ct: content_type.pk,
+                    '{}__in'.format(own_pk): pks[i:i + BULK_BATCH_SIZE],
+                }).values_list(own_pk, other_ct, other_pk, 'order_by')
+                for pk, ct_id, object_pk, order_by in rows:
+                    rows_by_pk[pk].append((order_by, (ct_id, object_pk)))
+
+        values_by_key = {
+            (values.content_type.pk, values.pk): values
+            for values in _get_related_values(
+                {key for rows in rows_by_pk.values() for _, key in rows}, rt)
+        }
+
+        for pk in pks:
+            keys = [key for _, key in sorted(
+                rows_by_pk.get(pk, ()), key=lambda row: row[0])]
+            related[pk][rt] = {
+                'count': len(keys),
+                'keys': keys,
+                'values': sorted(
+                    (values_by_key[key] for key in keys
+                     if key in values_by_key),
+                    key=_related_values_sort_key),
+            }
+
+    caches[VELCRO_CACHE].set_many({
+        _related_cache_key(content_type.pk, pk, versions[pk]): related[pk]
+        for pk in pks
+    }, VELCRO_RELATED_CACHE_TIMEOUT)
+
+    return related
+
 
 _startup()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET
+
+from .utils import (_get_related_keys, _get_related_values,
+    _get_relationship_version, _relationship_versions_enabled,
+    get_related_types, get_relationship_class, get_velcro_type)
+
+
+def _get_model_or_404(app_label, model_name):
+    """
+    Return a velcro-managed model and its velcro type, or raise 'Http404'.
+    """
+    try:
+        model = apps.get_model(app_label, model_name)
+    except LookupError:
+        raise Http404('No model {}.{}.'.format(app_label, model_name))
+
+    velcro_type = get_velcro_type(model)
+    if velcro_type is None:
+        raise Http404('{}.{} is not managed by Django Velcro.'.format(
+            app_label, model_name))
+
+    return model, velcro_type
+
+def _get_version(request, app_label, model_name, pk):
+    """
+    Return the relationship version of the requested object, or 'None' if
+    relationship versions aren't kept. The version is stored on the request
+    so that it is only looked up once.
+    """
+    if not _relationship_versions_enabled():
+        return None
+
+    if not hasattr(request, '_velcro_version'):
+        model, velcro_type = _get_model_or_404(app_label, model_name)
+        request._velcro_version = _get_relationship_version(
+            ContentType.objects.get_for_model(model).pk, int(pk))
+    return request._velcro_version
+
+def _dumps(value):
+    """
+    Serialize a value to JSON.
+    """
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+def _stream_related_content(
+        obj, velcro_type, related_types, page, page_size):
+    """
+    Yield the JSON representation of an object's related content, one
+    related object at a time.
+    """
+    content_type = ContentType.objects.get_for_model(obj)
+    yield '{{"content_type": {}, "pk": {}, "related": {{'.format(
+        _dumps('{}.{}'.format(content_type.app_label, content_type.model)),
+        _dumps(obj.pk))
+
+    for i, related_type in enumerate(related_types):
+        if page_size is None:
+            offset, limit = 0, None
+        else:
+            offset, limit = (page - 1) * page_size, page_size + 1
+
+        related_keys = _get_related_keys(
+            obj=obj,
+            velcro_type=velcro_type,
+            related_type=related_type,
+            content_type=content_type,
+            relationship_class=get_relationship_class(
+                velcro_type, related_type),
+            limit=limit,
+            using=None,
+            offset=offset,
+        )
+        has_next = page_size is not None and len(related_keys) > page_size
+        if has_next:
+            related_keys = related_keys[:page_size]
+
+        yield '{}{}: {{"results": ['.format(
+            ', ' if i else '', _dumps(related_type))
+        for j, related in enumerate(
+                _get_related_values(related_keys, related_type)):
+            yield '{}{}'.format(', ' if j else '', _dumps({
+                'content_type': '{}.{}'.format(
+                    related.content_type.app_label,
+                    related.content_type.model),
+                'pk': related.pk,
+                'label': related.label,
+                'url': related.url,
+            }))
+        yield '], "page": {}, "has_next": {}}}'.format(
+            _dumps(page), _dumps(has_next))
+
+    yield '}}'
+
+def related_content_etag(request, app_label, model_name, pk):
+    """
+    Return an ETag for an object's related content. It changes with the
+    object's relationship version and the query string.
+    """
+    version = _get_version(request, app_label, model_name, pk)
+    if version is None:
+        return None
+    return hashlib.md5('{}?{}'.format(
+        version[0], request.GET.urlencode()).encode('utf-8')).hexdigest()
+
+def related_content_last_modified(request, app_label, model_name, pk):
+    """
+    Return the time an object's relationships last changed.
+    """
+    version = _get_version(request, app_label, model_name, pk)
+    if version is None:
+        return None
+    return version[1]
+
+@require_GET
+@condition(etag_func=related_content_etag,
+           last_modified_func=related_content_last_modified)
+def related_content_json(request, app_label, model_name, pk):
+    """
+    Stream the related content of a velcro-managed object as JSON.
+
+    Related content of all related types is returned unless one or more
+    'type' query parameters are given. Use 'page_size' (and 'page') to
+    paginate each related type separately. Each related object is
+    represented by its content type, pk, label and URL (see 'values=True'
+    in 'get_related_content()').
+
+    Unknown or unrelated types get a '400 Bad Request'.
+
+    If relationship versions are kept (see 'get_relationship_version()'),
+    responses carry ETag and Last-Modified headers derived from the
+    object's relationship version, so conditional requests get a '304 Not
+    Modified' without touching the relationship tables. Versions live in
+    the 'VELCRO_CACHE' cache, which must then be shared by all worker
+    processes (e.g. memcached, not the default local-memory cache), or
+    each worker hands out different validators. Otherwise responses are
+    always sent in full.
+
+    Example:
+        GET /velcro/data/dataset/1/?type=publication&page_size=20&page=2
+
+        {"content_type": "data.dataset", "pk": 1, "related": {
+            "publication": {"results": [{"content_type":
+                "publication.publication", "pk": 7, "label": "...",
+                "url": "/publications/7/"}, ...],
+                "page": 2, "has_next": true}}}
+    """
+    model, velcro_type = _get_model_or_404(app_label, model_name)
+
+    try:
+        page = int(request.GET.get('page', 1))
+        page_size = request.GET.get('page_size')
+        page_size = None if page_size is None else int(page_size)
+    except ValueError:
+        return HttpResponseBadRequest(
+            "'page' and 'page_size' must be integers.")
+    if page < 1 or (page_size is not None and page_size < 1):
+        return HttpResponseBadRequest(
+            "'page' and 'page_size' must be positive.")
+
+    related_types = get_related_types(velcro_type)
+    requested_types = request.GET.getlist('type')
+    for related_type in requested_types:
+        if related_type not in related_types:
+            return HttpResponseBadRequest(
+                "'{}' is not a related velcro type for '{}'.".format(
+                    related_type, velcro_type))
+    if requested_types:
+        related_types = list(OrderedDict.fromkeys(requested_types))
+
+    obj = get_object_or_404(model, pk=pk)
+
+    response = StreamingHttpResponse(
+        _stream_related_content(
+            obj, velcro_type, related_types, page, page_size),
+        content_type='application/json')
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    return response